@@ -0,0 +1,104 @@
+import os
+import tomli
+import gspread
+from google.oauth2.service_account import Credentials
+from sheets_quota import open_worksheet, BATCH
+from experiment_registry import ExperimentRegistry
+from event_stream import EventStream
+from keyword_rules import apply_rules
+from sheet_labels import annotator_columns
+from llm_metrics import MetricsStore
+from answer_format import answer_setup
+from resilient_calls import DeadLetterQueue, ResilientCaller
+from prompt_layout import prompts_from_script, print_cache_report
+from model_backends import make_backend
+from job_scheduler import JobScheduler, RATE_LIMITS, classification_job
+from openai import OpenAI
+import pandas as pd
+
+# --- Configurazione ---------------------------------------------------------
+# Tutti i task e tutti i modelli in un solo processo: lo scheduler tiene pieno il
+# limite di ogni modello, serve prima il test set e i modelli economici, e divide
+# la capacità tra i task. I prompt si leggono dagli script dei singoli classificatori
+# (che restano il posto dove modificarli e importano le vecchie colonne dello sheet).
+REGISTRY_PATH        = os.path.expanduser("~/Documents/Programmi Utili/Collegio Superiore/Linguistica/experiments.sqlite")
+USE_RULES            = True
+ANSWER_MODE          = "json"
+MODELS = [
+    "gpt-4.1",
+    "gpt-4.1-mini",
+    "gpt-4.1-nano",
+    "gpt-4o",
+    "gpt-4o-mini",
+]
+# (task, sheet, split, espressione, script con il prompt, costante, versione, classi, solo righe annotate)
+# un task per sheet: gli id delle frasi sono indici di riga, validi solo nel loro sheet
+JOBS = [
+    ("donna_disponibile_test", "test data donna disponibile", "test", "donna disponibile",
+     "Classifier Test data Donna disponibile.py", "SYSTEM_PROMPT", "mod", 4, False),
+    ("donna_disponibile", "Training_data_donna_disponibile", "train", "donna disponibile",
+     "classifier Training Data Donna Disponibile.py", "SYSTEM_PROMPT4", "mod4", 4, False),
+    ("donna_libera", "Training_data_donna_libera", "train", "donna libera",
+     "Classifier Training Data Donna libera.py", "SYSTEM_PROMPT", "mod", 6, True),
+]
+# peso del task nel fair share (2.0 = il doppio della capacità degli altri)
+TASK_WEIGHTS = {}
+PARAMS = {
+    "temperature": 0,
+    "max_tokens": 10,
+    "top_p": 1,
+    "response_format": {"type": "json_object"},
+}
+
+# --- Setup OpenAI e Google Sheets ------------------------------------------
+openai_api_key = os.getenv("OPENAI_API_KEY")
+if not openai_api_key:
+    raise RuntimeError("Devi esportare OPENAI_API_KEY nell'ambiente")
+client = OpenAI(api_key=openai_api_key, max_retries=0)  # i ritentativi li fa ResilientCaller
+
+scopes = ["https://www.googleapis.com/auth/spreadsheets",
+          "https://www.googleapis.com/auth/drive"]
+secrets_path = os.path.expanduser("~/Documents/Programmi Utili/Collegio Superiore/Linguistica/.streamlit/secrets.toml")
+with open(secrets_path, "rb") as f:
+    toml_data = tomli.load(f)
+creds = Credentials.from_service_account_info(toml_data["gcp_service_account"], scopes=scopes)
+gc = gspread.authorize(creds)
+
+# ogni etichetta va anche nello stream di eventi letto dalla dashboard live (app_live_agreement.py)
+registry = ExperimentRegistry(REGISTRY_PATH, events=EventStream())
+metrics = MetricsStore()
+dead_letter = DeadLetterQueue()
+caller = ResilientCaller(dead_letter)
+backends = {mdl: make_backend(mdl, client) for mdl in MODELS}
+# i backend in-process (sklearn) non hanno limiti di richieste
+rate_limits = {b.name: RATE_LIMITS.get(b.name, 1e9 if b.name.startswith("sklearn:") else 60)
+               for b in backends.values()}
+scheduler = JobScheduler(rate_limits, {b.name: b.concurrency for b in backends.values()})
+
+# --- Costruzione dei job ------------------------------------------------------
+for task, sheet, split, expression, script, constant, version, n_classes, only_annotated in JOBS:
+    values = open_worksheet(gc, sheet, BATCH).get_all_values()
+    header, all_rows = values[0], values[1:]
+    df = pd.DataFrame(all_rows, columns=header)
+    # solo gli annotatori: né i modelli (gpt-4_1, mod4_gpt-4o, ...) né best_human
+    annotation_cols = annotator_columns(header)
+    if only_annotated:
+        df = df[df[annotation_cols].apply(lambda c: c.str.strip() != "").any(axis=1)]
+    # niente regole sul test set: è il benchmark, tutte le frasi vanno ai modelli
+    skip = (apply_rules(registry, task, expression, pd.DataFrame(all_rows, columns=header),
+                        annotator_cols=annotation_cols) if USE_RULES and split != "test" else set())
+    dead_letter.clear_retryable(task)
+    prompt, params, run_version = answer_setup(ANSWER_MODE, prompts_from_script(script)[constant], PARAMS,
+                                               n_classes, version)
+    rows = list(zip(df["id"], df["sentence"]))
+    for mdl in MODELS:
+        blocked = dead_letter.permanent_ids(task, backends[mdl].name, run_version)
+        scheduler.add(classification_job(registry, metrics, caller, backends[mdl], task, rows, prompt, params,
+                                         run_version, n_classes, ANSWER_MODE, split, skip | blocked,
+                                         TASK_WEIGHTS.get(task, 1.0)))
+
+print(f"{len(scheduler.jobs)} job, {sum(j.total for j in scheduler.jobs)} chiamate da fare")
+print(scheduler.run().to_string())
+for task in sorted({job[0] for job in JOBS}):
+    print_cache_report(metrics, task)
+    dead_letter.print_summary(task)
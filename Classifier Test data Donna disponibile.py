@@ -1,16 +1,42 @@
-import re
-import json
-import time
 import os
 import tomli
 import gspread
 from google.oauth2.service_account import Credentials
+from sheets_quota import open_worksheet, BATCH
+from experiment_registry import ExperimentRegistry
+from event_stream import EventStream
+from keyword_rules import apply_rules
+from llm_metrics import MetricsStore
+from answer_format import answer_setup, parse_answer
+from functools import partial
+from hedged_requests import Hedger
+from resilient_calls import DeadLetterQueue, ResilientCaller, has_label
+from prompt_layout import PromptLayout, schedule, print_cache_report
+from model_backends import make_backend
 from openai import OpenAI
+import pandas as pd
 from tqdm import tqdm
 
 # --- Configurazione ---------------------------------------------------------
 # SERVICE_ACCOUNT_FILE = "/percorso/al/tuo/service_account.json"
 SHEET_NAME           = "test data donna disponibile"
+# il task identifica espressione e dataset: gli id sono indici di riga dello sheet,
+# quindi test e training non possono condividere i run (stesso prompt, stessi parametri)
+TASK                 = "donna_disponibile_test"
+REGISTRY_PATH        = os.path.expanduser("~/Documents/Programmi Utili/Collegio Superiore/Linguistica/experiments.sqlite")
+EXPRESSION           = "donna disponibile"
+# le frasi ovvie (regole con precisione ≥ 95% sulle annotazioni) non vanno ai modelli;
+# spento per il test set: è il benchmark, ogni frase deve avere la risposta dei modelli
+USE_RULES            = False
+# formato della risposta: "json" (storico, {"class": k}) oppure "digit"
+# (una sola cifra con logit_bias e max_tokens=1: meno token e latenza)
+ANSWER_MODE          = "json"
+# duplica una chiamata che non torna entro il p95 del modello (al massimo il 5% in più)
+HEDGE                = False
+# oltre ai modelli OpenAI: "local:<modello>@<url>" (server compatibile OpenAI,
+# es. llama.cpp) oppure "sklearn:<percorso .joblib>" (vedi model_backends.py).
+# Qui le frasi vanno una alla volta: concurrency e batch_size dei backend li usa
+# solo "Classifier Scheduler.py" (e model_backends.benchmark)
 MODELS = [
     "gpt-4.1",
     "gpt-4.1-mini",
@@ -31,6 +57,15 @@ Rispondi **ESCLUSIVAMENTE** con un JSON UTF-8 valido:
   "class": <numero intero tra 1 e 4>
 }
 """
+# parametri della chiamata: fanno parte dell'identità del run nel registro
+PARAMS = {
+    "temperature": 0,
+    "max_tokens": 10,
+    "top_p": 1,
+    "response_format": {"type": "json_object"},
+}
+# prompt, parametri e versione del run nella modalità di risposta scelta
+RUN_PROMPT, RUN_PARAMS, PROMPT_VERSION = answer_setup(ANSWER_MODE, SYSTEM_PROMPT, PARAMS, 4, "mod")
 
 
 
@@ -39,7 +74,7 @@ Rispondi **ESCLUSIVAMENTE** con un JSON UTF-8 valido:
 openai_api_key = os.getenv("OPENAI_API_KEY")
 if not openai_api_key:
     raise RuntimeError("Devi esportare OPENAI_API_KEY nell'ambiente")
-client = OpenAI(api_key=openai_api_key)
+client = OpenAI(api_key=openai_api_key, max_retries=0)  # i ritentativi li fa ResilientCaller
 
 # 2) Google Sheets client
 scopes = ["https://www.googleapis.com/auth/spreadsheets",
@@ -51,65 +86,71 @@ with open(secrets_path, "rb") as f:
 service_account_info = toml_data["gcp_service_account"]
 creds = Credentials.from_service_account_info(service_account_info, scopes=scopes)
 gc = gspread.authorize(creds)
-ws = gc.open(SHEET_NAME).sheet1
-
-# --- Prepara la colonna per ciascun modello --------------------------------
-
-header = ws.row_values(1)
-for mdl in MODELS:
-    base = mdl.replace(".", "_")
-    new_col = f"mod_{base}"
-    if new_col not in header:
-        header.append(new_col)
-        ws.update_cell(1, len(header), new_col)
-
+ws = open_worksheet(gc, SHEET_NAME, BATCH)
 
-# ricava nuovamente colonne e mappa nome→indice
-header = ws.row_values(1)
-col_index = {name: idx+1 for idx, name in enumerate(header)}
+# --- Registro degli esperimenti ---------------------------------------------
+# ogni (prompt, modello, parametri) è un run del registro: le predizioni non
+# finiscono più in nuove colonne mod_* dello sheet
+# ogni etichetta va anche nello stream di eventi letto dalla dashboard live (app_live_agreement.py)
+registry = ExperimentRegistry(REGISTRY_PATH, events=EventStream())
+metrics = MetricsStore()
+# un backend per modello, ciascuno con la sua concorrenza, i suoi batch e i suoi costi
+# (il nome del backend, con l'hash per i modelli sklearn, è il modello del run)
+backends = {mdl: make_backend(mdl, client) for mdl in MODELS}
+runs = {mdl: registry.get_or_create_run(TASK, RUN_PROMPT, backends[mdl].name, RUN_PARAMS, prompt_version=PROMPT_VERSION)
+        for mdl in MODELS}
+# prefisso statico byte-stabile per la cache dei prompt di OpenAI
+layout = PromptLayout(RUN_PROMPT, PROMPT_VERSION)
+layout.warn_if_short()
+hedger = Hedger() if HEDGE else None
+# ritentativi con backoff, dead-letter per gli elementi che falliscono, circuit breaker per modello
+dead_letter = DeadLetterQueue()
+caller = ResilientCaller(dead_letter)
 
 # --- Funzione di classificazione -------------------------------------------
-def classify_with_model(sentence: str, model_name: str) -> int:
-    resp = client.chat.completions.create(
-        model=model_name,
-        messages=[
-            {"role": "system",  "content": SYSTEM_PROMPT},
-            {"role": "user",    "content": sentence}
-        ],
-        temperature=0,
-        max_tokens=10,
-        top_p=1,
-        response_format={"type": "json_object"}
-    )
-    txt = resp.choices[0].message.content.strip()
-    m = re.search(r'"?class"?\s*[:=]\s*([1-4])', txt)
-    if m:
-        return int(m.group(1))
-    try:
-        return int(json.loads(txt)["class"])
-    except:
-        return None
+def classify_with_model(sentence: str, model_name: str, sentence_id=None):
+    # token, latenza e retry di ogni chiamata finiscono nello store delle metriche
+    with metrics.track(backends[model_name].name, TASK, layout.hash, sentence_id) as call:
+        resp = backends[model_name].complete(layout, sentence, RUN_PARAMS)
+        call.response(resp)
+        txt = resp.choices[0].message.content or ""
+        # validatore rigido: una classe valida o None (mai una classe inventata)
+        cls = parse_answer(txt, 4, ANSWER_MODE)
+        call.set_label(cls)
+    return cls, txt
 
-# --- Itera su tutte le frasi e riempi le colonne ----------------------------
-all_rows = ws.get_all_values()[1:]  # esclude header
+# --- Itera su tutte le frasi e registra le predizioni -----------------------
+values = ws.get_all_values()
+header, all_rows = values[0], values[1:]  # esclude header
 print(f"Totale frasi da processare: {len(all_rows)}")
 
-for row_idx, row in enumerate(tqdm(all_rows, desc="Classifying"), start=2):
-    # If pointer is beyond last index, we are done
-    if row_idx-2 >= len(all_rows):
-        print("Hai terminato tutte le frasi. Grazie!")
-        break
+# le vecchie colonne mod_* dello sheet vengono importate una volta nel registro
+registry.import_sheet_columns(TASK, pd.DataFrame(all_rows, columns=header), {"mod": SYSTEM_PROMPT}, PARAMS)
+done = {mdl: registry.done_ids(run) for mdl, run in runs.items()}
+rule_labelled = apply_rules(registry, TASK, EXPRESSION, pd.DataFrame(all_rows, columns=header)) if USE_RULES else set()
+
+# gli errori transitori del run precedente si ritentano, quelli permanenti no
+dead_letter.clear_retryable(TASK)
+blocked = {mdl: dead_letter.permanent_ids(TASK, mdl, PROMPT_VERSION) for mdl in MODELS}
+
+# a blocchi di frasi, un modello alla volta: stesso prefisso a ridosso (cache)
+for mdl, row in tqdm(schedule(all_rows, MODELS), total=len(all_rows) * len(MODELS), desc="Classifying"):
     sentence = row[header.index("sentence")]  # presuppone colonna "sentence"
-    # salta se già classificate (ad es. first model già presente)
-    first_model_col = f"mod_{MODELS[0].replace('.', '_')}"
-    if row[col_index[first_model_col]-1].strip():
+    sentence_id = row[header.index("id")]
+    # saltando le frasi già classificate in questo run
+    if sentence_id in done[mdl] or sentence_id in rule_labelled or sentence_id in blocked[mdl]:
+        continue
+    # run fermato dalla dashboard (accordo troppo basso): le frasi restanti si saltano
+    if registry.events.stopped(runs[mdl]):
         continue
+    attempt = classify_with_model if hedger is None else partial(hedger.call, mdl, classify_with_model)
+    result = caller.call(mdl, attempt, sentence, mdl, sentence_id=sentence_id, validate=has_label,
+                         item={"task": TASK, "model": mdl, "prompt_version": PROMPT_VERSION,
+                               "sentence_id": sentence_id})
+    if result is None:
+        continue  # in dead-letter: ritentata al prossimo run (mai, se l'errore è permanente)
+    cls, txt = result
+    registry.record(runs[mdl], sentence_id, cls, raw=txt)
 
-    # per ciascun modello
-    for mdl in MODELS:
-        base = mdl.replace(".", "_")
-        col_name = f"mod_{base}"
-        cls = classify_with_model(sentence, mdl)
-        # scrivi subito in cella (puoi anche accumulare e batch-aggiornare)
-        ws.update_cell(row_idx, col_index[col_name], str(cls))
-        time.sleep(0.3)  # per non superare rate limit
+print_cache_report(metrics, TASK)
+dead_letter.print_summary(TASK)
@@ -1,64 +1,71 @@
-import re
 import pandas as pd
 from difflib import get_close_matches
+from text_cleaning import load_concordance, normalized_key
+from corpus_index import CorpusIndex
+from splitting import (content_ids, load_ledger, append_ledger, seed_ledger,
+                       assign_splits, find_leaks)
 
-# Utility: normalizza spazi bianchi multipli e trimma
-def normalize(s: str) -> str:
-    # collapse multiple whitespace into single spaces and trim
-    return re.sub(r"\s+", " ", s).strip()
+BASE_DIR    = "/Users/Fabio/Documents/Programmi Utili/Collegio Superiore/Linguistica"
+LEDGER_PATH = f"{BASE_DIR}/splits_disponibile.csv"
+INDEX_PATH  = f"{BASE_DIR}/corpus_index.sqlite"
+SPLIT_FRACTIONS = {"train": 0.37, "test": 0.63}
 
-# --- 1. Carica e parsifica il file di concordanze --------------------------
-records = []
-with open("/Users/Fabio/Documents/Programmi Utili/Collegio Superiore/Linguistica/Disponibile_concordance_preloaded_trends_it_20250625092858.txt", "r", encoding="utf-8") as f:
-    for line in f:
-        line = line.strip()
-        if not line:
-            continue
-        # ogni riga è: YYYY-MM-DD | testo...
-        m = re.match(r'^(\d{4}-\d{2}-\d{2})\s*\|\s*(.+)$', line)
-        if m:
-            date_str, sentence = m.groups()
-            # rimuovi eventuali tag <s> e </coll>
-            sentence = re.sub(r"</?s>", " ", sentence)
-            sentence = re.sub(r"</?coll>", "", sentence)
-            records.append({
-                "date": date_str,
-                "sentence": sentence.strip()
-            })
+# --- 1. Carica, parsifica e pulisci il file di concordanze ------------------
+# (mojibake, markup <s>/<coll>, NFC e spazi in un unico passaggio vettoriale)
+df = load_concordance(f"{BASE_DIR}/Disponibile_concordance_preloaded_trends_it_20250625092858.txt")
+# rimuovi i duplicati (notizie ripubblicate) usando la chiave normalizzata
+df = df.drop_duplicates("key")
+df["content_id"] = content_ids(df["key"])
 
-df = pd.DataFrame(records)
-# df["date"] = pd.to_datetime(df["date"], errors="coerce")
+# indice di ricerca full-text/faccette: solo le frasi nuove vengono aggiunte
+added = CorpusIndex(INDEX_PATH).add_sentences(df, "donna disponibile")
+print(f"Frasi nuove nell'indice di ricerca: {added}")
 
-# --- 2. Suddividi in training (100 esempi) e restante ------------------------
-# campiona mantenendo gli indici originali
-train_df = df.sample(n=100, random_state=42)
-# test set = righe non campionate
-test_df  = df.drop(train_df.index)
+# --- 2. Assegna gli split da hash del content_id ----------------------------
+# le frasi già nel registro non si spostano mai; solo le nuove vengono assegnate
+ledger = load_ledger(LEDGER_PATH)
+if ledger.empty:
+    # primo avvio: parti dalle esportazioni già annotate
+    ledger = seed_ledger({"train": f"{BASE_DIR}/train_sentences_disponibile.csv",
+                          "test":  f"{BASE_DIR}/rest_sentences_disponibile.csv"})
+    append_ledger(ledger, LEDGER_PATH)
+new_rows = assign_splits(df, SPLIT_FRACTIONS, ledger, stratify_by_year=True)
+append_ledger(new_rows, LEDGER_PATH)
+print(f"Nuove frasi assegnate: {len(new_rows)}")
 
-# resetta gli indici dei DataFrame per l'export
-train_df = train_df.reset_index(drop=True)
-test_df  = test_df.reset_index(drop=True)
+ledger = pd.concat([ledger, new_rows], ignore_index=True)
+df = df.merge(ledger[["content_id", "split"]], on="content_id", how="inner")
+
+# controllo leakage: quasi-duplicati finiti in split diversi
+leaks = find_leaks(df)
+if not leaks.empty:
+    print(f"Attenzione: {len(leaks)} coppie di quasi-duplicati tra split diversi")
+    print(leaks[["split_a", "split_b", "similarity", "sentence_a"]].head(20).to_string())
+
+export_cols = ["date", "sentence", "content_id"]
+train_df = df.loc[df["split"] == "train", export_cols].reset_index(drop=True)
+test_df  = df.loc[df["split"] == "test", export_cols].reset_index(drop=True)
 
 # --- 3. Esporta su CSV ------------------------------------------------------
-train_df.to_csv("/Users/Fabio/Documents/Programmi Utili/Collegio Superiore/Linguistica/train_sentences_disponibile.csv",
+train_df.to_csv(f"{BASE_DIR}/train_sentences_disponibile.csv",
                 index=False, encoding="utf-8")
-test_df.to_csv("/Users/Fabio/Documents/Programmi Utili/Collegio Superiore/Linguistica/rest_sentences_disponibile.csv",
+test_df.to_csv(f"{BASE_DIR}/rest_sentences_disponibile.csv",
                index=False, encoding="utf-8")
 
 print(f"Training set: {len(train_df)} frasi salvate in train_sentences_disponibile.csv")
 print(f"Test set:     {len(test_df)} frasi salvate in rest_sentences_disponibile.csv")
 
 # --- 4. Verifica presenza delle frasi da diificult_train_sentences_disponibile.csv ---
-difficult_file = "/Users/Fabio/Documents/Programmi Utili/Collegio Superiore/Linguistica/diificult_train_sentences_disponibile.csv"
+difficult_file = f"{BASE_DIR}/diificult_train_sentences_disponibile.csv"
 try:
     diff_df = pd.read_csv(difficult_file, encoding="utf-8")
     if "sentence" in diff_df.columns:
         diff_sentences = diff_df["sentence"].astype(str)
     else:
         diff_sentences = diff_df.iloc[:, -1].astype(str)
-    # normalize whitespace in both sets
-    train_norm = [normalize(x) for x in train_df["sentence"].astype(str)]
-    diff_norm  = [normalize(x) for x in diff_sentences]
+    # stessa chiave normalizzata (mojibake, NFC, spazi, minuscole) per entrambi
+    train_norm = normalized_key(train_df["sentence"].astype(str)).tolist()
+    diff_norm  = normalized_key(diff_sentences).tolist()
     missing = set(diff_norm) - set(train_norm)
     if missing:
         print(f"Numero di frasi mancanti: {len(missing)}")
@@ -74,7 +81,7 @@ try:
     else:
         print("Tutte le frasi da 'diificult_train_sentences_disponibile.csv' sono presenti nel training set.")
     # --- Verifica se le frasi difficult compaiono nel test set -------------
-    test_norm = [normalize(x) for x in test_df["sentence"].astype(str)]
+    test_norm = normalized_key(test_df["sentence"].astype(str)).tolist()
     present_in_test = set(diff_norm) & set(test_norm)
     if present_in_test:
         print("\nLe seguenti frasi difficult sono presenti nel test set (normalized):")
@@ -1,39 +1,57 @@
-import re
 import pandas as pd
+from text_cleaning import load_concordance
+from corpus_index import CorpusIndex
+from splitting import (content_ids, load_ledger, append_ledger, seed_ledger,
+                       assign_splits, find_leaks)
 
-# --- 1. Carica e parsifica il file di concordanze --------------------------
-records = []
-with open("/Users/Fabio/Documents/Programmi Utili/Collegio Superiore/Linguistica/concordance_preloaded_trends_it_20250625112515.txt", "r", encoding="utf-8") as f:
-    for line in f:
-        line = line.strip()
-        if not line:
-            continue
-        # ogni riga è: YYYY-MM-DD | testo...
-        m = re.match(r'^(\d{4}-\d{2}-\d{2})\s*\|\s*(.+)$', line)
-        if m:
-            date_str, sentence = m.groups()
-            # rimuovi eventuali tag <coll> e </s>
-            sentence = re.sub(r"</?s>", " ", sentence)
-            sentence = re.sub(r"</?coll>", "", sentence)
-            records.append({
-                "date": date_str,
-                "sentence": sentence.strip()
-            })
-
-df = pd.DataFrame(records)
-# opzionale: ordina cronologicamente
+BASE_DIR    = "/Users/Fabio/Documents/Programmi Utili/Collegio Superiore/Linguistica"
+LEDGER_PATH = f"{BASE_DIR}/splits_libera.csv"
+INDEX_PATH  = f"{BASE_DIR}/corpus_index.sqlite"
+# frazione del corpus per split (il resto rimane nel pool non annotato)
+SPLIT_FRACTIONS = {"train": 0.05, "test": 0.20}
+
+# --- 1. Carica, parsifica e pulisci il file di concordanze ------------------
+# (mojibake, markup <s>/<coll>, NFC e spazi in un unico passaggio vettoriale)
+df = load_concordance(f"{BASE_DIR}/concordance_preloaded_trends_it_20250625112515.txt")
+# rimuovi i duplicati (notizie ripubblicate) usando la chiave normalizzata
+df = df.drop_duplicates("key")
+df["content_id"] = content_ids(df["key"])
+
+# indice di ricerca full-text/faccette: solo le frasi nuove vengono aggiunte
+added = CorpusIndex(INDEX_PATH).add_sentences(df, "donna libera")
+print(f"Frasi nuove nell'indice di ricerca: {added}")
+
+# --- 2. Assegna gli split da hash del content_id ----------------------------
+# le frasi già nel registro non si spostano mai; solo le nuove vengono
+# assegnate, con quote per anno
+ledger = load_ledger(LEDGER_PATH)
+if ledger.empty:
+    # primo avvio: parti dalle esportazioni già annotate
+    ledger = seed_ledger({"train": f"{BASE_DIR}/train_sentences_libera.csv",
+                          "test":  f"{BASE_DIR}/rest_sentences_libera.csv"})
+    append_ledger(ledger, LEDGER_PATH)
+new_rows = assign_splits(df, SPLIT_FRACTIONS, ledger, stratify_by_year=True)
+append_ledger(new_rows, LEDGER_PATH)
+print(f"Nuove frasi assegnate: {len(new_rows)}")
+
+ledger = pd.concat([ledger, new_rows], ignore_index=True)
+df = df.merge(ledger[["content_id", "split"]], on="content_id", how="inner")
 df["date"] = pd.to_datetime(df["date"], errors="coerce")
 df = df.sort_values("date").reset_index(drop=True)
 
-# --- 2. Suddividi in training (200 esempi) e test (800 esempi) -------------
-train_df = df.sample(n=200, random_state=42).reset_index(drop=True)
-# estrai i rimanenti e poi campiona 800 frasi per il test set
-remaining_df = df.drop(train_df.index).reset_index(drop=True)
-test_df = remaining_df.sample(n=800, random_state=42).reset_index(drop=True)
+# controllo leakage: quasi-duplicati finiti in split diversi
+leaks = find_leaks(df)
+if not leaks.empty:
+    print(f"Attenzione: {len(leaks)} coppie di quasi-duplicati tra split diversi")
+    print(leaks[["split_a", "split_b", "similarity", "sentence_a"]].head(20).to_string())
+
+export_cols = ["date", "sentence", "content_id"]
+train_df = df.loc[df["split"] == "train", export_cols]
+test_df  = df.loc[df["split"] == "test", export_cols]
 
 # --- 3. Esporta su CSV ------------------------------------------------------
-train_df.to_csv("/Users/Fabio/Documents/Programmi Utili/Collegio Superiore/Linguistica/train_sentences_libera.csv", index=False, encoding="utf-8")
-test_df.to_csv("/Users/Fabio/Documents/Programmi Utili/Collegio Superiore/Linguistica/rest_sentences_libera.csv",  index=False, encoding="utf-8")
+train_df.to_csv(f"{BASE_DIR}/train_sentences_libera.csv", index=False, encoding="utf-8")
+test_df.to_csv(f"{BASE_DIR}/rest_sentences_libera.csv",  index=False, encoding="utf-8")
 
 print(f"Training set: {len(train_df)} frasi salvate in train_sentences_libera.csv")
 print(f"Test set:     {len(test_df)} frasi salvate in rest_sentences_libera.csv")
@@ -0,0 +1,231 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from diversity_sampler import embed
+from sheet_labels import ADJUDICATED, annotator_columns, human_labels, model_columns
+
+# --- Active learning per l'annotazione umana -------------------------------------
+# Un servizio in background (python active_learning.py serve ...) legge dallo
+# sheet le etichette umane e quelle dei modelli (SheetAnalysisCache: niente
+# letture se lo sheet non è cambiato). Ogni RETRAIN_EVERY etichette umane nuove
+# riaddestra una regressione logistica sulle feature TF-IDF con hashing di
+# diversity_sampler.embed (calcolate una volta sola per tutto il pool) e
+# ricalcola in blocco il guadagno atteso di ogni frase:
+#   gain = entropia predittiva del modello locale (normalizzata su log k),
+#          mediata con l'entropia dei voti dei modelli LLM (HardExampleMiner)
+#          dove ci sono almeno due modelli
+# La coda (queue_<sheet>.csv: id, gain, labelled) si riscrive in modo atomico:
+# le app con ORDER = "active" la rileggono quando cambia il mtime e riordinano
+# le frasi dopo quella corrente, senza riavvio.
+RETRAIN_EVERY = 20      # etichette umane nuove prima di riaddestrare
+POLL_S = 30             # intervallo tra due controlli dello sheet
+LLM_WEIGHT = 0.5        # peso dell'entropia dei voti LLM nel guadagno
+
+
+def queue_path(sheet_name: str) -> str:
+    return f"queue_{sheet_name.lower().replace(' ', '_')}.csv"
+
+
+class ActiveLearner:
+
+    def __init__(self, sentence_ids, sentences, n_classes: int, retrain_every: int = RETRAIN_EVERY):
+        self.ids = pd.Index(np.asarray(sentence_ids, dtype=object)).astype(str)
+        self.n_classes = n_classes
+        self.retrain_every = retrain_every
+        self.X = embed(sentences)                   # una volta per pool, riusata a ogni ciclo
+        self.labels = np.zeros(len(self.ids), np.int8)
+        self.llm_entropy = np.full(len(self.ids), np.nan)
+        self.model = None
+        self.new_labels = 0
+
+    # --- aggiornamenti --------------------------------------------------------
+    def set_labels(self, labels: pd.Series) -> int:
+        # sentence_id → classe umana (0 = nessuna); ritorna le etichette nuove o cambiate
+        pos = self.ids.get_indexer(labels.index.astype(str))
+        keep = pos >= 0
+        pos, new = pos[keep], labels.to_numpy()[keep].astype(np.int8)
+        new = np.where((new >= 1) & (new <= self.n_classes), new, 0).astype(np.int8)
+        changed = int(((self.labels[pos] != new) & (new > 0)).sum())
+        self.labels[pos] = new
+        self.new_labels += changed
+        return changed
+
+    def set_llm_entropy(self, scores: pd.DataFrame) -> None:
+        # HardExampleMiner.scores(): entropia dei voti dei modelli per frase
+        scores = scores.dropna(subset=["score"])
+        pos = self.ids.get_indexer(scores.index.astype(str))
+        self.llm_entropy[pos[pos >= 0]] = scores["entropy"].to_numpy()[pos >= 0]
+
+    def due(self) -> bool:
+        return self.model is None or self.new_labels >= self.retrain_every
+
+    # --- modello e punteggi ---------------------------------------------------
+    def retrain(self) -> bool:
+        from sklearn.linear_model import LogisticRegression
+        seen = np.flatnonzero(self.labels)
+        if len(np.unique(self.labels[seen])) < 2:
+            return False
+        classes = np.unique(self.labels[seen])
+        if self.model is None or not np.array_equal(self.model.classes_, classes):
+            self.model = LogisticRegression(max_iter=1000, class_weight="balanced", warm_start=True)
+        # warm start: si riparte dai coefficienti del ciclo precedente
+        self.model.fit(self.X[seen], self.labels[seen])
+        self.new_labels = 0
+        return True
+
+    def gain(self) -> np.ndarray:
+        # entropia predittiva su tutto il pool in un solo prodotto matrice-sparsa
+        if self.model is None:
+            local = np.full(len(self.ids), np.nan)
+        else:
+            p = self.model.predict_proba(self.X)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                local = -np.where(p > 0, p * np.log(p), 0).sum(axis=1) / np.log(self.n_classes)
+        llm = self.llm_entropy
+        both = ~np.isnan(local) & ~np.isnan(llm)
+        out = np.where(np.isnan(local), llm, local)
+        out[both] = (1 - LLM_WEIGHT) * local[both] + LLM_WEIGHT * llm[both]
+        return np.nan_to_num(out)
+
+    def queue(self) -> pd.DataFrame:
+        # prima le non annotate dal guadagno più alto, in fondo le già annotate
+        labelled = self.labels > 0
+        gain = self.gain()
+        order = np.lexsort((-gain, labelled))
+        return pd.DataFrame({"id": self.ids[order], "gain": gain[order], "labelled": labelled[order]})
+
+    def write_queue(self, path: str) -> pd.DataFrame:
+        queue = self.queue()
+        tmp = path + ".tmp"
+        queue.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+        return queue
+
+
+def load_queue(path: str) -> pd.DataFrame:
+    return pd.read_csv(path, dtype={"id": str})
+
+
+def reorder_todo(ids, pointer: int, queue: pd.DataFrame) -> np.ndarray:
+    # permutazione della coda di una sessione (ids nell'ordine attuale): le frasi
+    # fino a quella corrente restano ferme (pointer e "Indietro" validi), le
+    # successive seguono la coda; quelle assenti dalla coda vanno in fondo
+    ids = pd.Index(np.asarray(ids).astype(str))
+    rank = pd.Series(np.arange(len(queue)), index=queue["id"].astype(str))
+    rank = rank[~rank.index.duplicated()]
+    head = np.arange(min(pointer + 1, len(ids)))
+    tail_rank = rank.reindex(ids[len(head):]).fillna(len(queue)).to_numpy()
+    return np.concatenate([head, len(head) + np.argsort(tail_rank, kind="stable")])
+
+
+def serve(ws, sheet_name: str, n_classes: int, cache_path: str, retrain_every: int = RETRAIN_EVERY,
+          poll_s: float = POLL_S) -> None:
+    from analysis_cache import SheetAnalysisCache, _column_letter
+    from hard_examples import HardExampleMiner
+    learner, header = None, None
+    while True:
+        new_header = ws.row_values(1)
+        if new_header != header:
+            # colonne nuove (un annotatore o un modello in più): si rifà la cache
+            header = new_header
+            lower = [h.lower() for h in header]
+            models, annotators = model_columns(header), annotator_columns(header)
+            best = [h for h in header if h.lower() == ADJUDICATED]
+            cache = SheetAnalysisCache(cache_path, annotators + models + best, classes=range(1, n_classes + 1))
+            cache.last_update = None
+        changed = cache.refresh(ws, header)
+        frame = cache.frame().rename(columns={b: ADJUDICATED for b in best})
+        if learner is None or len(frame) != len(learner.ids):
+            # pool nuovo o righe aggiunte allo sheet: id e frasi in una batch_get
+            letters = [_column_letter(lower.index(c) + 1) for c in ("id", "sentence")]
+            ids, sentences = ([r[0] if r else "" for r in col] for col in ws.batch_get([f"{c}2:{c}" for c in letters]))
+            sentences += [""] * (len(ids) - len(sentences))
+            t0 = time.perf_counter()
+            learner = ActiveLearner(ids, sentences[:len(ids)], n_classes, retrain_every)
+            print(f"pool di {len(ids)} frasi vettorizzato in {time.perf_counter() - t0:.1f} s")
+            changed = True
+        if changed:
+            new = learner.set_labels(human_labels(frame, annotators))
+            if models:
+                long = frame.melt(id_vars="id", value_vars=models, var_name="model", value_name="label")
+                miner = HardExampleMiner(n_classes)
+                miner.update(long["id"], long["model"], long["label"])
+                learner.set_llm_entropy(miner.scores())
+            if learner.due():
+                t0 = time.perf_counter()
+                trained = learner.retrain()
+                queue = learner.write_queue(queue_path(sheet_name))
+                print(f"{time.strftime('%H:%M:%S')} {int((learner.labels > 0).sum())} frasi annotate "
+                      f"(+{new}){', modello riaddestrato' if trained else ''}: coda di {len(queue)} frasi "
+                      f"in {time.perf_counter() - t0:.2f} s")
+        time.sleep(poll_s)
+
+
+if __name__ == "__main__":
+    import sys
+    # uso: python active_learning.py serve "Training_data_donna_disponibile" 4 [retrain_every]
+    #      python active_learning.py bench [n_frasi] [n_annotate]
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        import tomllib
+        import gspread
+        from google.oauth2.service_account import Credentials
+        from sheets_quota import open_worksheet, ANALYSIS
+        secrets_path = os.path.expanduser(
+            "~/Documents/Programmi Utili/Collegio Superiore/Linguistica/.streamlit/secrets.toml")
+        sheet_name, n_classes = sys.argv[2], int(sys.argv[3])
+        every = int(sys.argv[4]) if len(sys.argv) > 4 else RETRAIN_EVERY
+        with open(secrets_path, "rb") as f:
+            secrets = tomllib.load(f)
+        creds = Credentials.from_service_account_info(secrets["gcp_service_account"], scopes=[
+            "https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"])
+        ws = open_worksheet(gspread.authorize(creds), sheet_name, ANALYSIS)
+        serve(ws, sheet_name, n_classes, f"analysis_cache_active_{sheet_name.lower().replace(' ', '_')}.npz", every)
+        sys.exit(0)
+    # benchmark: pool sintetico di n frasi dal corpus "donna libera" (parole
+    # rimescolate, così non ci sono doppioni esatti), pseudo-etichette dalle
+    # parole chiave come in diversity_sampler; entropia LLM simulata su metà pool
+    import tempfile
+    from keyword_rules import RULES
+    from text_cleaning import load_concordance
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    rng = np.random.default_rng(0)
+    base = load_concordance("concordance_preloaded_trends_it_20250625112515.txt")["sentence"].to_numpy()
+    words = [s.split() for s in base[rng.integers(0, len(base), n)]]
+    sentences = [" ".join(w[j] for j in rng.permutation(len(w))[:max(len(w) - 3, 1)]) for w in words]
+    text = pd.Series(sentences).str.lower()
+    y = np.ones(n, np.int8)
+    for rule in RULES["donna libera"]:
+        y[text.str.contains("|".join(w.rstrip("*") for w in rule["any"]), regex=True).to_numpy()] = rule["class"]
+    ids = np.arange(n).astype(str)
+    t0 = time.perf_counter()
+    learner = ActiveLearner(ids, sentences, n_classes=6)
+    embed_s = time.perf_counter() - t0
+    half = rng.random(n) < 0.5
+    learner.llm_entropy[half] = rng.random(half.sum())
+    seen = rng.choice(n, k, replace=False)
+    learner.set_labels(pd.Series(y[seen], index=ids[seen]))
+    path = os.path.join(tempfile.mkdtemp(), "queue.csv")
+    t0 = time.perf_counter()
+    learner.retrain()
+    fit_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    queue = learner.write_queue(path)
+    score_s = time.perf_counter() - t0
+    # RETRAIN_EVERY etichette nuove: il ciclo completo del servizio
+    more = rng.choice(np.flatnonzero(learner.labels == 0), RETRAIN_EVERY, replace=False)
+    learner.set_labels(pd.Series(y[more], index=ids[more]))
+    t0 = time.perf_counter()
+    learner.retrain()
+    learner.write_queue(path)
+    cycle_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    reorder_todo(ids[rng.permutation(n)], 10, load_queue(path))
+    reorder_ms = (time.perf_counter() - t0) * 1000
+    print(f"{n:,} frasi, {k:,} annotate: feature {embed_s:.1f} s (una volta per pool), addestramento {fit_s:.2f} s, "
+          f"punteggi + coda {score_s:.2f} s")
+    print(f"ciclo completo dopo {RETRAIN_EVERY} etichette nuove: {cycle_s:.2f} s; "
+          f"riordino della coda nell'app {reorder_ms:.0f} ms")
+    print(queue.head(5).round(3).to_string(index=False))
@@ -2,6 +2,11 @@ import os
 import tomli
 import gspread
 from google.oauth2.service_account import Credentials
+from sheets_quota import open_worksheet, ANALYSIS
+from analysis_cache import SheetAnalysisCache
+from disagreement_index import build_index, save_index, index_path
+from experiment_registry import ExperimentRegistry
+import pandas as pd
 
 # --- Configurazione ---------------------------------------------------------
 SHEET_NAME   = "Training_data_donna_disponibile"
@@ -10,84 +15,134 @@ SECRETS_PATH = os.path.expanduser(
 )
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets",
           "https://www.googleapis.com/auth/drive"]
+CACHE_PATH = "analysis_cache_training_disponibile.npz"
+TASK = "donna_disponibile"   # come nel classificatore del training set
+REGISTRY_PATH = os.path.expanduser(
+    "~/Documents/Programmi Utili/Collegio Superiore/Linguistica/experiments.sqlite"
+)
 
 # --- Autenticazione e apertura sheet ----------------------------------------
 with open(SECRETS_PATH, "rb") as f:
     secrets = tomli.load(f)
 creds = Credentials.from_service_account_info(secrets["gcp_service_account"], scopes=SCOPES)
 gc    = gspread.authorize(creds)
-ws    = gc.open(SHEET_NAME).sheet1
+ws    = open_worksheet(gc, SHEET_NAME, ANALYSIS)
 
-# --- Lettura header + dati --------------------------------------------------
+# --- Lettura header + dati (incrementale) ----------------------------------
 header = ws.row_values(1)
-rows   = ws.get_all_values()[1:]  # esclude l’header
 
-# mappa header→indice case-insensitive
+# mappa header→nome colonna case-insensitive
 lower_header = [h.lower() for h in header]
-fabio_col  = next((i for i,h in enumerate(lower_header) if h == "fabio"), None)
-mod4o_col  = next((i for i,h in enumerate(lower_header) if h == "mod_gpt-4o"), None)
-mod4_1_col = next((i for i,h in enumerate(lower_header) if h == "mod_gpt-4_1"), None)
-id_col     = next((i for i,h in enumerate(lower_header) if h == "id"), None)
-sent_col   = next((i for i,h in enumerate(lower_header) if h == "sentence"), None)
+def find_col(pred):
+    return next((header[i] for i,h in enumerate(lower_header) if pred(h)), None)
+
+fabio_col  = find_col(lambda h: h == "fabio")
+mod4o_col  = find_col(lambda h: h == "mod_gpt-4o")
+mod4_1_col = find_col(lambda h: h == "mod_gpt-4_1")
 # map third classification columns (match any header with mod3 and model)
-mod3_4o_col  = next((i for i,h in enumerate(lower_header) if "mod3" in h and "gpt-4o" in h), None)
-mod3_4_1_col = next((i for i,h in enumerate(lower_header) if "mod3" in h and "gpt-4_1" in h), None)
+mod3_4o_col  = find_col(lambda h: "mod3" in h and "gpt-4o" in h)
+mod3_4_1_col = find_col(lambda h: "mod3" in h and "gpt-4_1" in h)
 
-# map additional annotator and mod4 columns
-fabio2_col   = next((i for i,h in enumerate(lower_header) if h == "fabio2"), None)
-monica_col   = next((i for i,h in enumerate(lower_header) if h == "monica"), None)
-mod4_4o_col  = next((i for i,h in enumerate(lower_header) if h == "mod4_gpt-4o"), None)
-mod4_4_1_col = next((i for i,h in enumerate(lower_header) if h == "mod4_gpt-4_1"), None)
+# map additional annotator columns
+fabio2_col   = find_col(lambda h: h == "fabio2")
+monica_col   = find_col(lambda h: h == "monica")
+# etichetta aggiudicata (scritta da app_adjudication.py)
+best_col     = find_col(lambda h: h == "best_human")
 
-print("Rilevate le seguenti discrepanze tra Fabio e mod_gpt-4o/mod_gpt-4_1/mod3_chat_gpt-4o/mod3_chat_gpt-4_1:\n")
-for row_idx, r in enumerate(rows, start=2):
+# la cache legge solo id + colonne di etichetta e ripiega le righe cambiate
+label_cols = [c for c in [fabio_col, mod4o_col, mod4_1_col, mod3_4o_col, mod3_4_1_col,
+                          fabio2_col, monica_col, best_col] if c is not None]
+cache = SheetAnalysisCache(CACHE_PATH, label_cols, classes=[1, 2, 3, 4])
+changed = cache.refresh(ws, header)
+print(f"Righe nuove o modificate dall'ultima analisi: {len(changed)}\n")
+df = cache.frame()
+
+# --- Predizioni mod4 dal registro degli esperimenti -------------------------
+# i classificatori non scrivono più le colonne mod4_* dello sheet (quelle vecchie
+# sono importate nel registro): ultimo run di ogni modello col prompt "mod4",
+# allineato alle righe dello sheet
+registry = ExperimentRegistry(REGISTRY_PATH)
+runs4 = registry.latest_runs(TASK, prompt_version="mod4")
+preds4 = registry.matrix(list(runs4.values()), names={r: f"mod4_{m}" for m, r in runs4.items()},
+                         sentence_ids=df["id"], as_str=True).fillna("")
+mod4_cols = list(preds4.columns)
+for col in mod4_cols:
+    df[col] = preds4[col].to_numpy()
+
+def val(r, col):
+    return r[col].strip() if col is not None else ""
+
+# --- Discrepanze Fabio vs mod/mod3 -----------------------------------------
+discrepancies = []
+for _, r in df.iterrows():
     # se Fabio non ha etichettato, salta
-    fabio = r[fabio_col].strip() if fabio_col is not None else ""
+    fabio = val(r, fabio_col)
     if not fabio:
         continue
 
-    mod4o  = r[mod4o_col].strip()  if mod4o_col  is not None else ""
-    mod4_1 = r[mod4_1_col].strip() if mod4_1_col is not None else ""
-    mod3_4o  = r[mod3_4o_col].strip()  if mod3_4o_col  is not None else ""
-    mod3_4_1 = r[mod3_4_1_col].strip() if mod3_4_1_col is not None else ""
-
-    diff_4o  = mod4o  and fabio != mod4o
-    diff_4_1 = mod4_1 and fabio != mod4_1
-    diff_3_4o  = mod3_4o  and fabio != mod3_4o
-    diff_3_4_1 = mod3_4_1 and fabio != mod3_4_1
-    if diff_4o or diff_4_1 or diff_3_4o or diff_3_4_1:
-        # id e frase fallback a row_idx o a intera riga se mancano colonne
-        id_val = r[id_col].strip() if id_col is not None else str(row_idx)
-        sent_val = r[sent_col].strip() if sent_col is not None else ""
-        print(f"ID {id_val} (riga {row_idx}):\n  Frase: {sent_val}")
-        print(f"  Fabio      → {fabio}")
-        if diff_4o:  print(f"  mod_gpt-4o  → {mod4o}")
-        if diff_4_1: print(f"  mod_gpt-4_1 → {mod4_1}")
-        if diff_3_4o:  print(f"  mod3_chat_gpt-4o → {mod3_4o}")
-        if diff_3_4_1: print(f"  mod3_chat_gpt-4_1 → {mod3_4_1}")
-        print("-" * 60)
+    others = {
+        "mod_gpt-4o":        val(r, mod4o_col),
+        "mod_gpt-4_1":       val(r, mod4_1_col),
+        "mod3_chat_gpt-4o":  val(r, mod3_4o_col),
+        "mod3_chat_gpt-4_1": val(r, mod3_4_1_col),
+    }
+    diffs = {name: v for name, v in others.items() if v and fabio != v}
+    if diffs:
+        discrepancies.append((r, fabio, diffs))
 
 # --- Confronto multi-annotator mod4 vs Fabio2 & Monica --------------------
-print("\nDiscrepanze tra Fabio2, Monica, mod4_gpt-4o, mod4_gpt-4_1:\n")
-for row_idx, r in enumerate(rows, start=2):
+multi = []
+for _, r in df.iterrows():
     # raccogli valori
-    fabio2  = r[fabio2_col].strip()   if fabio2_col   is not None else ""
-    monica  = r[monica_col].strip()   if monica_col   is not None else ""
-    m4o_val = r[mod4_4o_col].strip()  if mod4_4o_col  is not None else ""
-    m4_1_val= r[mod4_4_1_col].strip() if mod4_4_1_col is not None else ""
-    # se nessuno ha etichettato, salta
-    if not any([fabio2, monica, m4o_val, m4_1_val]):
-        continue
-    # controlla divergenze
-    unique_vals = set(x for x in [fabio2, monica, m4o_val, m4_1_val] if x)
-    if len(unique_vals) > 1:
-        # ottieni id e frase
-        id_val = r[id_col].strip()   if id_col   is not None else str(row_idx)
-        sent_val = r[sent_col].strip() if sent_col is not None else ""
-        print(f"ID {id_val} (riga {row_idx}): {sent_val}")
-        # stampa ogni annotazione
-        print(f"  Fabio2 → {fabio2}")
-        print(f"  Monica → {monica}")
-        print(f"  mod4_gpt-4o  → {m4o_val}")
-        print(f"  mod4_gpt-4_1 → {m4_1_val}")
-        print("-" * 60)
\ No newline at end of file
+    values = {
+        "Fabio2":       val(r, fabio2_col),
+        "Monica":       val(r, monica_col),
+        **{col: val(r, col) for col in mod4_cols},
+    }
+    # se nessuno ha etichettato, salta; altrimenti controlla divergenze
+    if len(set(v for v in values.values() if v)) > 1:
+        multi.append((r, values))
+
+# testo delle frasi solo per le righe da stampare (lettura a intervalli)
+needed = {int(r["__sheet_row"]) for r, *_ in discrepancies + multi}
+sentences = cache.fetch_column(ws, header, "sentence", sorted(needed)) if "sentence" in lower_header else {}
+
+print("Rilevate le seguenti discrepanze tra Fabio e mod_gpt-4o/mod_gpt-4_1/mod3_chat_gpt-4o/mod3_chat_gpt-4_1:\n")
+for r, fabio, diffs in discrepancies:
+    row_idx = int(r["__sheet_row"])
+    print(f"ID {r['id']} (riga {row_idx}):\n  Frase: {sentences.get(row_idx, '')}")
+    print(f"  Fabio      → {fabio}")
+    for name, v in diffs.items():
+        print(f"  {name} → {v}")
+    print("-" * 60)
+
+print(f"\nDiscrepanze tra Fabio2, Monica, {', '.join(mod4_cols)}:\n")
+for r, values in multi:
+    row_idx = int(r["__sheet_row"])
+    print(f"ID {r['id']} (riga {row_idx}): {sentences.get(row_idx, '')}")
+    # stampa ogni annotazione
+    for name, v in values.items():
+        print(f"  {name} → {v}")
+    print("-" * 60)
+
+# --- Indice dei disaccordi per la vista di aggiudicazione -------------------
+# annotatori dello sheet + run mod4 del registro; best_human resta l'etichetta aggiudicata
+raters = [c for c in [fabio_col, fabio2_col, monica_col] if c is not None] + mod4_cols
+index = build_index(df.rename(columns={best_col: "best_human"}) if best_col else df, raters)
+save_index(index, index_path(SHEET_NAME))
+print(f"\nIndice dei disaccordi: {len(index)} righe ({(index['best_human'] == '').sum()} da aggiudicare) "
+      f"in {index_path(SHEET_NAME)}")
+
+# --- Accordo a coppie dagli aggregati in cache ------------------------------
+print("\nAccordo tra valutatori (frazione di righe in cui coincidono):")
+print(cache.agreement_table().round(3))
+
+# modelli mod4 (dal registro) contro annotatori: solo righe con entrambe le etichette
+humans = [c for c in [fabio2_col, monica_col, best_col] if c is not None]
+table = pd.DataFrame(index=mod4_cols, columns=humans, dtype=float)
+for m in mod4_cols:
+    for h in humans:
+        both = (df[m] != "") & (df[h].str.strip() != "")
+        table.at[m, h] = (df.loc[both, m] == df.loc[both, h].str.strip()).mean() if both.any() else float("nan")
+print("\nAccordo dei run mod4 del registro con gli annotatori:")
+print(table.round(3))
@@ -2,9 +2,15 @@ import os
 import tomli
 import gspread
 from google.oauth2.service_account import Credentials
+from sheets_quota import open_worksheet, ANALYSIS
 import pandas as pd
 import matplotlib.pyplot as plt
 from statsmodels.stats.proportion import proportion_confint
+from analysis_cache import SheetAnalysisCache
+from disagreement_index import build_index, save_index, index_path
+from experiment_registry import ExperimentRegistry
+from model_significance import compare_models, pvalue_matrix
+from llm_metrics import MetricsStore, PRICES
 
 # Toggle plotting on/off
 ENABLE_PLOTS = True
@@ -20,39 +26,47 @@ SECRETS_PATH = os.path.expanduser(
 )
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets",
           "https://www.googleapis.com/auth/drive"]
+CACHE_PATH = "analysis_cache_test_disponibile.npz"
+TASK = "donna_disponibile_test"   # come nel classificatore del test set
+REGISTRY_PATH = os.path.expanduser(
+    "~/Documents/Programmi Utili/Collegio Superiore/Linguistica/experiments.sqlite"
+)
 
 # --- Autenticazione e apertura sheet ----------------------------------------
 with open(SECRETS_PATH, "rb") as f:
     secrets = tomli.load(f)
 creds = Credentials.from_service_account_info(secrets["gcp_service_account"], scopes=SCOPES)
 gc    = gspread.authorize(creds)
-ws    = gc.open(SHEET_NAME).sheet1
+ws    = open_worksheet(gc, SHEET_NAME, ANALYSIS)
 
-# --- Lettura header + dati --------------------------------------------------
+# --- Lettura header + dati (incrementale) ----------------------------------
+# la cache conserva un fingerprint per riga e gli aggregati: viene letta solo
+# la colonna id e le colonne di etichetta, e ripiegate solo le righe cambiate
 header = ws.row_values(1)
-rows   = ws.get_all_values()[1:]  # esclude l’header
+LABEL_COLUMNS = ["best_human"]
+cache = SheetAnalysisCache(CACHE_PATH, LABEL_COLUMNS, classes=[1, 2, 3, 4])
+changed = cache.refresh(ws, header)
+print(f"Righe nuove o modificate dall'ultima analisi: {len(changed)}")
+df = cache.frame()
 
-# mappa header→indice case-insensitive
-lower_header = [h.lower() for h in header]
+# mappa header→indice case-insensitive (sulle colonne in cache)
+lower_header = [h.lower() for h in df.columns]
 human_col  = next((i for i,h in enumerate(lower_header) if h == "best_human"), None)
-mod4o_col  = next((i for i,h in enumerate(lower_header) if h == "mod_gpt-4o"), None)
-mod4_1_col = next((i for i,h in enumerate(lower_header) if h == "mod_gpt-4_1"), None)
 id_col     = next((i for i,h in enumerate(lower_header) if h == "id"), None)
-sent_col   = next((i for i,h in enumerate(lower_header) if h == "sentence"), None)
-# map additional GPT-4.1 variants and mini GPT-4o column
-mod4_1_mini_col = next((i for i,h in enumerate(lower_header) if h == "mod_gpt-4_1-mini"), None)
-mod4_1_nano_col = next((i for i,h in enumerate(lower_header) if h == "mod_gpt-4_1-nano"), None)
-mod4o_mini_col  = next((i for i,h in enumerate(lower_header) if h == "mod_gpt-4o-mini"), None)
-
-# Build DataFrame and extract labels/predictions for all plotting
-df = pd.DataFrame(rows, columns=header)
+
+# --- Predizioni dei modelli dal registro degli esperimenti ------------------
+# ultimo run di ogni modello col prompt "mod", allineato alle righe dello sheet
+registry = ExperimentRegistry(REGISTRY_PATH)
+runs = registry.latest_runs(TASK, prompt_version="mod")
+preds = registry.matrix(list(runs.values()), names={r: m for m, r in runs.items()},
+                        sentence_ids=df["id"], as_str=True).fillna("")
+
+# Extract labels/predictions for all plotting
 human = df.iloc[:, human_col]
 models = {
-    "gpt-4.1":     df.iloc[:, mod4_1_col],
-    "gpt-4.1-mini": df.iloc[:, mod4_1_mini_col],
-    "gpt-4.1-nano": df.iloc[:, mod4_1_nano_col],
-    "gpt-4o":      df.iloc[:, mod4o_col],
-    "gpt-4o-mini":  df.iloc[:, mod4o_mini_col],
+    name: pd.Series(preds[name].to_numpy(), index=df.index)
+    for name in ["gpt-4.1", "gpt-4.1-mini", "gpt-4.1-nano", "gpt-4o", "gpt-4o-mini"]
+    if name in preds.columns
 }
 
 # --- Compute and plot agreement percentages and cost ---
@@ -95,14 +109,15 @@ if ENABLE_PLOTS:
 
     # Calculate percentage agreement for each model
     agreement = {name: (series == human).mean() * 100 for name, series in models.items()}
-    # Cost per million tokens for each model
-    costs = {
-        "gpt-4.1":      2.00,
-        "gpt-4.1-mini": 0.40,
-        "gpt-4.1-nano": 0.10,
-        "gpt-4o":       2.50,
-        "gpt-4o-mini":  0.15,
-    }
+    # costo reale per 1000 frasi dallo store delle metriche; se qualche modello
+    # non ha chiamate registrate, si torna al listino ($ per milione di token in input)
+    measured = MetricsStore().cost_per_sentence(task=TASK)
+    if all(name in measured.index for name in models):
+        costs = {name: measured[name] * 1000 for name in models}
+        cost_label = "Cost ($/1k sentences)"
+    else:
+        costs = {name: PRICES[name]["input"] for name in models}
+        cost_label = "Cost ($/M input tokens)"
 
     # Prepare data for plotting
     names = list(agreement.keys())
@@ -133,7 +148,7 @@ if ENABLE_PLOTS:
                      ha='center', va='bottom')
     ax1.set_ylabel("Agreement (%)")
     ax1.set_xlabel("Model")
-    ax1.set_title("Model Agreement and Cost per Million Tokens")
+    ax1.set_title(f"Model Agreement and {cost_label}")
     ax1.tick_params(axis="x", rotation=45)
 
     # Dashed line at 100% accuracy
@@ -141,8 +156,8 @@ if ENABLE_PLOTS:
 
     # Plot cost on secondary axis
     ax2 = ax1.twinx()
-    ax2.plot(names, cost_values, marker="o", linestyle="--", color="orange", label="Cost ($/M tokens)")
-    ax2.set_ylabel("Cost ($/M tokens)")
+    ax2.plot(names, cost_values, marker="o", linestyle="--", color="orange", label=cost_label)
+    ax2.set_ylabel(cost_label)
 
     # Annotate cost values above each point
     #for x, y in zip(names, cost_values):
@@ -157,6 +172,22 @@ if ENABLE_PLOTS:
     plt.show()
 # end of agreement & cost plotting
 
+# --- Significatività delle differenze tra modelli ---
+# McNemar esatto, bootstrap appaiato e permutazione per ogni coppia, con
+# correzione di Holm; workers=1 perché lo script non ha un blocco __main__
+# (con spawn i processi figli lo rieseguirebbero da capo)
+significance = compare_models(human, models, n_resamples=10_000, workers=1)
+print("\nConfronti a coppie tra modelli (p corretti con Holm):")
+print(significance[["model_a", "model_b", "acc_a", "acc_b", "a_only", "b_only", "boot_low", "boot_high",
+                    "mcnemar_holm", "boot_holm", "perm_holm"]].round(3).to_string(index=False))
+if ENABLE_PLOTS:
+    plt.figure(figsize=(6, 5))
+    sns.heatmap(pvalue_matrix(significance, "mcnemar_holm"), annot=True, fmt=".3f",
+                cmap="Blues_r", vmin=0, vmax=0.1)
+    plt.title("McNemar p (Holm) tra coppie di modelli")
+    plt.tight_layout()
+    plt.show()
+
 # --- Agreement of other models relative to GPT-4.1 ---
 if ENABLE_PLOTS:
     # Convert GPT-4.1 outputs to numeric
@@ -261,6 +292,8 @@ mask = (
     (models["gpt-4o"] != human)
 )
 disagree_df = df[mask]
+# testo delle frasi solo per le righe in disaccordo (lettura a intervalli)
+sentences = cache.fetch_column(ws, header, "sentence", disagree_df["__sheet_row"])
 
 # print("\nSentences where GPT-4.1, GPT-4o, and human disagree:")
 # for idx, row in disagree_df.iterrows():
@@ -277,15 +310,23 @@ output_path = "disagreement_sentences.txt"
 with open(output_path, "w", encoding="utf-8") as f:
     f.write("Sentences where GPT-4.1, GPT-4o, and human disagree:\n")
     for idx, row in disagree_df.iterrows():
-        sent = row[df.columns[sent_col]]
+        sent = sentences.get(int(row["__sheet_row"]), "")
         gid = row[df.columns[id_col]] if id_col is not None else idx
         f.write(f"[{gid}] {sent}\n")
-        f.write(f" - GPT-4.1: {row[df.columns[mod4_1_col]]}\n")
-        f.write(f" - GPT-4o:   {row[df.columns[mod4o_col]]}\n")
+        f.write(f" - GPT-4.1: {models['gpt-4.1'][idx]}\n")
+        f.write(f" - GPT-4o:   {models['gpt-4o'][idx]}\n")
         f.write(f" - Human:    {row[df.columns[human_col]]}\n")
         f.write("-" * 50 + "\n")
 print(f"\nDisagreement sentences also saved to {output_path}")
 
+# --- Indice dei disaccordi per la vista di aggiudicazione (app_adjudication.py) ---
+# tutti i modelli del registro, non solo GPT-4.1/GPT-4o; best_human è l'etichetta
+# aggiudicata, non un valutatore (altrimenti ogni disaccordo risulterebbe già risolto)
+index_frame = pd.concat([df[["id", "__sheet_row", "best_human"]], pd.DataFrame(models)], axis=1)
+index = build_index(index_frame, list(models))
+save_index(index, index_path(SHEET_NAME))
+print(f"Indice dei disaccordi: {len(index)} righe in {index_path(SHEET_NAME)}")
+
 # --- Three confusion matrices side by side (1×3) ---
 if ENABLE_PLOTS_CONFUSION:
     # Mapping numeric labels to English descriptions
@@ -0,0 +1,272 @@
+import json
+import os
+from itertools import combinations
+import numpy as np
+import pandas as pd
+
+from sheets_quota import GovernedWorksheet, spreadsheet_update_time
+
+# --- Cache incrementale per gli script di analisi ---------------------------
+# Per ogni riga dello sheet si salvano un fingerprint delle celle di etichetta
+# e i codici di classe; a ogni nuova lettura si ripiegano negli aggregati
+# (tallies per classe, matrici di confusione per coppia di valutatori) solo
+# le righe il cui fingerprint è cambiato.
+# Solo il ripiegamento è proporzionale alle righe cambiate: la lettura no.
+# L'API di Sheets non dice quali righe sono cambiate, quindi refresh scarica
+# comunque tutte le colonne id + etichette (non le frasi) e confronta i
+# fingerprint; si salta del tutto solo se lo sheet non è stato modificato
+# (lastUpdateTime). Con 5 righe cambiate il ripiegamento costa ~0.2 s contro
+# ~0.5 s del ricalcolo completo, dominati da lettura e hashing.
+
+
+def row_fingerprints(labels: pd.DataFrame) -> np.ndarray:
+    # one uint64 hash per row, computed in C over all label cells
+    return pd.util.hash_pandas_object(labels, index=False).to_numpy()
+
+
+def _column_letter(col: int) -> str:
+    # 1 → A, 27 → AA (come gspread.utils.rowcol_to_a1 senza numero di riga)
+    letters = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+class SheetAnalysisCache:
+
+    def __init__(self, path: str, label_cols: list, classes: list, key_col: str = "id"):
+        self.path = path
+        self.label_cols = list(label_cols)
+        self.classes = [str(c) for c in classes]
+        self.key_col = key_col
+        self._code = {c: i for i, c in enumerate(self.classes)}
+        self.pairs = list(combinations(range(len(self.label_cols)), 2))
+        self.last_update = None
+        self._set_state(pd.Index([], dtype=object), np.zeros(0, np.uint64), np.zeros(0, np.int64),
+                        np.zeros((0, len(self.label_cols)), np.int64))
+        self._reset_aggregates()
+        if os.path.exists(path):
+            self._load()
+
+    def _set_state(self, keys, fps, sheet_rows, codes):
+        # stato per riga: fingerprint, riga dello sheet, codici di classe (-1 = vuota)
+        self.state = pd.DataFrame({"fp": fps, "sheet_row": sheet_rows}, index=keys)
+        self.codes = codes
+
+    def _reset_aggregates(self):
+        k, n = len(self.classes), len(self.label_cols)
+        self.tallies = np.zeros((n, k), dtype=np.int64)
+        self.confusion = np.zeros((len(self.pairs), k, k), dtype=np.int64)
+
+    # --- ripiegamento delle righe cambiate ----------------------------------
+    def _encode(self, labels: pd.DataFrame) -> np.ndarray:
+        codes = np.full(labels.shape, -1, dtype=np.int64)
+        for j, col in enumerate(labels.columns):
+            codes[:, j] = labels[col].astype(str).str.strip().map(self._code).fillna(-1).to_numpy()
+        return codes
+
+    def _apply(self, codes: np.ndarray, sign: int) -> None:
+        # codes: (righe × valutatori), -1 = cella vuota o non valida
+        if codes.size == 0:
+            return
+        for j in range(codes.shape[1]):
+            col = codes[:, j]
+            np.add.at(self.tallies[j], col[col >= 0], sign)
+        for p, (a, b) in enumerate(self.pairs):
+            ok = (codes[:, a] >= 0) & (codes[:, b] >= 0)
+            np.add.at(self.confusion[p], (codes[ok, a], codes[ok, b]), sign)
+
+    def fold(self, keys, sheet_rows, labels) -> set:
+        # keys/sheet_rows/labels describe the current content of the sheet;
+        # only rows whose fingerprint changed are re-encoded and folded into
+        # the aggregates. Returns the keys that changed (added, edited, removed)
+        keys = pd.Index([str(k) for k in keys])
+        labels = pd.DataFrame(list(labels), columns=self.label_cols, index=keys).fillna("")
+        sheet_rows = np.asarray(sheet_rows, dtype=np.int64)
+        # id ripetuti nello sheet (righe copiate): vale l'ultima riga con quell'id
+        unique = ~keys.duplicated(keep="last")
+        if not unique.all():
+            keys, labels, sheet_rows = keys[unique], labels[unique], sheet_rows[unique]
+        fps = row_fingerprints(labels)
+        pos = self.state.index.get_indexer(keys)
+        known = pos >= 0
+        old_fp = np.zeros(len(keys), dtype=np.uint64)
+        old_fp[known] = self.state["fp"].to_numpy()[pos[known]]
+        changed = ~known | (old_fp != fps)
+        removed = np.ones(len(self.state), dtype=bool)
+        removed[pos[known]] = False
+
+        codes = np.empty((len(keys), len(self.label_cols)), dtype=np.int64)
+        keep = known & ~changed
+        codes[keep] = self.codes[pos[keep]]
+        codes[changed] = self._encode(labels[changed])
+
+        removed_keys = set(self.state.index[removed])
+        self._apply(self.codes[np.concatenate([pos[known & changed], np.flatnonzero(removed)])], -1)
+        self._apply(codes[changed], +1)
+        self._set_state(keys, fps, sheet_rows, codes)
+        return set(keys[changed]) | removed_keys
+
+    # --- lettura dallo sheet --------------------------------------------------
+    def refresh(self, ws, header: list = None) -> set:
+        # reads the full id and label columns (ranged reads, no sentences): the
+        # fetch is not incremental, only the folding is; skips everything when
+        # the spreadsheet has not been modified since the last refresh
+        last_update = _last_update_time(ws)
+        if last_update is not None and last_update == self.last_update:
+            return set()
+        header = header if header is not None else ws.row_values(1)
+        lower = {h.lower(): i + 1 for i, h in enumerate(header)}
+        wanted = [self.key_col] + self.label_cols
+        ranges = [f"{_column_letter(lower[c.lower()])}2:{_column_letter(lower[c.lower()])}"
+                  for c in wanted if c.lower() in lower]
+        present = [c for c in wanted if c.lower() in lower]
+        columns = dict(zip(present, ws.batch_get(ranges)))
+        n_rows = max((len(v) for v in columns.values()), default=0)
+
+        def cells(name):
+            col = columns.get(name, [])
+            return [(col[i][0] if i < len(col) and col[i] else "") for i in range(n_rows)]
+
+        key_values = cells(self.key_col) if self.key_col in columns else [str(i) for i in range(2, n_rows + 2)]
+        labels = list(zip(*[cells(c) for c in self.label_cols])) if self.label_cols else []
+        changed = self.fold(key_values, range(2, n_rows + 2), labels)
+        self.last_update = last_update
+        self.save()
+        return changed
+
+    def fetch_column(self, ws, header: list, name: str, sheet_rows) -> dict:
+        # fetch a (wide) text column only for the given rows, e.g. the sentences
+        # of the disagreement rows
+        return fetch_column(ws, header, name, sheet_rows)
+
+    # --- metriche dagli aggregati --------------------------------------------
+    def _pair(self, a: str, b: str):
+        i, j = self.label_cols.index(a), self.label_cols.index(b)
+        if i < j:
+            return self.confusion[self.pairs.index((i, j))]
+        return self.confusion[self.pairs.index((j, i))].T
+
+    def confusion_matrix(self, ref: str, pred: str) -> pd.DataFrame:
+        return pd.DataFrame(self._pair(ref, pred), index=self.classes, columns=self.classes)
+
+    def agreement(self, a: str, b: str) -> float:
+        cm = self._pair(a, b)
+        total = cm.sum()
+        return float(np.trace(cm) / total) if total else float("nan")
+
+    def kappa(self, a: str, b: str) -> float:
+        cm = self._pair(a, b).astype(float)
+        total = cm.sum()
+        if not total:
+            return float("nan")
+        p_o = np.trace(cm) / total
+        p_e = (cm.sum(axis=0) * cm.sum(axis=1)).sum() / total ** 2
+        return float((p_o - p_e) / (1 - p_e)) if p_e < 1 else float("nan")
+
+    def per_class_recall(self, ref: str, pred: str) -> pd.Series:
+        cm = self._pair(ref, pred).astype(float)
+        support = cm.sum(axis=1)
+        recall = np.divide(np.diag(cm), support, out=np.full(len(support), np.nan), where=support > 0)
+        return pd.Series(recall, index=self.classes)
+
+    def agreement_table(self) -> pd.DataFrame:
+        out = pd.DataFrame(index=self.label_cols, columns=self.label_cols, dtype=float)
+        for a in self.label_cols:
+            for b in self.label_cols:
+                out.at[a, b] = 1.0 if a == b else self.agreement(a, b)
+        return out
+
+    def frame(self) -> pd.DataFrame:
+        # etichette in cache come DataFrame (stringhe, "" per celle vuote/non valide)
+        lookup = np.array(self.classes + [""], dtype=object)
+        df = pd.DataFrame(lookup[self.codes], columns=self.label_cols)
+        df.insert(0, "__sheet_row", self.state["sheet_row"].to_numpy())
+        df.insert(0, self.key_col, self.state.index.to_numpy())
+        return df.sort_values("__sheet_row").reset_index(drop=True)
+
+    # --- persistenza --------------------------------------------------------
+    def save(self) -> None:
+        meta = {"label_cols": self.label_cols, "classes": self.classes, "last_update": self.last_update}
+        tmp = self.path + ".tmp.npz"
+        np.savez(tmp, meta=np.array(json.dumps(meta)), keys=self.state.index.to_numpy(dtype=str),
+                 fp=self.state["fp"].to_numpy(), sheet_row=self.state["sheet_row"].to_numpy(),
+                 codes=self.codes.astype(np.int8))
+        os.replace(tmp, self.path)
+
+    def _load(self) -> None:
+        data = np.load(self.path)
+        meta = json.loads(str(data["meta"]))
+        if meta["label_cols"] != self.label_cols or meta["classes"] != self.classes:
+            return  # colonne cambiate: si riparte da zero
+        self.last_update = meta["last_update"]
+        self._set_state(pd.Index(data["keys"].astype(object)), data["fp"], data["sheet_row"],
+                        data["codes"].astype(np.int64))
+        # gli aggregati si ricostruiscono dai codici in un solo passaggio vettoriale
+        self._apply(self.codes, +1)
+
+
+def fetch_column(ws, header: list, name: str, sheet_rows) -> dict:
+    # una cella per riga richiesta, tutte in una sola batch_get
+    col = _column_letter([h.lower() for h in header].index(name.lower()) + 1)
+    sheet_rows = [int(r) for r in sheet_rows]
+    if not sheet_rows:
+        return {}
+    values = ws.batch_get([f"{col}{r}" for r in sheet_rows])
+    return {r: (v[0][0] if v and v[0] else "") for r, v in zip(sheet_rows, values)}
+
+
+def _last_update_time(ws):
+    # con open_worksheet la lettura dei metadati passa dal governor della quota
+    if isinstance(ws, GovernedWorksheet):
+        return ws.last_update_time()
+    return spreadsheet_update_time(ws)
+
+
+# --- Benchmark: sheet sintetico da 100k righe ------------------------------
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import time
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    label_cols = ["best_human", "Fabio", "Monica", "mod_gpt-4_1", "mod_gpt-4o", "mod_gpt-4o-mini"]
+    rng = np.random.default_rng(0)
+    labels = rng.integers(1, 5, (n_rows, len(label_cols))).astype(str)
+    labels[rng.random(labels.shape) < 0.1] = ""
+    labels = [tuple(r) for r in labels]
+    keys = [str(i) for i in range(n_rows)]
+    sheet_rows = range(2, n_rows + 2)
+    path = os.path.join(tempfile.mkdtemp(), "cache.npz")
+    print(f"Sheet sintetico: {n_rows:,} righe × {len(label_cols)} colonne di etichette")
+
+    # ricalcolo completo come negli script attuali
+    t0 = time.perf_counter()
+    df = pd.DataFrame(labels, columns=label_cols)
+    for a, b in combinations(label_cols, 2):
+        ok = (df[a] != "") & (df[b] != "")
+        pd.crosstab(df.loc[ok, a], df.loc[ok, b])
+    print(f"  ricalcolo completo:          {time.perf_counter() - t0:8.3f} s")
+
+    cache = SheetAnalysisCache(path, label_cols, classes=[1, 2, 3, 4])
+    t0 = time.perf_counter()
+    cache.fold(keys, sheet_rows, labels)
+    print(f"  primo fold (cache vuota):    {time.perf_counter() - t0:8.3f} s")
+
+    # un annotatore aggiunge 5 etichette
+    for i in rng.choice(n_rows, 5, replace=False):
+        row = list(labels[i])
+        row[1] = "1" if row[1] == "2" else "2"
+        labels[i] = tuple(row)
+    t0 = time.perf_counter()
+    changed = cache.fold(keys, sheet_rows, labels)
+    print(f"  fold con {len(changed)} righe cambiate:  {time.perf_counter() - t0:8.3f} s")
+
+    t0 = time.perf_counter()
+    cache.save()
+    reloaded = SheetAnalysisCache(path, label_cols, classes=[1, 2, 3, 4])
+    print(f"  salvataggio + ricaricamento: {time.perf_counter() - t0:8.3f} s")
+    fresh = SheetAnalysisCache(path + ".fresh", label_cols, classes=[1, 2, 3, 4])
+    fresh.fold(keys, sheet_rows, labels)
+    assert (reloaded.confusion == cache.confusion).all() and (fresh.confusion == cache.confusion).all()
+    print(f"  accordo best_human/mod_gpt-4_1: {cache.agreement('best_human', 'mod_gpt-4_1'):.3f}")
@@ -0,0 +1,122 @@
+import json
+import re
+
+# --- Formato della risposta dei classificatori -------------------------------
+#   json : {"class": k} con response_format json_object e max_tokens=10 (storico)
+#   digit: una sola cifra, vincolata con logit_bias sulle cifre 1..k e
+#          max_tokens=1 → 1 token di output invece di ~5 e nessun JSON da riparare
+# In entrambi i casi il validatore è rigido: o una classe in 1..k, o None
+# (che il registro salva come NULL = fallita, insieme al testo grezzo).
+ANSWER_MODES = ("json", "digit")
+
+# nei tokenizer OpenAI (cl100k_base, o200k_base: gpt-4o, gpt-4.1) i primi token
+# sono i caratteri ASCII stampabili da "!" in poi: "0" = 15, "1" = 16, ... "9" = 24
+DIGIT_TOKEN_BASE = 15
+LOGIT_BIAS = 100  # +100 = solo questi token sono campionabili
+
+JSON_INSTRUCTION_RE = re.compile(
+    r'Rispondi \*\*ESCLUSIVAMENTE\*\* con un JSON UTF-8 valido:\s*\{\s*"class": <numero intero tra 1 e (\d)>\s*\}')
+JSON_EXAMPLE_RE = re.compile(r'\{"class":\s*(\d)\}')
+
+
+def digit_token_ids(n_classes: int) -> list:
+    if not 1 <= n_classes <= 9:
+        raise ValueError(f"la modalità digit supporta da 1 a 9 classi, non {n_classes}")
+    return [DIGIT_TOKEN_BASE + k for k in range(1, n_classes + 1)]
+
+
+def digit_params(n_classes: int) -> dict:
+    return {
+        "temperature": 0,
+        "max_tokens": 1,
+        "top_p": 1,
+        "logit_bias": {str(t): LOGIT_BIAS for t in digit_token_ids(n_classes)},
+    }
+
+
+def digit_prompt(prompt: str, n_classes: int) -> str:
+    # stesso prompt, ma chiede la sola cifra (anche negli esempi few-shot)
+    out, found = JSON_INSTRUCTION_RE.subn(
+        f"Rispondi **ESCLUSIVAMENTE** con il numero della classe: una sola cifra tra 1 e {n_classes}, "
+        f"senza altro testo.", prompt)
+    if found != 1:
+        raise ValueError("istruzione di risposta JSON non trovata nel prompt")
+    return JSON_EXAMPLE_RE.sub(r"\1", out)
+
+
+def answer_setup(mode: str, prompt: str, params: dict, n_classes: int, version: str):
+    # → (prompt, parametri, prompt_version) del run; in modalità json tutto invariato,
+    # così i run storici nel registro restano gli stessi
+    if mode == "json":
+        return prompt, params, version
+    if mode == "digit":
+        return digit_prompt(prompt, n_classes), digit_params(n_classes), f"{version}_digit"
+    raise ValueError(f"modalità di risposta sconosciuta: {mode!r} (attese: {', '.join(ANSWER_MODES)})")
+
+
+def parse_answer(text, n_classes: int, mode: str = "json"):
+    # → classe in 1..n_classes oppure None; niente regex di recupero su testo sporco
+    text = (text or "").strip()
+    if mode == "digit":
+        return int(text) if len(text) == 1 and text.isdigit() and 1 <= int(text) <= n_classes else None
+    try:
+        obj = json.loads(text)
+    except ValueError:
+        return None
+    value = obj.get("class") if isinstance(obj, dict) else None
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        return None
+    return value if 1 <= value <= n_classes else None
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    import pandas as pd
+    from openai import OpenAI
+    from llm_metrics import call_cost
+    from llm_simulator import SimulatorConfig, running_simulator
+    from prompt_layout import PromptLayout, prompts_from_script
+    # benchmark sul simulatore: modalità json contro digit con il prompt di "donna libera"
+    # uso: python answer_format.py [n_frasi] [concorrenza]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    conc = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    here = os.path.dirname(os.path.abspath(__file__))
+    prompt = prompts_from_script(os.path.join(here, "Classifier Training Data Donna libera.py"))["SYSTEM_PROMPT"]
+    sentences = pd.read_csv(os.path.join(here, "train_sentences_libera.csv"))["sentence"].head(n).tolist()
+    json_params = {"temperature": 0, "max_tokens": 10, "top_p": 1, "response_format": {"type": "json_object"}}
+    model = "gpt-4.1-mini"
+    rows = []
+    for mode in ANSWER_MODES:
+        run_prompt, params, _ = answer_setup(mode, prompt, json_params, 6, "mod")
+        layout = PromptLayout(run_prompt, mode)
+        # latenza = attesa fissa + 20 ms per token generato; 2% di JSON troncati
+        config = SimulatorConfig(latency_ms=300, ms_per_output_token=20, malformed_prob=0.02, seed=1)
+        with running_simulator(config) as sim:
+            client = OpenAI(base_url=sim.base_url, api_key="sim", max_retries=0)
+
+            def call(sentence):
+                t0 = time.perf_counter()
+                resp = client.chat.completions.create(model=model, messages=layout.messages(sentence), **params)
+                return ((time.perf_counter() - t0) * 1000, resp.usage.prompt_tokens, resp.usage.completion_tokens,
+                        parse_answer(resp.choices[0].message.content, 6, mode))
+
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=conc) as pool:
+                res = list(pool.map(call, sentences))
+            elapsed = time.perf_counter() - t0
+        lat = np.array([r[0] for r in res])
+        prompt_tokens = np.array([r[1] for r in res])
+        completion_tokens = np.array([r[2] for r in res])
+        rows.append({"mode": mode, "calls": len(res), "throughput_rps": len(res) / elapsed,
+                     "p50_ms": np.percentile(lat, 50), "p95_ms": np.percentile(lat, 95),
+                     "output_tokens_per_call": completion_tokens.mean(),
+                     "invalid": sum(r[3] is None for r in res),
+                     "cost_per_1k_usd": 1000 * call_cost(model, prompt_tokens, completion_tokens, 0).mean()})
+    print(f"{len(sentences)} frasi, {model} simulato, concorrenza {conc}:")
+    print(pd.DataFrame(rows).set_index("mode").round(4).to_string())
@@ -0,0 +1,94 @@
+import os
+import streamlit as st
+import pandas as pd
+import gspread
+from google.oauth2.service_account import Credentials
+from sheets_quota import open_worksheet, INTERACTIVE
+from disagreement_index import ADJUDICATED, adjudicate, fetch_rows, index_path, load_index
+
+# --------- Config --------------------
+# aggiudicazione dei disaccordi: l'indice lo scrivono gli script di analisi
+# ("analyse result donna disponibile.py", "analyse test donna disponibile.py");
+# dallo sheet si leggono solo le frasi della pagina corrente
+SHEETS = {
+    "Training_data_donna_disponibile": 4,
+    "test data donna disponibile": 4,
+}
+CATEGORIES = {
+    1: "Neutro/lavorativo/Pratico",
+    2: "Sessuale/dispregiativo",
+    3: "Figurato/positivo",
+    4: "Aggettivo non riferito a donna"
+}
+PAGE = 20   # frasi lette dallo sheet per ogni lettura a intervalli
+# -------------------------------------
+
+
+@st.cache_resource
+def open_sheet(sheet_name: str):
+    scopes = [
+        "https://www.googleapis.com/auth/spreadsheets",
+        "https://www.googleapis.com/auth/drive"
+    ]
+    creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=scopes)
+    ws = open_worksheet(gspread.authorize(creds), sheet_name, INTERACTIVE)
+    return ws, ws.row_values(1)
+
+
+st.title("Aggiudicazione dei disaccordi (best_human)")
+sheet_name = st.sidebar.selectbox("Sheet", list(SHEETS))
+show_done = st.sidebar.checkbox("Mostra anche le righe già aggiudicate", value=False)
+path = index_path(sheet_name)
+if not os.path.exists(path):
+    st.warning(f"Indice {path} non trovato: lancia prima lo script di analisi dello sheet.")
+    st.stop()
+
+# indice e pagina corrente per sessione; si ricarica se lo script di analisi lo ha riscritto
+mtime = os.path.getmtime(path)
+if st.session_state.get("adj_key") != (sheet_name, show_done, mtime):
+    index = load_index(path)
+    st.session_state.adj_key = (sheet_name, show_done, mtime)
+    st.session_state.adj_index = index
+    st.session_state.adj_queue = (index.index if show_done else index.index[index[ADJUDICATED] == ""]).to_numpy()
+    st.session_state.adj_pointer = 0
+    st.session_state.adj_page = {}
+
+index = st.session_state.adj_index
+queue = st.session_state.adj_queue
+pointer = st.session_state.adj_pointer
+todo = int((index[ADJUDICATED] == "").sum())
+st.markdown(f"**Disaccordi nell'indice**: {len(index)} · **da aggiudicare**: {todo}")
+if pointer >= len(queue):
+    st.success("Nessun disaccordo da aggiudicare. Grazie!")
+    st.stop()
+
+ws, header = open_sheet(sheet_name)
+pos = queue[pointer]
+row = index.loc[pos]
+# frasi della pagina corrente (una lettura a intervalli ogni PAGE righe)
+if row["sheet_row"] not in st.session_state.adj_page:
+    page_rows = index.loc[queue[pointer:pointer + PAGE], "sheet_row"]
+    st.session_state.adj_page = fetch_rows(ws, header, page_rows)["sentence"].to_dict()
+sentence = st.session_state.adj_page.get(row["sheet_row"], "")
+
+st.markdown(f"**Frase {pointer + 1} / {len(queue)}** (id {row['id']}, riga {row['sheet_row']})")
+st.markdown(f"> {sentence}")
+raters = [c for c in index.columns if c not in ("id", "sheet_row", "n_labels", "n_distinct", ADJUDICATED)]
+st.table(pd.DataFrame({"etichetta": [row[c] or "—" for c in raters]}, index=raters))
+if row[ADJUDICATED]:
+    st.info(f"Già aggiudicata: {row[ADJUDICATED]}")
+
+n_classes = SHEETS[sheet_name]
+cols = st.columns(n_classes + 1)
+for k in range(1, n_classes + 1):
+    if cols[k - 1].button(f"{k} → {CATEGORIES.get(k, k)}", key=f"adj_{k}"):
+        if adjudicate(ws, header, index, path, row["id"], k):
+            st.session_state.adj_key = (sheet_name, show_done, os.path.getmtime(path))
+            st.session_state.adj_pointer += 1
+        else:
+            st.error("La riga dello sheet non corrisponde più all'id: rilancia lo script di analisi.")
+            st.stop()
+        st.rerun()
+if cols[n_classes].button("Salta"):
+    st.session_state.adj_pointer += 1
+    st.rerun()
@@ -6,6 +6,7 @@ import json
 import os
 import gspread
 from google.oauth2.service_account import Credentials
+from sheets_quota import open_worksheet, INTERACTIVE
 
 # --------- Config --------------------
 SHEET_NAME = "train_sentences_libera"
@@ -32,7 +33,7 @@ def load_sentences(annotator):
         scopes=scopes
     )
     client = gspread.authorize(creds)
-    ws = client.open(SHEET_NAME).sheet1
+    ws = open_worksheet(client, SHEET_NAME, INTERACTIVE)
 
     # fetch all data
     all_values = ws.get_all_values()
@@ -0,0 +1,109 @@
+import os
+import streamlit as st
+import pandas as pd
+import gspread
+from google.oauth2.service_account import Credentials
+from statsmodels.stats.proportion import proportion_confint
+from sheets_quota import open_worksheet, ANALYSIS
+from analysis_cache import _column_letter
+from sheet_labels import human_labels, annotator_columns, ADJUDICATED
+from experiment_registry import ExperimentRegistry
+from event_stream import EventStream, RunningAgreement
+
+# --------- Config --------------------
+# dashboard live: ogni etichetta scritta dai classificatori arriva come evento
+# e aggiorna accordo, recall per classe e confusione senza rileggere il run
+REGISTRY_PATH = os.path.expanduser("~/Documents/Programmi Utili/Collegio Superiore/Linguistica/experiments.sqlite")
+# task → (sheet, numero di classi): un solo sheet per task, perché gli id delle
+# frasi sono indici di riga e valgono solo nel loro sheet
+TASKS = {
+    "donna_disponibile_test": ("test data donna disponibile", 4),
+    "donna_disponibile": ("Training_data_donna_disponibile", 4),
+    "donna_libera": ("Training_data_donna_libera", 6),
+}
+REFRESH_S = 5
+MIN_SENTENCES = 50     # prima di 50 frasi l'intervallo è troppo largo per fermare un run
+# -------------------------------------
+
+
+@st.cache_data(ttl=600)
+def load_human(sheet: str) -> dict:
+    # id e best_human in una batch_get; senza best_human (donna libera) l'etichetta
+    # su cui concordano tutti gli annotatori
+    scopes = [
+        "https://www.googleapis.com/auth/spreadsheets",
+        "https://www.googleapis.com/auth/drive"
+    ]
+    creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=scopes)
+    client = gspread.authorize(creds)
+    ws = open_worksheet(client, sheet, ANALYSIS)
+    header = ws.row_values(1)
+    lower = [h.lower() for h in header]
+    raters = [header[lower.index(ADJUDICATED)]] if ADJUDICATED in lower else annotator_columns(header)
+    cols = [header[lower.index("id")]] + raters
+    data = ws.batch_get([f"{c}2:{c}" for c in (_column_letter(header.index(h) + 1) for h in cols)])
+    ids = [r[0] if r else "" for r in data[0]]
+    frame = pd.DataFrame({"id": ids})
+    for name, col in zip(raters, data[1:]):
+        values = [r[0] if r else "" for r in col][:len(ids)]
+        frame[name] = values + [""] * (len(ids) - len(values))
+    labels = human_labels(frame, raters)
+    return {i: int(l) for i, l in labels.items() if l > 0}
+
+
+@st.cache_resource
+def open_stores():
+    return EventStream(), ExperimentRegistry(REGISTRY_PATH)
+
+
+st.title("Accordo live dei classificatori con le etichette umane")
+task = st.sidebar.selectbox("Task", list(TASKS))
+sheet, n_classes = TASKS[task]
+min_agreement = st.sidebar.slider("Accordo minimo accettabile", 0.0, 1.0, 0.6, 0.05)
+stream, registry = open_stores()
+
+# aggregati per sessione: al primo avvio si ripiega tutto lo stream, poi solo il nuovo
+if st.session_state.get("live_task") != task:
+    st.session_state.live_task = task
+    st.session_state.agreement = RunningAgreement(n_classes, load_human(sheet))
+if st.sidebar.button("Ricarica etichette umane"):
+    load_human.clear()
+    # le etichette umane cambiano: si riparte da zero sullo stream
+    st.session_state.agreement = RunningAgreement(n_classes, load_human(sheet))
+
+
+@st.fragment(run_every=REFRESH_S)
+def live_view():
+    agg = st.session_state.agreement
+    while agg.consume(stream, task):
+        pass
+    summary = agg.summary()
+    if summary.empty:
+        st.info("Nessun evento per questo task: avvia un classificatore.")
+        return
+    runs = registry.runs(task).set_index("run_id")[["model", "prompt_version"]]
+    summary = runs.join(summary, how="inner")
+    low, high = proportion_confint((summary["agreement"] * summary["n"]).round(), summary["n"].clip(lower=1),
+                                   method="wilson")
+    summary["ci_low"], summary["ci_high"] = low, high
+    # sotto soglia con buona confidenza: anche il limite alto dell'intervallo è sotto
+    summary["sotto_soglia"] = (summary["n"] >= MIN_SENTENCES) & (summary["ci_high"] < min_agreement)
+    summary["fermato"] = [stream.stopped(r) for r in summary.index]
+    st.caption(f"Ultimo evento: {agg.seq}")
+    st.dataframe(summary.round(3), use_container_width=True)
+
+    for run_id, row in summary[summary["sotto_soglia"] & ~summary["fermato"]].iterrows():
+        st.error(f"Run {run_id} ({row['model']}, {row['prompt_version']}): accordo {row['agreement']:.2f} "
+                 f"su {row['n']} frasi, intervallo [{row['ci_low']:.2f}, {row['ci_high']:.2f}]")
+        if st.button(f"Ferma run {run_id}", key=f"stop_{run_id}"):
+            stream.request_stop(run_id, f"accordo {row['agreement']:.2f} su {row['n']} frasi")
+    for run_id in summary.index[summary["fermato"]]:
+        if st.button(f"Riprendi run {run_id}", key=f"resume_{run_id}"):
+            stream.resume(run_id)
+
+    run_id = st.selectbox("Matrice di confusione del run", list(summary.index),
+                          format_func=lambda r: f"{r} · {summary.loc[r, 'model']} · {summary.loc[r, 'prompt_version']}")
+    st.dataframe(agg.confusion_frame(run_id), use_container_width=True)
+
+
+live_view()
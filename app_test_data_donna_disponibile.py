@@ -6,8 +6,12 @@ import json
 import os
 import gspread
 from google.oauth2.service_account import Credentials
+from sheets_quota import open_worksheet, INTERACTIVE
+from diversity_sampler import diversity_order
+from shared_corpus import SharedCorpus, corpus_path
 
 # --------- Config --------------------
+CORPUS_TTL_S = 600   # ogni quanto il corpus condiviso rilegge lo sheet (righe nuove)
 SHEET_NAME = "test data donna disponibile"
 
 
@@ -37,8 +41,10 @@ st.sidebar.markdown("""
 # -------------------------------------
 
 
-def load_sentences(annotator_input):
-    # connect to Google Sheet
+@st.cache_resource(ttl=CORPUS_TTL_S, show_spinner="Carico il corpus...")
+def load_corpus():
+    # un solo corpus (frasi in Arrow memory-mapped), worksheet e header per tutte
+    # le sessioni; ogni CORPUS_TTL_S si rilegge lo sheet per le righe nuove
     scopes = [
         "https://www.googleapis.com/auth/spreadsheets",
         "https://www.googleapis.com/auth/drive"
@@ -48,52 +54,16 @@ def load_sentences(annotator_input):
         scopes=scopes
     )
     client = gspread.authorize(creds)
-    ws = client.open(SHEET_NAME).sheet1
-
-    # fetch all data
-    all_values = ws.get_all_values()
-    header = all_values[0]
-    rows = all_values[1:]
-    total_count = len(rows)
-
-    # track original sheet row numbers
-    sheet_rows = list(range(2, len(rows) + 2))
-
-    df = pd.DataFrame(rows, columns=header)
-    # record sheet row for each DataFrame row
-    df["__sheet_row"] = sheet_rows
-
-    # ensure an 'id' column exists
-    if "id" in df.columns:
-        df["id"] = df["id"].astype(int)
-    else:
-        df.insert(0, "id", df.index)  # fallback to DataFrame index
-
-    df["date"] = pd.to_datetime(df["date"], errors="coerce")
-
-    # normalize annotator name case-insensitively
-    annotator_input = annotator_input.strip()
-    lower_input = annotator_input.lower()
-    # map existing headers lower→original
-    lower_header_map = {h.lower(): h for h in header}
-    if lower_input in lower_header_map:
-        annotator = lower_header_map[lower_input]
-    else:
-        annotator = lower_input
-        # add new column to DataFrame and sheet
-        df[annotator] = ""
-        ws.update_cell(1, len(header) + 1, annotator)
-        header.append(annotator)
-
-    done = df[df[annotator] != ""]["id"].tolist()
-    done_count = len(done)
-    todo = df[~df["id"].isin(done)].sample(frac=1, random_state=42)
-    return todo.reset_index(drop=True), ws, header, done_count, total_count, annotator
-
-def save_annotation(ws, header, sheet_row, label, annotator):
+    ws = open_worksheet(client, SHEET_NAME, INTERACTIVE)
+    values = ws.get_all_values()
+    corpus = SharedCorpus(ws, corpus_path(SHEET_NAME), values)
+    # ordine casuale fisso (come sample(frac=1, random_state=42)): valutazione non distorta
+    corpus.set_order(diversity_order(corpus.sentences(), "random"))
+    return corpus
+
+def save_annotation(corpus, sheet_row, label, annotator):
     # update the cell at the known sheet row
-    col_number = header.index(annotator) + 1
-    ws.update_cell(sheet_row, col_number, str(label))
+    corpus.ws.update_cell(sheet_row, corpus.column_number(annotator), str(label))
 
 st.title("Annotazione: significato di «donna disponibile» (categorie 1-4)")
 
@@ -102,22 +72,34 @@ if not annotator:
     st.warning("Per favore inserisci il tuo nome o nickname per cominciare.")
     st.stop()
 
-# Initialize session state for this annotator
+corpus = load_corpus()
+
+# Initialize session state for this annotator: solo le posizioni nel corpus
+# condiviso delle frasi ancora da annotare, nell'ordine di annotazione
 if st.session_state.get("annotator") != annotator:
-    df_loaded, ws, header, done_count, total_count, canonical_annotator = load_sentences(annotator)
+    canonical_annotator = corpus.add_annotator(annotator.strip().lower())
+    order, done_count = corpus.annotator_todo(canonical_annotator)
     st.session_state.annotator = canonical_annotator
-    st.session_state.todo_df = df_loaded
-    st.session_state.ws = ws
-    st.session_state.header = header
+    st.session_state.order = order
     st.session_state.done_count = done_count
-    st.session_state.total_count = total_count
+    st.session_state.total_count = len(corpus)
     st.session_state.pointer = 0
     st.session_state.history = []
     st.session_state.finished = False
+    st.session_state.corpus_version = corpus.version
+elif st.session_state.get("corpus_version") != corpus.version:
+    # corpus riletto dopo CORPUS_TTL_S: le posizioni della sessione puntavano
+    # alla tabella vecchia (righe riordinate o cancellate nello sheet), quindi
+    # si ricalcolano le frasi da annotare dalla colonna dell'annotatore
+    order, done_count = corpus.annotator_todo(st.session_state.annotator)
+    st.session_state.order = order
+    st.session_state.done_count = done_count
+    st.session_state.total_count = len(corpus)
+    st.session_state.pointer = 0
+    st.session_state.history = []
+    st.session_state.corpus_version = corpus.version
 
-df = st.session_state.todo_df
-ws = st.session_state.ws
-header = st.session_state.header
+order = st.session_state.order
 done_count = st.session_state.done_count
 total_count = st.session_state.total_count
 
@@ -128,17 +110,17 @@ if st.session_state.finished:
  # display progress of all annotators
 st.markdown(f"**Annotazioni già effettuate da tutti gli annotatori**: {done_count} / {total_count}")
 # display progress of current annotator in this session
-remaining = len(st.session_state.todo_df)
+remaining = len(order)
 current_index = st.session_state.pointer + 1
 st.markdown(f"**Frase corrente da annotare**: {current_index} / {remaining}")
 
-if df.empty:
+if len(order) == 0:
     st.success("Tutte le frasi sono state annotate. Grazie!")
     st.stop()
 
 pointer = st.session_state.pointer
 try:
-    row = df.iloc[pointer]
+    row = corpus.row(order[pointer])
 except IndexError:
     st.success("Hai terminato tutte le frasi. Grazie!")
     st.stop()
@@ -159,8 +141,7 @@ st.caption("Seleziona una categoria e poi premi un pulsante.")
 # define callbacks for saving and navigation
 def on_save():
     # save current annotation
-    save_annotation(st.session_state.ws, st.session_state.header,
-                    row["__sheet_row"], st.session_state.label,
+    save_annotation(corpus, row["__sheet_row"], st.session_state.label,
                     st.session_state.annotator)
     # advance pointer
     st.session_state.history.append(st.session_state.pointer)
@@ -6,9 +6,21 @@ import json
 import os
 import gspread
 from google.oauth2.service_account import Credentials
+from sheets_quota import open_worksheet, INTERACTIVE
+from corpus_index import CorpusIndex, sentence_content_ids
+from diversity_sampler import diversity_order
+from shared_corpus import SharedCorpus, corpus_path
+from active_learning import queue_path, load_queue, reorder_todo
 
 # --------- Config --------------------
+# ordine delle frasi: "random" (storico), "cluster"/"farthest" (diversità: meno
+# doppioni di fila ma, in simulazione, più etichette necessarie rispetto a
+# "random", vedi diversity_sampler.py) o "active" (coda di active_learning.py serve, se gira; altrimenti "random")
+ORDER = "random"
+CORPUS_TTL_S = 600   # ogni quanto il corpus condiviso rilegge lo sheet (righe nuove)
 SHEET_NAME = "Training_data_donna_libera"
+EXPRESSION = "donna libera"
+INDEX_PATH = os.environ.get("CORPUS_INDEX_PATH", "corpus_index.sqlite")
 
 SYSTEM_PROMPT = """
 Sei un classificatore che assegna ogni frase a una di queste categorie sul significato dell'espressione "donna libera":
@@ -77,11 +89,48 @@ st.sidebar.markdown("""
 **6 → Libera – status legale o giudiziario**: donna che ha ottenuto la libertà in senso giuridico (ad esempio dopo detenzione, assoluzione, o proscioglimento). Uso neutro o descrittivo.  
     es. "Dopo vent'anni di carcere, Patrizia Reggiani è una donna libera."  
 """)
+
+# --- Ricerca nel corpus (solo se l'indice locale esiste) ---
+@st.cache_resource
+def open_index(path):
+    # una connessione condivisa da tutte le sessioni
+    return CorpusIndex(path)
+
+def parse_years(text):
+    # "2019" → 2019, "2016-2018" → (2016, 2018)
+    parts = [p.strip() for p in text.split("-") if p.strip()]
+    if not parts or not all(p.isdigit() for p in parts):
+        return None
+    return int(parts[0]) if len(parts) == 1 else (int(parts[0]), int(parts[1]))
+
+def parse_labels(text):
+    # "gpt-4o=2, best_human=1" → {"gpt-4o": 2, "best_human": 1}
+    labels = {}
+    for item in text.split(","):
+        source, _, value = item.partition("=")
+        if source.strip() and value.strip().isdigit():
+            labels[source.strip()] = int(value)
+    return labels
+
+search_index = open_index(INDEX_PATH) if os.path.exists(INDEX_PATH) else None
+if search_index is not None:
+    st.sidebar.subheader("Cerca nel corpus")
+    query = st.sidebar.text_input("Parole (es. carcere, sentenz*)")
+    years_text = st.sidebar.text_input("Anno o intervallo (es. 2019, 2016-2018)")
+    labels_text = st.sidebar.text_input("Etichette (es. gpt-4_1=2, best_human=1)")
+    if query or years_text or labels_text:
+        results = search_index.search(text=query or None, years=parse_years(years_text),
+                                      expression=EXPRESSION, labels=parse_labels(labels_text), limit=50)
+        st.sidebar.caption(f"{len(results)} risultati (max 50)")
+        st.sidebar.dataframe(results.drop(columns=["content_id", "expression"], errors="ignore"),
+                             hide_index=True)
 # -------------------------------------
 
 
-def load_sentences(annotator_input):
-    # connect to Google Sheet
+@st.cache_resource(ttl=CORPUS_TTL_S, show_spinner="Carico il corpus...")
+def load_corpus():
+    # un solo corpus (frasi in Arrow memory-mapped), worksheet e header per tutte
+    # le sessioni; ogni CORPUS_TTL_S si rilegge lo sheet per le righe nuove
     scopes = [
         "https://www.googleapis.com/auth/spreadsheets",
         "https://www.googleapis.com/auth/drive"
@@ -91,52 +140,19 @@ def load_sentences(annotator_input):
         scopes=scopes
     )
     client = gspread.authorize(creds)
-    ws = client.open(SHEET_NAME).sheet1
-
-    # fetch all data
-    all_values = ws.get_all_values()
-    header = all_values[0]
-    rows = all_values[1:]
-    total_count = len(rows)
-
-    # track original sheet row numbers
-    sheet_rows = list(range(2, len(rows) + 2))
-
-    df = pd.DataFrame(rows, columns=header)
-    # record sheet row for each DataFrame row
-    df["__sheet_row"] = sheet_rows
-
-    # ensure an 'id' column exists
-    if "id" in df.columns:
-        df["id"] = df["id"].astype(int)
-    else:
-        df.insert(0, "id", df.index)  # fallback to DataFrame index
-
-    df["date"] = pd.to_datetime(df["date"], errors="coerce")
-
-    # normalize annotator name case-insensitively
-    annotator_input = annotator_input.strip()
-    lower_input = annotator_input.lower()
-    # map existing headers lower→original
-    lower_header_map = {h.lower(): h for h in header}
-    if lower_input in lower_header_map:
-        annotator = lower_header_map[lower_input]
-    else:
-        annotator = annotator_input
-        # add new column to DataFrame and sheet
-        df[annotator] = ""
-        ws.update_cell(1, len(header) + 1, annotator)
-        header.append(annotator)
-
-    done = df[df[annotator] != ""]["id"].tolist()
-    done_count = len(done)
-    todo = df[~df["id"].isin(done)].sample(frac=1, random_state=42)
-    return todo.reset_index(drop=True), ws, header, done_count, total_count, annotator
-
-def save_annotation(ws, header, sheet_row, label, annotator):
+    ws = open_worksheet(client, SHEET_NAME, INTERACTIVE)
+    values = ws.get_all_values()
+    corpus = SharedCorpus(ws, corpus_path(SHEET_NAME), values)
+    corpus.set_order(diversity_order(corpus.sentences(), "random" if ORDER == "active" else ORDER))
+    # allinea le etichette dell'indice di ricerca con lo stato dello sheet
+    if search_index is not None:
+        df = pd.DataFrame(values[1:], columns=values[0])
+        search_index.update_from_sheet(df, [h for h in values[0] if h not in ("id", "date", "sentence")])
+    return corpus
+
+def save_annotation(corpus, sheet_row, label, annotator):
     # update the cell at the known sheet row
-    col_number = header.index(annotator) + 1
-    ws.update_cell(sheet_row, col_number, str(label))
+    corpus.ws.update_cell(sheet_row, corpus.column_number(annotator), str(label))
 
 st.title("Annotazione: significato di «donna libera»")
 
@@ -145,22 +161,46 @@ if not annotator:
     st.warning("Per favore inserisci il tuo nome o nickname per cominciare.")
     st.stop()
 
-# Initialize session state for this annotator
+corpus = load_corpus()
+
+# Initialize session state for this annotator: solo le posizioni nel corpus
+# condiviso delle frasi ancora da annotare, nell'ordine di annotazione
 if st.session_state.get("annotator") != annotator:
-    df_loaded, ws, header, done_count, total_count, canonical_annotator = load_sentences(annotator)
+    canonical_annotator = corpus.add_annotator(annotator.strip())
+    order, done_count = corpus.annotator_todo(canonical_annotator)
     st.session_state.annotator = canonical_annotator
-    st.session_state.todo_df = df_loaded
-    st.session_state.ws = ws
-    st.session_state.header = header
+    st.session_state.order = order
     st.session_state.done_count = done_count
-    st.session_state.total_count = total_count
+    st.session_state.total_count = len(corpus)
     st.session_state.pointer = 0
     st.session_state.history = []
     st.session_state.finished = False
-
-df = st.session_state.todo_df
-ws = st.session_state.ws
-header = st.session_state.header
+    st.session_state.queue_mtime = None
+    st.session_state.corpus_version = corpus.version
+elif st.session_state.get("corpus_version") != corpus.version:
+    # corpus riletto dopo CORPUS_TTL_S: le posizioni della sessione puntavano
+    # alla tabella vecchia (righe riordinate o cancellate nello sheet), quindi
+    # si ricalcolano le frasi da annotare dalla colonna dell'annotatore
+    order, done_count = corpus.annotator_todo(st.session_state.annotator)
+    st.session_state.order = order
+    st.session_state.done_count = done_count
+    st.session_state.total_count = len(corpus)
+    st.session_state.pointer = 0
+    st.session_state.history = []
+    st.session_state.queue_mtime = None
+    st.session_state.corpus_version = corpus.version
+
+# la coda dell'active learning si rilegge quando il servizio la riscrive: le
+# frasi dopo quella corrente cambiano ordine senza riavviare l'app
+QUEUE_PATH = queue_path(SHEET_NAME)
+if ORDER == "active" and os.path.exists(QUEUE_PATH) \
+        and st.session_state.get("queue_mtime") != os.path.getmtime(QUEUE_PATH):
+    st.session_state.queue_mtime = os.path.getmtime(QUEUE_PATH)
+    order = st.session_state.order
+    st.session_state.order = order[reorder_todo(corpus.ids[order], st.session_state.pointer,
+                                                load_queue(QUEUE_PATH))]
+
+order = st.session_state.order
 done_count = st.session_state.done_count
 total_count = st.session_state.total_count
 
@@ -173,18 +213,18 @@ if st.session_state.finished:
  # display progress of all annotators
 st.markdown(f"**Annotazioni già effettuate da tutti gli annotatori**: {done_count} / {total_count}")
 # display progress of current annotator in this session
-remaining = len(st.session_state.todo_df)
+remaining = len(order)
 current_index = st.session_state.pointer + 1
 st.markdown(f"**Frase corrente da annotare**: {current_index} / {remaining}")
 
-if df.empty:
+if len(order) == 0:
     st.balloons()
     st.title("Grazie!")
     st.write("Hai completato tutte le annotazioni. Grazie per il tuo contributo!")
     st.stop()
 
 pointer = st.session_state.pointer
-row = df.iloc[pointer]
+row = corpus.row(order[pointer])
 st.markdown(f"### Frase #{row['id']} ({row['date'].date() if not pd.isna(row['date']) else ''})")
 with st.expander("Mostra/Nascondi testo della frase", expanded=True):
     st.write(row["sentence"])
@@ -202,9 +242,12 @@ st.caption("Seleziona una categoria e poi premi un pulsante.")
 # define callbacks for saving and navigation
 def on_save():
     # save current annotation
-    save_annotation(st.session_state.ws, st.session_state.header,
-                    row["__sheet_row"], st.session_state.label,
+    save_annotation(corpus, row["__sheet_row"], st.session_state.label,
                     st.session_state.annotator)
+    # l'etichetta nuova è subito ricercabile
+    if search_index is not None:
+        search_index.update_labels(st.session_state.annotator,
+                                   sentence_content_ids([row["sentence"]]), [st.session_state.label])
     # advance pointer
     st.session_state.history.append(st.session_state.pointer)
     st.session_state.pointer += 1
@@ -1,16 +1,39 @@
-import re
-import json
-import time
 import os
 import tomli
 import gspread
 from google.oauth2.service_account import Credentials
+from sheets_quota import open_worksheet, BATCH
+from experiment_registry import ExperimentRegistry
+from event_stream import EventStream
+from llm_metrics import MetricsStore
+from answer_format import answer_setup, parse_answer
+from functools import partial
+from hedged_requests import Hedger
+from resilient_calls import DeadLetterQueue, ResilientCaller, has_label
+from prompt_layout import PromptLayout, schedule, print_cache_report
+from model_backends import make_backend
+from self_consistency import sc_params, classify_votes, vote_table, review_queue
 from openai import OpenAI
+import pandas as pd
 from tqdm import tqdm
 
 # --- Configurazione ---------------------------------------------------------
 # SERVICE_ACCOUNT_FILE = "/percorso/al/tuo/service_account.json"
 SHEET_NAME           = "Training_data_donna_disponibile"
+TASK                 = "donna_disponibile"
+REGISTRY_PATH        = os.path.expanduser("~/Documents/Programmi Utili/Collegio Superiore/Linguistica/experiments.sqlite")
+# formato della risposta: "json" (storico, {"class": k}) oppure "digit"
+# (una sola cifra con logit_bias e max_tokens=1: meno token e latenza)
+ANSWER_MODE          = "json"
+# duplica una chiamata che non torna entro il p95 del modello (al massimo il 5% in più)
+HEDGE                = False
+# stabilità delle etichette: k campioni per frase in una sola chiamata (n=k,
+# temperatura > 0) sul prompt mod4; 0 = nessun passaggio self-consistency
+SC_SAMPLES           = 0
+# oltre ai modelli OpenAI: "local:<modello>@<url>" (server compatibile OpenAI,
+# es. llama.cpp) oppure "sklearn:<percorso .joblib>" (vedi model_backends.py).
+# Qui le frasi vanno una alla volta: concurrency e batch_size dei backend li usa
+# solo "Classifier Scheduler.py" (e model_backends.benchmark)
 MODELS = [
     "gpt-4.1",
     "gpt-4.1-mini",
@@ -63,6 +86,16 @@ Rispondi **ESCLUSIVAMENTE** con un JSON UTF-8 valido:
   "class": <numero intero tra 1 e 4>
 }
 """
+# parametri della chiamata: fanno parte dell'identità del run nel registro
+PARAMS = {
+    "temperature": 0,
+    "max_tokens": 10,
+    "top_p": 1,
+    "response_format": {"type": "json_object"},
+}
+# prompt, parametri e versione dei run nella modalità di risposta scelta
+PROMPT3, PARAMS3, VERSION3 = answer_setup(ANSWER_MODE, SYSTEM_PROMPT3, PARAMS, 3, "mod3")
+PROMPT4, PARAMS4, VERSION4 = answer_setup(ANSWER_MODE, SYSTEM_PROMPT4, PARAMS, 4, "mod4")
 
 
 
@@ -71,7 +104,7 @@ Rispondi **ESCLUSIVAMENTE** con un JSON UTF-8 valido:
 openai_api_key = os.getenv("OPENAI_API_KEY")
 if not openai_api_key:
     raise RuntimeError("Devi esportare OPENAI_API_KEY nell'ambiente")
-client = OpenAI(api_key=openai_api_key)
+client = OpenAI(api_key=openai_api_key, max_retries=0)  # i ritentativi li fa ResilientCaller
 
 # 2) Google Sheets client
 scopes = ["https://www.googleapis.com/auth/spreadsheets",
@@ -83,105 +116,110 @@ with open(secrets_path, "rb") as f:
 service_account_info = toml_data["gcp_service_account"]
 creds = Credentials.from_service_account_info(service_account_info, scopes=scopes)
 gc = gspread.authorize(creds)
-ws = gc.open(SHEET_NAME).sheet1
-
-# --- Prepara la colonna per ciascun modello --------------------------------
-
-header = ws.row_values(1)
-for mdl in MODELS:
-    base = mdl.replace(".", "_")
-    new_col = f"mod3_{base}"
-    if new_col not in header:
-        header.append(new_col)
-        ws.update_cell(1, len(header), new_col)
-
-# --- Prepara le colonne per la quarta classificazione (mod4) ---
-header = ws.row_values(1)
-for mdl in MODELS:
-    base = mdl.replace(".", "_")
-    new_col4 = f"mod4_{base}"
-    if new_col4 not in header:
-        header.append(new_col4)
-        ws.update_cell(1, len(header), new_col4)
-
-
-# ricava nuovamente colonne e mappa nome→indice
-header = ws.row_values(1)
-col_index = {name: idx+1 for idx, name in enumerate(header)}
+ws = open_worksheet(gc, SHEET_NAME, BATCH)
+
+# --- Registro degli esperimenti ---------------------------------------------
+# ogni (prompt, modello, parametri) è un run del registro: le predizioni non
+# finiscono più in nuove colonne mod3_*/mod4_* dello sheet
+# ogni etichetta va anche nello stream di eventi letto dalla dashboard live (app_live_agreement.py)
+registry = ExperimentRegistry(REGISTRY_PATH, events=EventStream())
+metrics = MetricsStore()
+# un backend per modello, ciascuno con la sua concorrenza, i suoi batch e i suoi costi
+# (il nome del backend, con l'hash per i modelli sklearn, è il modello del run)
+backends = {mdl: make_backend(mdl, client) for mdl in MODELS}
+runs3 = {mdl: registry.get_or_create_run(TASK, PROMPT3, backends[mdl].name, PARAMS3, prompt_version=VERSION3)
+         for mdl in MODELS}
+runs4 = {mdl: registry.get_or_create_run(TASK, PROMPT4, backends[mdl].name, PARAMS4, prompt_version=VERSION4)
+         for mdl in MODELS}
+
+# prefisso statico byte-stabile per la cache dei prompt di OpenAI
+layout3 = PromptLayout(PROMPT3, VERSION3)
+layout4 = PromptLayout(PROMPT4, VERSION4)
+hedger = Hedger() if HEDGE else None
+# ritentativi con backoff, dead-letter per gli elementi che falliscono, circuit breaker per modello
+dead_letter = DeadLetterQueue()
+caller = ResilientCaller(dead_letter)
 
 # --- Funzione di classificazione -------------------------------------------
-def classify_with_model(sentence: str, model_name: str) -> int:
-    resp = client.chat.completions.create(
-        model=model_name,
-        messages=[
-            {"role": "system",  "content": SYSTEM_PROMPT3},
-            {"role": "user",    "content": sentence}
-        ],
-        temperature=0,
-        max_tokens=10,
-        top_p=1,
-        response_format={"type": "json_object"}
-    )
-    txt = resp.choices[0].message.content.strip()
-    m = re.search(r'"?class"?\s*[:=]\s*([1-3])', txt)
-    if m:
-        return int(m.group(1))
-    try:
-        return int(json.loads(txt)["class"])
-    except:
-        return None
-
-# --- Itera su tutte le frasi e riempi le colonne ----------------------------
-all_rows = ws.get_all_values()[1:]  # esclude header
+def classify_with_model(sentence: str, model_name: str, layout: PromptLayout = layout3,
+                        params: dict = PARAMS3, n_classes: int = 3, sentence_id=None):
+    # token, latenza e retry di ogni chiamata finiscono nello store delle metriche
+    with metrics.track(backends[model_name].name, TASK, layout.hash, sentence_id) as call:
+        resp = backends[model_name].complete(layout, sentence, params)
+        call.response(resp)
+        txt = resp.choices[0].message.content or ""
+        # validatore rigido: una classe valida o None (mai una classe inventata)
+        cls = parse_answer(txt, n_classes, ANSWER_MODE)
+        call.set_label(cls)
+    return cls, txt
+
+# --- Itera su tutte le frasi e registra le predizioni -----------------------
+values = ws.get_all_values()
+header, all_rows = values[0], values[1:]  # esclude header
 print(f"Totale frasi da processare: {len(all_rows)}")
 
-for row_idx, row in enumerate(tqdm(all_rows, desc="Classifying"), start=2):
-    sentence = row[header.index("sentence")]  # presuppone colonna "sentence"
-    # salta se già classificate (ad es. first model già presente)
-    first_model_col = f"mod3_{MODELS[0].replace('.', '_')}"
-    if row[col_index[first_model_col]-1].strip():
-        continue
-
-    # per ciascun modello
-    for mdl in MODELS:
-        base = mdl.replace(".", "_")
-        col_name = f"mod3_{base}"
-        cls = classify_with_model(sentence, mdl)
-        # scrivi subito in cella (puoi anche accumulare e batch-aggiornare)
-        ws.update_cell(row_idx, col_index[col_name], str(cls))
-        time.sleep(0.3)  # per non superare rate limit
-
-
-# --- Quarta classificazione: usa SYSTEM_PROMPT4 e popola mod4 col ---
+# le vecchie colonne mod3_*/mod4_* dello sheet vengono importate una volta nel registro
+legacy = pd.DataFrame(all_rows, columns=header)
+registry.import_sheet_columns(TASK, legacy, {"mod3": SYSTEM_PROMPT3}, PARAMS, n_classes=3)
+registry.import_sheet_columns(TASK, legacy, {"mod4": SYSTEM_PROMPT4}, PARAMS, n_classes=4)
+
+
+def run_prompt(runs: dict, layout: PromptLayout, params: dict, n_classes: int, desc: str) -> None:
+    # una versione del prompt alla volta, a blocchi di frasi e un modello alla
+    # volta: le richieste con lo stesso prefisso arrivano a ridosso (cache)
+    layout.warn_if_short()
+    done = {mdl: registry.done_ids(run) for mdl, run in runs.items()}
+    blocked = {mdl: dead_letter.permanent_ids(TASK, mdl, layout.version) for mdl in MODELS}
+    for mdl, row in tqdm(schedule(all_rows, MODELS), total=len(all_rows) * len(MODELS), desc=desc):
+        sentence = row[header.index("sentence")]  # presuppone colonna "sentence"
+        sentence_id = row[header.index("id")]
+        # saltando le frasi già classificate in questo run
+        if sentence_id in done[mdl] or sentence_id in blocked[mdl]:
+            continue
+        # run fermato dalla dashboard (accordo troppo basso): le frasi restanti si saltano
+        if registry.events.stopped(runs[mdl]):
+            continue
+        attempt = classify_with_model if hedger is None else partial(hedger.call, mdl, classify_with_model)
+        result = caller.call(mdl, attempt, sentence, mdl, layout, params, n_classes, sentence_id,
+                             validate=has_label, item={"task": TASK, "model": mdl, "prompt_version": layout.version,
+                                                       "sentence_id": sentence_id})
+        if result is None:
+            continue  # in dead-letter: ritentata al prossimo run (mai, se l'errore è permanente)
+        cls, txt = result
+        registry.record(runs[mdl], sentence_id, cls, raw=txt)
+
+
+# gli errori transitori del run precedente si ritentano, quelli permanenti no
+dead_letter.clear_retryable(TASK)
+
+run_prompt(runs3, layout3, PARAMS3, 3, "Classifying")
+
+# --- Quarta classificazione: usa SYSTEM_PROMPT4 (run mod4) ---
 print("Starting fourth classification run (mod4)...")
-for row_idx, row in enumerate(tqdm(all_rows, desc="Classifying mod4"), start=2):
-    sentence = row[header.index("sentence")]
-    first_mod4 = f"mod4_{MODELS[0].replace('.', '_')}"
-    if row[col_index[first_mod4]-1].strip():
-        continue
-    for mdl in MODELS:
-        base = mdl.replace(".", "_")
-        col4 = f"mod4_{base}"
-        resp = client.chat.completions.create(
-            model=mdl,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT4},
-                {"role": "user",   "content": sentence}
-            ],
-            temperature=0,
-            max_tokens=10,
-            top_p=1,
-            response_format={"type": "json_object"}
-        )
-        txt4 = resp.choices[0].message.content.strip()
-        # estrai classe (1-4)
-        m4 = re.search(r'"?class"?\s*[:=]\s*([1-4])', txt4)
-        cls4 = int(m4.group(1)) if m4 else None
-        if cls4 is None:
-            try:
-                cls4 = int(json.loads(txt4)["class"])
-            except:
-                cls4 = None
-        ws.update_cell(row_idx, col_index[col4], str(cls4))
-        time.sleep(0.3)
-
+run_prompt(runs4, layout4, PARAMS4, 4, "Classifying mod4")
+
+# --- Self-consistency sul prompt mod4 (voti ed entropia per frase) ---
+if SC_SAMPLES:
+    params_sc = sc_params(PARAMS4, SC_SAMPLES)
+    runs_sc = {mdl: registry.get_or_create_run(TASK, PROMPT4, backends[mdl].name, params_sc, prompt_version=f"{VERSION4}_sc")
+               for mdl in MODELS}
+    done = {mdl: registry.done_ids(run) for mdl, run in runs_sc.items()}
+    for mdl, row in tqdm(schedule(all_rows, MODELS), total=len(all_rows) * len(MODELS), desc="Self-consistency"):
+        sentence_id = row[header.index("id")]
+        if sentence_id in done[mdl]:
+            continue
+        result = caller.call(mdl, classify_votes, backends[mdl], metrics, TASK, layout4, backends[mdl].name, row[header.index("sentence")],
+                             params_sc, 4, ANSWER_MODE, sentence_id, validate=has_label,
+                             item={"task": TASK, "model": mdl, "prompt_version": f"{VERSION4}_sc",
+                                   "sentence_id": sentence_id})
+        if result is None:
+            continue
+        cls, votes_json = result
+        registry.record(runs_sc[mdl], sentence_id, cls, raw=votes_json)
+    # le frasi più incerte (entropia alta o modelli in disaccordo) vanno riviste a mano
+    queue = review_queue(vote_table(registry, runs_sc))
+    queue.to_csv("review_queue_disponibile.csv")
+    print(f"Frasi incerte da rivedere: {len(queue)} (review_queue_disponibile.csv)")
+
+print_cache_report(metrics, TASK)
+dead_letter.print_summary(TASK)
@@ -0,0 +1,212 @@
+import os
+import sqlite3
+import threading
+import pandas as pd
+
+from splitting import content_ids
+from text_cleaning import normalized_key
+
+# --- Indice di ricerca sul corpus di concordanze ----------------------------
+# sentences: una riga per frase (content_id, data, anno, espressione cercata)
+# sentences_fts: indice FTS5 sul testo (senza accenti, maiuscole indifferenti)
+# labels: ultima etichetta per (frase, sorgente) — annotatori e modelli,
+#         aggiornata riga per riga quando un'etichetta cambia
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sentences (
+    rowid      INTEGER PRIMARY KEY,
+    content_id TEXT UNIQUE NOT NULL,
+    date       TEXT,
+    year       INTEGER,
+    expression TEXT,
+    sentence   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sentences_year ON sentences (year);
+CREATE INDEX IF NOT EXISTS sentences_expression ON sentences (expression, year);
+CREATE VIRTUAL TABLE IF NOT EXISTS sentences_fts USING fts5 (
+    sentence, content='sentences', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS labels (
+    content_id TEXT NOT NULL,
+    source     TEXT NOT NULL,
+    label      INTEGER NOT NULL,
+    PRIMARY KEY (content_id, source)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS labels_source ON labels (source, label, content_id);
+"""
+BATCH_ROWS = 50_000
+
+
+def fts_query(text: str) -> str:
+    # each word becomes a quoted FTS5 term (no syntax errors from user input);
+    # a trailing * keeps prefix search: carcer* → "carcer"*
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def sentence_content_ids(sentences) -> pd.Series:
+    # stesso content_id dei Create Database: hash della chiave normalizzata
+    return content_ids(normalized_key(sentences))
+
+
+class CorpusIndex:
+
+    def __init__(self, path: str, readonly: bool = False):
+        self.path = path
+        # una connessione condivisa tra le sessioni Streamlit (st.cache_resource):
+        # letture e transazioni passano una alla volta (RLock: update_from_sheet
+        # tiene il lock su tutte le colonne)
+        self._lock = threading.RLock()
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+
+    # --- ingestione -----------------------------------------------------------
+    def add_sentences(self, df: pd.DataFrame, expression: str) -> int:
+        # df: date, sentence, content_id (output di load_concordance + content_ids);
+        # frasi già indicizzate vengono saltate (il content_id dipende dal testo)
+        dates = pd.to_datetime(df["date"], errors="coerce")
+        rows = pd.DataFrame({
+            "content_id": df["content_id"].astype(str).to_numpy(),
+            "date": dates.dt.strftime("%Y-%m-%d").to_numpy(),
+            "year": dates.dt.year.astype("Int64").to_numpy(),
+            "expression": expression,
+            "sentence": df["sentence"].astype(str).to_numpy(),
+        })
+        rows = rows.astype(object).where(rows.notna(), None)
+        with self._lock, self.conn:
+            before = self.conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM sentences").fetchone()[0]
+            for start in range(0, len(rows), BATCH_ROWS):
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO sentences (content_id, date, year, expression, sentence) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows.iloc[start:start + BATCH_ROWS].itertuples(index=False, name=None))
+            # solo le righe nuove entrano nell'indice full-text
+            added = self.conn.execute(
+                "INSERT INTO sentences_fts (rowid, sentence) SELECT rowid, sentence FROM sentences "
+                "WHERE rowid > ?", (before,)).rowcount
+        return added
+
+    def update_labels(self, source: str, content_id_values, labels) -> None:
+        # ultima etichetta per sorgente; None/""/non numerica rimuove l'etichetta
+        labels = pd.to_numeric(pd.Series(list(labels), dtype=object), errors="coerce")
+        ids = [str(c) for c in content_id_values]
+        keep = labels.notna().to_numpy()
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM labels WHERE content_id = ? AND source = ?",
+                                  [(c, source) for c, k in zip(ids, keep) if not k])
+            self.conn.executemany("INSERT OR REPLACE INTO labels VALUES (?, ?, ?)",
+                                  [(c, source, int(l)) for c, l, k in zip(ids, labels, keep) if k])
+
+    def update_from_sheet(self, df: pd.DataFrame, label_cols: list, sentence_col: str = "sentence") -> None:
+        # le colonne dello sheet (best_human, annotatori, ...) diventano sorgenti
+        ids = sentence_content_ids(df[sentence_col])
+        with self._lock:
+            for col in label_cols:
+                if col in df.columns:
+                    self.update_labels(col, ids, df[col])
+
+    # --- ricerca --------------------------------------------------------------
+    def _where(self, text, years, expression, labels):
+        # → (join + where SQL, parametri) condivisi da search e facets
+        joins, join_args, conds, args = [], [], [], []
+        # labels: {"gpt-4o": 2, "best_human": 1} → una join per sorgente
+        for i, (source, label) in enumerate((labels or {}).items()):
+            joins.append(f"JOIN labels l{i} ON l{i}.content_id = s.content_id "
+                         f"AND l{i}.source = ? AND l{i}.label = ?")
+            join_args += [source, int(label)]
+        if text:
+            conds.append("s.rowid IN (SELECT rowid FROM sentences_fts WHERE sentences_fts MATCH ?)")
+            args.append(fts_query(text))
+        if years is not None:
+            lo, hi = years if isinstance(years, (tuple, list)) else (years, years)
+            conds.append("s.year BETWEEN ? AND ?")
+            args += [int(lo), int(hi)]
+        if expression:
+            conds.append("s.expression = ?")
+            args.append(expression)
+        where_sql = (" WHERE " + " AND ".join(conds)) if conds else ""
+        return " ".join(joins) + where_sql, join_args + args
+
+    def search(self, text: str = None, years=None, expression: str = None, labels: dict = None,
+               limit: int = 100, offset: int = 0) -> pd.DataFrame:
+        clause, args = self._where(text, years, expression, labels)
+        with self._lock:
+            df = pd.read_sql_query(
+                f"SELECT s.content_id, s.date, s.expression, s.sentence FROM sentences s {clause} "
+                f"ORDER BY s.date, s.rowid LIMIT ? OFFSET ?", self.conn, params=args + [limit, offset])
+            if df.empty:
+                return df
+            # ultime etichette delle frasi trovate, una colonna per sorgente
+            marks = ",".join("?" * len(df))
+            lab = pd.read_sql_query(f"SELECT content_id, source, label FROM labels WHERE content_id IN ({marks})",
+                                    self.conn, params=df["content_id"].tolist())
+        if not lab.empty:
+            df = df.merge(lab.pivot(index="content_id", columns="source", values="label"),
+                          left_on="content_id", right_index=True, how="left")
+        return df
+
+    def facets(self, text: str = None, years=None, expression: str = None, labels: dict = None,
+               source: str = None) -> dict:
+        # conteggi dei risultati per anno e, se richiesto, per etichetta di source
+        clause, args = self._where(text, years, expression, labels)
+        with self._lock:
+            out = {"year": pd.read_sql_query(
+                f"SELECT s.year, COUNT(*) AS n FROM sentences s {clause} GROUP BY s.year ORDER BY s.year",
+                self.conn, params=args).set_index("year")["n"]}
+            if source:
+                out[source] = pd.read_sql_query(
+                    # la sottoquery viene materializzata una volta sola (niente FTS per riga)
+                    f"SELECT label, COUNT(*) AS n FROM labels WHERE source = ? AND content_id IN "
+                    f"(SELECT s.content_id FROM sentences s {clause}) GROUP BY label ORDER BY label",
+                    self.conn, params=[source] + args).set_index("label")["n"]
+        return out
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM sentences").fetchone()[0]
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import time
+    import numpy as np
+    # benchmark: indice su N frasi sintetiche, poi ricerche tipiche
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = np.random.default_rng(0)
+    words = np.array(["donna", "libera", "disponibile", "carcere", "lavoro", "città", "giudice", "casa",
+                      "famiglia", "sindaco", "ospedale", "scuola", "notizia", "processo", "sentenza"]
+                     + [f"parola{i}" for i in range(5000)])
+    sentences = [" ".join(rng.choice(words, 12)) + f" {i}" for i in range(n)]
+    df = pd.DataFrame({"date": pd.to_datetime("2015-01-01") + pd.to_timedelta(rng.integers(0, 3650, n), "D"),
+                       "sentence": sentences, "content_id": [f"{i:016x}" for i in range(n)]})
+    index = CorpusIndex(os.path.join(tempfile.mkdtemp(), "corpus_index.sqlite"))
+    t0 = time.perf_counter()
+    index.add_sentences(df, "donna libera")
+    print(f"Indicizzazione di {n:,} frasi: {time.perf_counter() - t0:.1f} s")
+    t0 = time.perf_counter()
+    index.update_labels("best_human", df["content_id"][:200_000], rng.integers(1, 7, 200_000))
+    index.update_labels("gpt-4o", df["content_id"][:200_000], rng.integers(1, 7, 200_000))
+    print(f"Etichette (2 × 200k): {time.perf_counter() - t0:.1f} s")
+    for desc, kwargs in [("testo 'carcere' nel 2019", dict(text="carcere", years=2019)),
+                         ("gpt-4o=2 e best_human=1", dict(labels={"gpt-4o": 2, "best_human": 1})),
+                         ("prefisso 'sentenz*' 2016-2018", dict(text="sentenz*", years=(2016, 2018)))]:
+        t0 = time.perf_counter()
+        res = index.search(limit=50, **kwargs)
+        t_search = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        index.facets(source="best_human", **kwargs)
+        print(f"{desc:>32}: {len(res)} risultati in {t_search * 1000:.1f} ms, "
+              f"faccette in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    t0 = time.perf_counter()
+    index.update_labels("best_human", [df["content_id"][5]], [3])
+    print(f"Aggiornamento di una etichetta: {(time.perf_counter() - t0) * 1000:.1f} ms")
@@ -0,0 +1,136 @@
+import fcntl
+import os
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+from analysis_cache import fetch_column
+
+# --- Indice dei disaccordi ----------------------------------------------------
+# Gli script di analisi salvano qui le righe in cui i valutatori (annotatori e
+# modelli) danno etichette diverse: id, riga dello sheet e tutte le etichette.
+# La vista di aggiudicazione (app_adjudication.py) legge solo questo file e,
+# dallo sheet, solo le righe che mostra: il costo non dipende dalla dimensione
+# dello sheet ma dal numero di disaccordi.
+# Più sessioni possono aggiudicare insieme: ogni scrittura del file avviene sotto
+# un lock (<indice>.lock) e adjudicate rilegge il file prima di modificarlo, così
+# nessuno cancella le etichette scritte dagli altri.
+ADJUDICATED = "best_human"
+
+
+def index_path(sheet_name: str) -> str:
+    return f"disagreements_{sheet_name.lower().replace(' ', '_')}.csv"
+
+
+def build_index(frame: pd.DataFrame, raters: list, key_col: str = "id") -> pd.DataFrame:
+    # frame: una riga per frase con __sheet_row e le colonne dei valutatori
+    # (stringhe, "" = vuota), come SheetAnalysisCache.frame(); disaccordo = almeno
+    # due etichette diverse tra quelle presenti. Tutto vettoriale.
+    # la colonna aggiudicata non è un valutatore: finisce a parte in ADJUDICATED
+    raters = [r for r in raters if r != ADJUDICATED]
+    codes = frame[raters].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    ordered = np.sort(codes, axis=1)              # NaN in fondo
+    present = (~np.isnan(ordered)).sum(axis=1)
+    distinct = (np.diff(ordered, axis=1) > 0).sum(axis=1) + (present > 0)
+    mask = distinct >= 2
+    out = frame.loc[mask, [key_col, "__sheet_row"] + list(raters)].rename(columns={"__sheet_row": "sheet_row"})
+    out.insert(2, "n_labels", present[mask])
+    out.insert(3, "n_distinct", distinct[mask])
+    if ADJUDICATED in frame.columns:
+        out[ADJUDICATED] = frame.loc[mask, ADJUDICATED].fillna("").astype(str)
+    else:
+        out[ADJUDICATED] = ""
+    # i disaccordi più ampi per primi
+    return out.sort_values(["n_distinct", "n_labels"], ascending=False, kind="stable").reset_index(drop=True)
+
+
+@contextmanager
+def _index_lock(path: str):
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write_index(index: pd.DataFrame, path: str) -> None:
+    tmp = path + ".tmp"
+    index.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def save_index(index: pd.DataFrame, path: str) -> None:
+    with _index_lock(path):
+        _write_index(index, path)
+
+
+def load_index(path: str) -> pd.DataFrame:
+    index = pd.read_csv(path, dtype=str, keep_default_na=False)
+    index["sheet_row"] = index["sheet_row"].astype(int)
+    return index
+
+
+def fetch_rows(ws, header: list, sheet_rows, columns=("id", "sentence")) -> pd.DataFrame:
+    # lettura a intervalli: una cella per (riga, colonna) richiesta
+    sheet_rows = [int(r) for r in sheet_rows]
+    data = {c: fetch_column(ws, header, c, sheet_rows) for c in columns}
+    return pd.DataFrame({c: [data[c].get(r, "") for r in sheet_rows] for c in columns}, index=sheet_rows)
+
+
+def adjudicate(ws, header: list, index: pd.DataFrame, path: str, sentence_id, label, key_col: str = "id") -> bool:
+    # scrive l'etichetta aggiudicata nella colonna best_human dello sheet e
+    # nell'indice; False se la riga dello sheet non contiene più quell'id
+    # (sheet riordinato: va ricostruito l'indice con lo script di analisi)
+    pos = index.index[index[key_col] == str(sentence_id)][0]
+    sheet_row = int(index.at[pos, "sheet_row"])
+    if fetch_column(ws, header, key_col, [sheet_row]).get(sheet_row, "") != str(sentence_id):
+        return False
+    lower = [h.lower() for h in header]
+    if ADJUDICATED in lower:
+        col = lower.index(ADJUDICATED) + 1
+    else:
+        header.append(ADJUDICATED)
+        col = len(header)
+        # lo sheet può non avere colonne libere oltre l'header: si allarga la griglia
+        if col > ws.col_count:
+            ws.add_cols(col - ws.col_count)
+        ws.update_cell(1, col, ADJUDICATED)
+    ws.update_cell(sheet_row, col, str(label))
+    index.at[pos, ADJUDICATED] = str(label)
+    # la copia della sessione può essere vecchia: si aggiorna solo questa riga
+    # nel file com'è adesso
+    with _index_lock(path):
+        current = load_index(path) if os.path.exists(path) else index
+        current.loc[current[key_col] == str(sentence_id), ADJUDICATED] = str(label)
+        _write_index(current, path)
+    return True
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import time
+    # benchmark: sheet sintetico grande con il 2% di righe in disaccordo
+    # uso: python disagreement_index.py [righe]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    raters = ["Fabio2", "Monica", "mod4_gpt-4o", "mod4_gpt-4_1"]
+    rng = np.random.default_rng(0)
+    base = rng.integers(1, 5, n)
+    labels = np.repeat(base[:, None], len(raters), axis=1).astype(str)
+    flip = rng.random(n) < 0.02
+    labels[flip, rng.integers(0, len(raters), flip.sum())] = "9"
+    labels[rng.random(labels.shape) < 0.2] = ""
+    frame = pd.DataFrame(labels, columns=raters)
+    frame.insert(0, "__sheet_row", np.arange(2, n + 2))
+    frame.insert(0, "id", np.arange(n).astype(str))
+    t0 = time.perf_counter()
+    index = build_index(frame, raters)
+    build_s = time.perf_counter() - t0
+    path = os.path.join(tempfile.mkdtemp(), "disagreements.csv")
+    save_index(index, path)
+    t0 = time.perf_counter()
+    load_index(path)
+    load_ms = (time.perf_counter() - t0) * 1000
+    print(f"{n:,} righe: {len(index):,} disaccordi ({len(index) / n:.1%}), indice costruito in {build_s:.2f} s, "
+          f"{os.path.getsize(path) / 1024:.0f} KB, caricato in {load_ms:.0f} ms")
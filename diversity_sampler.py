@@ -0,0 +1,202 @@
+import hashlib
+import numpy as np
+import pandas as pd
+
+# --- Ordine di annotazione per diversità ---------------------------------------
+# Il corpus è pieno di notizie ripubblicate quasi identiche (la storia di
+# Patrizia Reggiani torna decine di volte): in ordine casuale gli annotatori
+# etichettano più volte la stessa frase. Qui le frasi vengono raggruppate
+# (TF-IDF con hashing in parallelo su tutti i core, proiezione SVD e
+# MiniBatchKMeans: adatto a milioni di righe) e servite:
+#   "cluster"   a turno un elemento per cluster, i quasi-doppioni per ultimi
+#   "farthest"  farthest-point: ogni frase è la più lontana da quelle già servite
+#               (sulle prime FARTHEST_MAX, poi si prosegue con "cluster")
+#   "random"    l'ordine storico sample(frac=1, random_state=42)
+# "cluster" e "farthest" NON riducono le etichette necessarie. Nella simulazione
+# in fondo (corpus donna libera, 2 ripetizioni) servono più etichette che in
+# ordine casuale: per l'accuratezza bilanciata del 60% 1500 con "cluster" contro
+# 1350 con "random", per ≥5 esempi per classe 832 con "farthest" contro 605.
+# Anche le varianti provate (casuale con i quasi-doppioni in fondo,
+# campionamento proporzionale dentro i cluster) non fanno meglio del casuale.
+# L'unico effetto misurato è che tra le prime 500 frasi non ci sono
+# quasi-doppioni (circa 6 con "random"). Per questo le app usano "random" come
+# predefinito.
+N_FEATURES = 2 ** 18
+CHUNK = 50_000
+SVD_DIMS = 64
+FARTHEST_MAX = 5000
+DUP_COS = 0.95          # nella proiezione SVD: quasi-doppione
+WITHIN_MAX = 1000       # frasi per cluster controllate per i doppioni
+
+
+def n_clusters_for(n: int) -> int:
+    # ~ una ventina di frasi per cluster, tra 8 e 2000 cluster
+    return int(np.clip(n // 20, 8, 2000))
+
+
+def embed(sentences, n_jobs: int = -1):
+    # TF-IDF senza vocabolario (HashingVectorizer): i blocchi si vettorizzano in
+    # parallelo e il risultato non dipende dall'ordine delle frasi
+    from joblib import Parallel, delayed
+    from scipy import sparse
+    from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+    vec = HashingVectorizer(n_features=N_FEATURES, ngram_range=(1, 2), alternate_sign=False, norm=None)
+    sentences = list(sentences)
+    chunks = [sentences[i:i + CHUNK] for i in range(0, len(sentences), CHUNK)]
+    counts = Parallel(n_jobs=n_jobs)(delayed(vec.transform)(c) for c in chunks) if len(chunks) > 1 \
+        else [vec.transform(chunks[0])]
+    return TfidfTransformer(sublinear_tf=True).fit_transform(sparse.vstack(counts).tocsr())
+
+
+def reduce(X, dims: int = SVD_DIMS, seed: int = 42) -> np.ndarray:
+    # LSA: proiezione SVD normalizzata, densa e piccola (float32): il clustering
+    # e le distanze costano O(n · dims) invece che sui 2^18 termini
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.preprocessing import normalize
+    X = X[:, np.flatnonzero(X.getnnz(axis=0))]   # solo i termini presenti (hashing: quasi tutti vuoti)
+    dims = min(dims, X.shape[1] - 1, max(X.shape[0] - 1, 1))
+    return normalize(TruncatedSVD(dims, random_state=seed).fit_transform(X)).astype(np.float32)
+
+
+def cluster(Z, n_clusters: int = None, seed: int = 42):
+    # → (etichetta di cluster, distanza dal centro) per ogni frase
+    from sklearn.cluster import MiniBatchKMeans
+    km = MiniBatchKMeans(n_clusters=n_clusters or n_clusters_for(Z.shape[0]), batch_size=4096, n_init=3,
+                         random_state=seed)
+    labels = km.fit_predict(Z)
+    dist = np.linalg.norm(Z - km.cluster_centers_[labels], axis=1)
+    return labels, dist
+
+
+def cluster_order(Z, labels, seed: int = 42) -> np.ndarray:
+    # round-robin tra i cluster (i più grandi per primi); dentro al cluster ordine
+    # casuale, ma i quasi-doppioni (coseno ≥ DUP_COS con una frase già servita
+    # dello stesso cluster, sulle prime WITHIN_MAX) finiscono in fondo al cluster
+    labels = np.asarray(labels)
+    sizes = np.bincount(labels)
+    rng = np.random.default_rng(seed)
+    cluster_rank = np.empty(len(sizes), np.int64)
+    cluster_rank[np.lexsort((rng.random(len(sizes)), -sizes))] = np.arange(len(sizes))
+    within = np.empty(len(labels), np.int64)
+    members = pd.Series(np.arange(len(labels))).groupby(labels).indices
+    for c, idx in members.items():
+        idx = idx[rng.permutation(len(idx))]
+        head = idx[:WITHIN_MAX]
+        dup = np.zeros(len(idx), bool)
+        dup[:len(head)] = (np.tril(Z[head] @ Z[head].T, -1) >= DUP_COS).any(axis=1)
+        within[idx[np.argsort(dup, kind="stable")]] = np.arange(len(idx))
+    return np.lexsort((cluster_rank[labels], within))
+
+
+def farthest_order(Z, first: np.ndarray, n: int = FARTHEST_MAX) -> np.ndarray:
+    # k-center greedy sulla proiezione SVD, partendo dalla prima frase di "first";
+    # le frasi oltre le prime n seguono l'ordine "first"
+    n = min(n, len(Z))
+    chosen = [int(first[0])]
+    nearest = 1 - Z @ Z[chosen[0]]
+    for _ in range(n - 1):
+        nxt = int(nearest.argmax())
+        chosen.append(nxt)
+        nearest = np.minimum(nearest, 1 - Z @ Z[nxt])
+    taken = np.zeros(len(Z), bool)
+    taken[chosen] = True
+    return np.concatenate([np.array(chosen), first[~taken[first]]])
+
+
+def diversity_order(sentences, method: str = "cluster", seed: int = 42, n_clusters: int = None) -> np.ndarray:
+    # permutazione delle posizioni di sentences nell'ordine di annotazione
+    n = len(sentences)
+    if method == "random" or n < 2:
+        return np.random.RandomState(seed).permutation(n)
+    Z = reduce(embed(sentences), seed=seed)
+    labels, _ = cluster(Z, min(n_clusters or n_clusters_for(n), n), seed)
+    order = cluster_order(Z, labels, seed)
+    if method == "farthest":
+        order = farthest_order(Z, order)
+    return order
+
+
+def order_frame(df: pd.DataFrame, method: str = "cluster", seed: int = 42, column: str = "sentence") -> pd.DataFrame:
+    # come df.sample(frac=1, random_state=seed) ma nell'ordine scelto
+    if method == "random":
+        return df.sample(frac=1, random_state=seed)
+    return df.iloc[diversity_order(df[column].astype(str).tolist(), method, seed)]
+
+
+def corpus_fingerprint(sentences) -> str:
+    # chiave di cache per le app: cambia solo se cambiano le frasi
+    h = hashlib.blake2b(digest_size=16)
+    for s in sentences:
+        h.update(str(s).encode("utf-8") + b"\0")
+    return h.hexdigest()
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from keyword_rules import RULES
+    from text_cleaning import load_concordance
+    # simulazione sul corpus "donna libera" (3781 righe, duplicati inclusi). Non
+    # ci sono etichette umane in locale: le classi sono pseudo-etichette dalle
+    # parole chiave (giudiziario, sentimentale, più tre classi rare), il resto è
+    # "emancipata". Per ogni ordine: etichette necessarie per coprire ogni classe
+    # con almeno COVER esempi e per arrivare all'accuratezza obiettivo con
+    # TF-IDF + regressione logistica addestrata sulle frasi già etichettate, più
+    # le etichette sprecate su quasi-doppioni (coseno ≥ DUP con una frase già
+    # servita) tra le prime BUDGET.
+    # uso: python diversity_sampler.py [corpus.txt] [ripetizioni] [random,cluster,farthest]
+    path = sys.argv[1] if len(sys.argv) > 1 else "concordance_preloaded_trends_it_20250625112515.txt"
+    reps = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    COVER, TARGET, STEP, BUDGET, DUP = 5, 0.60, 50, 500, 0.8
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics import balanced_accuracy_score
+
+    df = load_concordance(path)
+    text = df["sentence"].str.lower()
+    y = np.full(len(df), 1)
+    extra = {5: ["schiett*", "franc*", "spontane*"], 3: ["sessual*", "sesso"], 4: ["facile", "poco di buono"]}
+    for rule in RULES["donna libera"]:
+        pattern = "|".join(w.rstrip("*") for w in rule["any"])
+        y[text.str.contains(pattern, regex=True).to_numpy()] = rule["class"]
+    for cls, words in extra.items():
+        y[text.str.contains("|".join(w.rstrip("*") for w in words), regex=True).to_numpy()] = cls
+    print(f"{len(df)} frasi, {df['key'].nunique()} distinte; classi: {np.bincount(y)[1:].tolist()}")
+    X = TfidfVectorizer(ngram_range=(1, 2), min_df=2, sublinear_tf=True).fit_transform(df["sentence"])
+
+    def labels_to_target(order):
+        counts = np.zeros(7, int)
+        cover_at = None
+        for i, cls in enumerate(y[order], 1):
+            counts[cls] += 1
+            if cover_at is None and (counts[1:] >= np.minimum(COVER, np.bincount(y, minlength=7)[1:])).all():
+                cover_at = i
+                break
+        acc_at = None
+        for m in range(STEP, len(order) + 1, STEP):
+            seen = order[:m]
+            if len(np.unique(y[seen])) < 2:
+                continue
+            clf = LogisticRegression(max_iter=1000, class_weight="balanced").fit(X[seen], y[seen])
+            if balanced_accuracy_score(y, clf.predict(X)) >= TARGET:
+                acc_at = m
+                break
+        first = X[order[:BUDGET]]
+        sim = (first @ first.T).toarray()
+        wasted = int((np.tril(sim, -1) >= DUP).any(axis=1).sum())
+        return cover_at, acc_at, wasted
+
+    rows = []
+    for method in sys.argv[3].split(",") if len(sys.argv) > 3 else ("random", "cluster", "farthest"):
+        for rep in range(reps):
+            t0 = time.perf_counter()
+            order = diversity_order(df["sentence"].tolist(), method, seed=rep)
+            order_s = time.perf_counter() - t0
+            cover_at, acc_at, wasted = labels_to_target(order)
+            rows.append({"ordine": method, "rep": rep, "copertura": cover_at, "accuratezza": acc_at,
+                         "doppioni": wasted, "ordine_s": order_s})
+    res = pd.DataFrame(rows).groupby("ordine")[["copertura", "accuratezza", "doppioni", "ordine_s"]].mean()
+    print(f"etichette umane necessarie (media su {reps} ripetizioni): copertura = ≥{COVER} per classe, "
+          f"accuratezza bilanciata (media delle recall) ≥{TARGET:.0%} sul corpus, "
+          f"doppioni = quasi-doppioni tra le prime {BUDGET}")
+    print(res.round(2).to_string())
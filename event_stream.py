@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+# --- Stream locale dei risultati ---------------------------------------------
+# Ogni etichetta scritta nel registro degli esperimenti viene pubblicata anche
+# in un change log su SQLite (seq crescente). La dashboard live legge solo gli
+# eventi dopo l'ultimo seq visto e li ripiega negli aggregati in O(1) per evento,
+# così l'accordo con best_human si vede mentre il run procede e un prompt
+# sbagliato si ferma dopo 50 frasi invece che dopo 800.
+DEFAULT_DB_PATH = os.environ.get(
+    "CLASSIFIER_EVENTS_DB", os.path.expanduser("~/.cache/linguistica/events.sqlite")
+)
+STOP_CHECK_S = 5.0   # ogni quanto i classificatori rileggono le richieste di stop
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts          REAL,
+    task        TEXT,
+    run_id      INTEGER,
+    sentence_id TEXT,
+    label       INTEGER
+);
+CREATE INDEX IF NOT EXISTS events_task_seq ON events (task, seq);
+CREATE TABLE IF NOT EXISTS stops (run_id INTEGER PRIMARY KEY, ts REAL, reason TEXT);
+"""
+
+
+class EventStream:
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._stopped = set()
+        self._stops_read = 0.0
+
+    def publish(self, task: str, run_id: int, sentence_id, label) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO events (ts, task, run_id, sentence_id, label) VALUES (?, ?, ?, ?, ?)",
+                               (time.time(), task, int(run_id), str(sentence_id),
+                                None if label is None else int(label)))
+
+    def read(self, task: str = None, after: int = 0, limit: int = 10000) -> pd.DataFrame:
+        # eventi con seq > after, in ordine
+        query = "SELECT seq, ts, task, run_id, sentence_id, label FROM events WHERE seq > ?"
+        args = [after]
+        if task is not None:
+            query += " AND task = ?"
+            args.append(task)
+        with self._lock:
+            return pd.read_sql_query(query + " ORDER BY seq LIMIT ?", self._conn, params=args + [limit])
+
+    # --- stop dei run dalla dashboard -------------------------------------------
+    def request_stop(self, run_id: int, reason: str = "") -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO stops VALUES (?, ?, ?)", (int(run_id), time.time(), reason))
+
+    def resume(self, run_id: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM stops WHERE run_id = ?", (int(run_id),))
+
+    def stopped(self, run_id: int) -> bool:
+        # letto al massimo ogni STOP_CHECK_S secondi: costa poco anche per ogni frase
+        now = time.monotonic()
+        if now - self._stops_read > STOP_CHECK_S:
+            with self._lock:
+                self._stopped = {r for (r,) in self._conn.execute("SELECT run_id FROM stops")}
+            self._stops_read = now
+        return int(run_id) in self._stopped
+
+
+class RunningAgreement:
+    # confusione umano × modello per run, aggiornata evento per evento. Le
+    # righe/colonne 0 sono "risposta non valida"; un evento che riscrive la
+    # stessa (run, frase) toglie prima il contributo precedente.
+
+    def __init__(self, n_classes: int, human: dict = None):
+        self.n_classes = n_classes
+        self.human = {}
+        self.confusion = {}
+        self.last = {}
+        self.unlabelled = {}
+        self.seq = 0
+        self.set_human(human or {})
+
+    def set_human(self, human: dict) -> None:
+        # sentence_id → etichetta umana (1..k); le etichette mancanti non contano
+        self.human = {str(s): int(l) for s, l in human.items() if 1 <= int(l) <= self.n_classes}
+
+    def add(self, run_id: int, sentence_id, label) -> None:
+        sid = str(sentence_id)
+        pred = int(label) if label is not None and 1 <= int(label) <= self.n_classes else 0
+        cm = self.confusion.get(run_id)
+        if cm is None:
+            cm = self.confusion[run_id] = np.zeros((self.n_classes + 1, self.n_classes + 1), np.int64)
+        prev = self.last.get((run_id, sid))
+        if prev is not None:
+            cm[prev] -= 1
+        h = self.human.get(sid)
+        if h is None:
+            self.last.pop((run_id, sid), None)
+            self.unlabelled[run_id] = self.unlabelled.get(run_id, 0) + (prev is None)
+            return
+        self.last[(run_id, sid)] = (h, pred)
+        cm[h, pred] += 1
+
+    def consume(self, stream: EventStream, task: str = None, limit: int = 10000) -> int:
+        # ripiega gli eventi nuovi; restituisce quanti
+        events = stream.read(task, self.seq, limit)
+        for run_id, sid, label in events[["run_id", "sentence_id", "label"]].itertuples(index=False):
+            self.add(int(run_id), sid, None if pd.isna(label) else label)
+        if len(events):
+            self.seq = int(events["seq"].iloc[-1])
+        return len(events)
+
+    def summary(self) -> pd.DataFrame:
+        rows = []
+        for run_id, cm in self.confusion.items():
+            n = int(cm[1:].sum())
+            correct = int(np.trace(cm[1:, 1:]))
+            row = {"run_id": run_id, "n": n, "agreement": correct / n if n else np.nan,
+                   "invalid": int(cm[1:, 0].sum()), "unlabelled": self.unlabelled.get(run_id, 0)}
+            for k in range(1, self.n_classes + 1):
+                support = cm[k].sum()
+                row[f"recall_{k}"] = cm[k, k] / support if support else np.nan
+            rows.append(row)
+        return pd.DataFrame(rows).set_index("run_id") if rows else pd.DataFrame()
+
+    def confusion_frame(self, run_id: int) -> pd.DataFrame:
+        labels = ["non valida"] + [str(k) for k in range(1, self.n_classes + 1)]
+        cm = self.confusion[run_id][1:]
+        return pd.DataFrame(cm, index=[f"umano {k}" for k in labels[1:]], columns=labels)
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    # benchmark: costo per evento dell'aggiornamento incrementale rispetto al
+    # ricalcolo completo dopo ogni evento (come rilanciare lo script di analisi)
+    # uso: python event_stream.py [n_eventi]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = np.random.default_rng(0)
+    human = {str(i): int(rng.integers(1, 5)) for i in range(n)}
+    preds = [(1 + i % 5, str(i), human[str(i)] if rng.random() < 0.8 else int(rng.integers(1, 5)))
+             for i in range(n)]
+    with tempfile.TemporaryDirectory() as tmp:
+        stream = EventStream(os.path.join(tmp, "events.sqlite"))
+        t0 = time.perf_counter()
+        for run_id, sid, label in preds:
+            stream.publish("demo", run_id, sid, label)
+        publish_us = (time.perf_counter() - t0) / n * 1e6
+        agg = RunningAgreement(4, human)
+        t0 = time.perf_counter()
+        agg.consume(stream, "demo", limit=n)
+        consume_us = (time.perf_counter() - t0) / n * 1e6
+        # ricalcolo completo ogni 100 eventi, sul prefisso già arrivato
+        df = pd.DataFrame(preds, columns=["run_id", "sentence_id", "label"])
+        df["human"] = df["sentence_id"].map(human)
+        t0 = time.perf_counter()
+        for end in range(100, n + 1, 100):
+            part = df.iloc[:end]
+            (part["label"] == part["human"]).groupby(part["run_id"]).mean()
+            pd.crosstab([part["run_id"], part["human"]], part["label"])
+        full_us = (time.perf_counter() - t0) / (n // 100) * 1e6
+    print(agg.summary().round(3).to_string())
+    print(f"publish {publish_us:.0f} µs/evento, aggiornamento incrementale {consume_us:.1f} µs/evento, "
+          f"ricalcolo completo {full_us / 1000:.1f} ms ogni 100 eventi (cresce col run)")
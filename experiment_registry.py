@@ -0,0 +1,223 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from prediction_store import SHEET_COLUMN_RE, encode_labels, prompt_hash, sheet_model_name
+
+# --- Registro degli esperimenti (formato lungo) -----------------------------
+# Un run è identificato da (task, hash del prompt, modello, parametri), dove il
+# task indica espressione e dataset ("donna_disponibile" = training,
+# "donna_disponibile_test" = test set): gli id delle frasi sono indici di riga
+# del singolo sheet e due sheet non devono mai condividere un run. I
+# risultati sono righe (run, frase, etichetta) con chiave primaria
+# (run_id, sentence_id), quindi leggere il run n. 50 costa quanto leggere il
+# run n. 2, indipendentemente da quanti esperimenti esistono.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    task           TEXT NOT NULL,
+    prompt_hash    TEXT NOT NULL,
+    model          TEXT NOT NULL,
+    params         TEXT NOT NULL,
+    prompt_version TEXT,
+    prompt         TEXT,
+    created        TEXT,
+    UNIQUE (task, prompt_hash, model, params)
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id      INTEGER NOT NULL,
+    sentence_id TEXT NOT NULL,
+    label       INTEGER,
+    raw         TEXT,
+    created     TEXT,
+    PRIMARY KEY (run_id, sentence_id)
+) WITHOUT ROWID;
+"""
+
+
+def _params_key(params: dict) -> str:
+    # forma canonica: stesso dict → stessa chiave
+    return json.dumps(params or {}, sort_keys=True, separators=(",", ":"))
+
+
+class ExperimentRegistry:
+
+    def __init__(self, path: str, events=None):
+        # events: EventStream opzionale, riceve ogni etichetta scritta con record()
+        self.path = path
+        self.events = events
+        self._tasks = {}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # WAL: i classificatori scrivono mentre gli script di analisi leggono
+        # le scritture possono arrivare dai thread dello scheduler (job_scheduler.py)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    # --- run ------------------------------------------------------------------
+    def get_or_create_run(self, task: str, prompt: str, model: str, params: dict = None,
+                          prompt_version: str = None, prompt_hash_value: str = None) -> int:
+        key = (task, prompt_hash_value or prompt_hash(prompt), model, _params_key(params))
+        row = self.conn.execute(
+            "SELECT run_id FROM runs WHERE task = ? AND prompt_hash = ? AND model = ? AND params = ?",
+            key).fetchone()
+        if row:
+            return row[0]
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO runs (task, prompt_hash, model, params, prompt_version, prompt, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                key + (prompt_version, prompt, datetime.utcnow().isoformat()))
+        return cur.lastrowid
+
+    def runs(self, task: str = None, **filters) -> pd.DataFrame:
+        # filters on model / prompt_hash / prompt_version
+        query, args = "SELECT run_id, task, prompt_hash, model, params, prompt_version, created FROM runs", []
+        conds = []
+        if task is not None:
+            conds.append("task = ?")
+            args.append(task)
+        for column, value in filters.items():
+            if column not in ("model", "prompt_hash", "prompt_version"):
+                raise ValueError(f"Filtro non supportato: {column}")
+            conds.append(f"{column} = ?")
+            args.append(value)
+        if conds:
+            query += " WHERE " + " AND ".join(conds)
+        return pd.read_sql_query(query + " ORDER BY run_id", self.conn, params=args)
+
+    def latest_runs(self, task: str, **filters) -> dict:
+        # modello → run più recente che soddisfa i filtri
+        runs = self.runs(task, **filters)
+        return runs.groupby("model")["run_id"].max().to_dict()
+
+    # --- risultati ------------------------------------------------------------
+    def record(self, run_id: int, sentence_id, label, raw: str = None) -> None:
+        # label None (risposta non valida) resta NULL: mai la stringa "None"
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                              (run_id, str(sentence_id), None if label is None else int(label), raw,
+                               datetime.utcnow().isoformat()))
+        if self.events is not None:
+            self.events.publish(self.task_of(run_id), run_id, sentence_id, label)
+
+    def task_of(self, run_id: int) -> str:
+        if run_id not in self._tasks:
+            with self._lock:
+                row = self.conn.execute("SELECT task FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            self._tasks[run_id] = row[0] if row else None
+        return self._tasks[run_id]
+
+    def record_many(self, run_id: int, sentence_ids, labels, raws=None) -> None:
+        now = datetime.utcnow().isoformat()
+        raws = raws if raws is not None else [None] * len(labels)
+        rows = [(run_id, str(s), None if l is None or pd.isna(l) else int(l), r, now)
+                for s, l, r in zip(sentence_ids, labels, raws)]
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", rows)
+
+    def done_ids(self, run_id: int, include_failed: bool = False) -> set:
+        query = "SELECT sentence_id FROM results WHERE run_id = ?"
+        if not include_failed:
+            query += " AND label IS NOT NULL"
+        return {r[0] for r in self.conn.execute(query, (run_id,))}
+
+    def has_results(self, run_id: int) -> bool:
+        return self.conn.execute("SELECT 1 FROM results WHERE run_id = ? LIMIT 1", (run_id,)).fetchone() is not None
+
+    def results(self, run_ids, with_raw: bool = False) -> pd.DataFrame:
+        run_ids = [int(r) for r in run_ids]
+        columns = ["run_id", "sentence_id", "label"] + (["raw"] if with_raw else [])
+        if not run_ids:
+            return pd.DataFrame(columns=columns)
+        marks = ",".join("?" * len(run_ids))
+        return pd.read_sql_query(
+            f"SELECT {', '.join(columns)} FROM results WHERE run_id IN ({marks})",
+            self.conn, params=run_ids)
+
+    def matrix(self, run_ids, names: dict = None, sentence_ids=None, as_str: bool = False) -> pd.DataFrame:
+        # matrice di confronto on demand: frasi × run (colonne rinominate con names)
+        long = self.results(run_ids)
+        wide = long.pivot(index="sentence_id", columns="run_id", values="label")
+        wide = wide.reindex(columns=[int(r) for r in run_ids])
+        if sentence_ids is not None:
+            wide = wide.reindex([str(s) for s in sentence_ids])
+        if names:
+            wide = wide.rename(columns=names)
+        if as_str:
+            # stesso formato delle celle dello sheet ("" = mancante/non valida)
+            wide = wide.apply(lambda col: col.map(lambda v: "" if pd.isna(v) else str(int(v))))
+        return wide
+
+    def compare(self, run_a: int, run_b: int, n_classes: int) -> pd.DataFrame:
+        wide = self.matrix([run_a, run_b]).dropna()
+        cm = np.zeros((n_classes, n_classes), dtype=np.int64)
+        np.add.at(cm, (wide[run_a].astype(int) - 1, wide[run_b].astype(int) - 1), 1)
+        labels = list(range(1, n_classes + 1))
+        return pd.DataFrame(cm, index=labels, columns=labels)
+
+    # --- migrazione dallo sheet / export verso lo store denso ----------------
+    def import_sheet_columns(self, task: str, df: pd.DataFrame, prompts: dict, params: dict = None,
+                             id_col: str = "id", n_classes: int = 4) -> list:
+        # the legacy mod_/mod3_/mod4_ columns become runs; prompts maps prefix → prompt.
+        # Runs that already have results are left alone, so this can run at every start
+        created = []
+        for col in df.columns:
+            m = SHEET_COLUMN_RE.match(col)
+            if not m or m.group(1) not in prompts:
+                continue
+            prefix, model = m.groups()
+            run = self.get_or_create_run(task, prompts[prefix], sheet_model_name(model), params,
+                                         prompt_version=prefix)
+            if self.has_results(run):
+                continue
+            codes = encode_labels(df[col], n_classes)
+            keep = codes != 0
+            labels = [None if c < 0 else int(c) for c in codes[keep]]
+            self.record_many(run, df.loc[keep, id_col].astype(str), labels,
+                             raws=df.loc[keep, col].astype(str).tolist())
+            created.append(run)
+        return created
+
+    def to_prediction_store(self, store, run_ids) -> None:
+        for run in run_ids:
+            meta = self.conn.execute("SELECT model, prompt_hash, prompt_version, created FROM runs "
+                                     "WHERE run_id = ?", (int(run),)).fetchone()
+            long = self.results([run])
+            codes = long["label"].fillna(-1).astype(np.int8).to_numpy()
+            target = store.add_run(meta[0], prompt_hash_value=meta[1], column=meta[2] or "",
+                                   date=meta[3][:10])
+            store.write(target, long["sentence_id"], codes)
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import time
+    # benchmark: 50 run × N frasi; leggere il run 50 deve costare come il run 2
+    n_sent = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    n_runs = 50
+    registry = ExperimentRegistry(os.path.join(tempfile.mkdtemp(), "experiments.sqlite"))
+    ids = [f"s{i}" for i in range(n_sent)]
+    rng = np.random.default_rng(0)
+    t0 = time.perf_counter()
+    for r in range(n_runs):
+        run = registry.get_or_create_run("bench", f"prompt v{r}", "gpt-4.1", {"temperature": 0},
+                                         prompt_version=f"v{r}")
+        labels = rng.integers(1, 5, n_sent).astype(object)
+        labels[rng.random(n_sent) < 0.01] = None
+        registry.record_many(run, ids, labels)
+    print(f"Scrittura di {n_runs} run × {n_sent:,} frasi: {time.perf_counter() - t0:.2f} s")
+    for run in (2, n_runs):
+        t0 = time.perf_counter()
+        registry.matrix([1, run])
+        print(f"Matrice run 1 vs run {run}: {(time.perf_counter() - t0) * 1000:.1f} ms")
+    t0 = time.perf_counter()
+    print(registry.compare(1, n_runs, n_classes=4))
+    print(f"Confronto: {(time.perf_counter() - t0) * 1000:.1f} ms")
@@ -0,0 +1,194 @@
+import numpy as np
+import pandas as pd
+
+# --- Mining delle frasi difficili ---------------------------------------------
+# Ogni frase (annotata o no) riceve un punteggio da tre segnali:
+#   disagreement  1 - quota della classe di maggioranza tra i modelli
+#   entropy       entropia dei voti dei modelli (normalizzata su log2 k); se ci
+#                 sono run self-consistency si media con l'entropia dei campioni
+#   mismatch      quota dei modelli in disaccordo con best_human (solo annotate)
+# Lo stato è una matrice frasi × modelli con i conteggi per classe: una nuova
+# predizione (dal registro o dallo stream di eventi) toglie il voto vecchio e
+# aggiunge il nuovo, e i punteggi si ricalcolano in blocco su tutte le righe.
+WEIGHTS = {"disagreement": 1.0, "entropy": 1.0, "mismatch": 2.0}
+MIN_MODELS = 2          # con meno di due modelli non c'è disaccordo da misurare
+HARD_SET_SIZE = 200
+EXPORT_COLUMNS = ["date", "sentence"]   # formato di diificult_train_sentences_disponibile.csv
+
+
+class HardExampleMiner:
+
+    def __init__(self, n_classes: int, weights: dict = None, capacity: int = 1024):
+        self.n_classes = n_classes
+        self.weights = {**WEIGHTS, **(weights or {})}
+        self.ids = pd.Index([], dtype=object)
+        self.models = []
+        self.labels = np.zeros((capacity, 0), np.int8)           # 0 = nessuna predizione valida
+        self.counts = np.zeros((capacity, n_classes + 1), np.int32)  # colonna 0 ignorata
+        self.human = np.zeros(capacity, np.int8)
+        self.sc_entropy = np.full(capacity, np.nan)
+        self.run_models = {}
+        self.seq = 0
+
+    # --- righe e colonne ----------------------------------------------------
+    def _rows(self, sentence_ids) -> np.ndarray:
+        keys = pd.Index(np.asarray(sentence_ids, dtype=object)).astype(str)
+        pos = self.ids.get_indexer(keys)
+        new = keys[pos < 0].unique()
+        if len(new):
+            start = len(self.ids)
+            self.ids = self.ids.append(new)
+            if len(self.ids) > len(self.human):
+                cap = max(len(self.ids), 2 * len(self.human))
+                self.labels = np.vstack([self.labels, np.zeros((cap - len(self.labels), self.labels.shape[1]), np.int8)])
+                self.counts = np.vstack([self.counts, np.zeros((cap - len(self.counts), self.counts.shape[1]), np.int32)])
+                self.human = np.concatenate([self.human, np.zeros(cap - len(self.human), np.int8)])
+                self.sc_entropy = np.concatenate([self.sc_entropy, np.full(cap - len(self.sc_entropy), np.nan)])
+            pos[pos < 0] = start + new.get_indexer(keys[pos < 0])
+        return pos
+
+    def _col(self, model: str) -> int:
+        if model not in self.models:
+            self.models.append(model)
+            self.labels = np.hstack([self.labels, np.zeros((len(self.labels), 1), np.int8)])
+        return self.models.index(model)
+
+    # --- aggiornamenti --------------------------------------------------------
+    def update(self, sentence_ids, models, labels) -> None:
+        # predizioni nuove o riscritte; a parità di (frase, modello) vale l'ultima
+        models = pd.Series(np.asarray(models, dtype=object))
+        if models.empty:
+            return
+        rows = self._rows(sentence_ids)
+        cols = models.map({m: self._col(m) for m in models.unique()}).to_numpy()
+        new = pd.to_numeric(pd.Series(np.asarray(labels, dtype=object)), errors="coerce").fillna(0).to_numpy()
+        new = np.where((new >= 1) & (new <= self.n_classes), new, 0).astype(np.int8)
+        # ultima occorrenza di ogni (frase, modello) nel blocco
+        key = rows.astype(np.int64) * (len(self.models) + 1) + cols
+        _, last = np.unique(key[::-1], return_index=True)
+        keep = len(key) - 1 - last
+        rows, cols, new = rows[keep], cols[keep], new[keep]
+        old = self.labels[rows, cols]
+        np.add.at(self.counts, (rows, old), -1)
+        np.add.at(self.counts, (rows, new), 1)
+        self.labels[rows, cols] = new
+
+    def set_human(self, human: dict) -> None:
+        # sentence_id → best_human; le frasi ancora sconosciute vengono aggiunte
+        s = pd.to_numeric(pd.Series(human, dtype=object), errors="coerce")
+        s = s[(s >= 1) & (s <= self.n_classes)]
+        self.human[self._rows(s.index)] = s.to_numpy().astype(np.int8)
+
+    def set_vote_entropy(self, sentence_ids, entropy_norm) -> None:
+        # entropia media dei campioni self-consistency (vote_table) per frase
+        self.sc_entropy[self._rows(sentence_ids)] = np.asarray(entropy_norm, dtype=float)
+
+    def load_registry(self, registry, task: str, prompt_version: str) -> None:
+        # ultimo run di ogni modello per quella versione del prompt
+        runs = registry.latest_runs(task, prompt_version=prompt_version)
+        self.run_models.update({int(r): m for m, r in runs.items()})
+        long = registry.results(list(runs.values()))
+        self.update(long["sentence_id"], long["run_id"].map(self.run_models), long["label"])
+
+    def load_votes(self, registry, task: str, prompt_version: str) -> None:
+        from self_consistency import vote_table
+        table = vote_table(registry, registry.latest_runs(task, prompt_version=prompt_version))
+        if not table.empty:
+            mean = table.groupby("sentence_id")["entropy_norm"].mean()
+            self.set_vote_entropy(mean.index, mean.to_numpy())
+
+    def consume(self, stream, task: str, limit: int = 100000) -> int:
+        # eventi nuovi dallo stream (event_stream.py) dei run caricati con load_registry
+        events = stream.read(task, self.seq, limit)
+        if len(events):
+            self.seq = int(events["seq"].iloc[-1])
+            events = events[events["run_id"].isin(list(self.run_models))]
+            self.update(events["sentence_id"], events["run_id"].map(self.run_models), events["label"])
+        return len(events)
+
+    # --- punteggi -------------------------------------------------------------
+    def scores(self) -> pd.DataFrame:
+        n = len(self.ids)
+        votes = self.counts[:n, 1:].astype(float)
+        total = votes.sum(axis=1)
+        safe = np.maximum(total, 1)
+        p = votes / safe[:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            entropy = -np.where(p > 0, p * np.log2(p), 0).sum(axis=1) / np.log2(self.n_classes)
+        disagreement = 1 - votes.max(axis=1) / safe
+        sc = self.sc_entropy[:n]
+        entropy = np.where(np.isnan(sc), entropy, (entropy + sc) / 2)
+        human = self.human[:n].astype(int)
+        labelled = human > 0
+        agree = votes[np.arange(n), np.maximum(human - 1, 0)]
+        mismatch = np.where(labelled, 1 - agree / safe, np.nan)
+        w = self.weights
+        score = (w["disagreement"] * disagreement + w["entropy"] * entropy
+                 + w["mismatch"] * np.nan_to_num(mismatch))
+        score[total < MIN_MODELS] = np.nan
+        return pd.DataFrame({"models": total.astype(int), "disagreement": disagreement, "entropy": entropy,
+                             "mismatch": mismatch, "human": np.where(labelled, human, 0), "score": score},
+                            index=self.ids)
+
+    def hard_set(self, size: int = HARD_SET_SIZE, labelled=None) -> pd.DataFrame:
+        # labelled: None = tutte, True = solo annotate, False = solo da annotare
+        scores = self.scores().dropna(subset=["score"])
+        if labelled is not None:
+            scores = scores[(scores["human"] > 0) == labelled]
+        return scores.nlargest(size, "score")
+
+    def export(self, corpus: pd.DataFrame, path: str, size: int = HARD_SET_SIZE, labelled=None) -> pd.DataFrame:
+        # corpus: colonne id, date, sentence; stesso formato CSV del file curato a mano
+        hard = self.hard_set(size, labelled)
+        out = corpus.assign(id=corpus["id"].astype(str)).set_index("id").reindex(hard.index)
+        out = out.dropna(subset=["sentence"])[EXPORT_COLUMNS]
+        out.to_csv(path, index=False, encoding="utf-8")
+        return out
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    # uso: python hard_examples.py export registro.sqlite task prompt_version n_classi corpus.csv out.csv [n]
+    #      (corpus.csv: export dello sheet con id, date, sentence e, se c'è, best_human)
+    #      python hard_examples.py bench [n_frasi]
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        from experiment_registry import ExperimentRegistry
+        registry_path, task, version, n_classes, corpus_path, out_path = sys.argv[2:8]
+        size = int(sys.argv[8]) if len(sys.argv) > 8 else HARD_SET_SIZE
+        registry = ExperimentRegistry(registry_path)
+        corpus = pd.read_csv(corpus_path, dtype=str, keep_default_na=False)
+        miner = HardExampleMiner(int(n_classes))
+        miner.load_registry(registry, task, version)
+        miner.load_votes(registry, task, f"{version}_sc")
+        if "best_human" in corpus.columns:
+            miner.set_human(dict(zip(corpus["id"], corpus["best_human"])))
+        out = miner.export(corpus, out_path, size)
+        print(miner.hard_set(size).head(20).round(3).to_string())
+        print(f"{len(out)} frasi difficili salvate in {out_path}")
+        sys.exit(0)
+    # benchmark: n frasi × 5 modelli, 20% annotate; poi 10k predizioni nuove
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+    rng = np.random.default_rng(0)
+    truth = rng.integers(1, 5, n)
+    models = ["gpt-4.1", "gpt-4.1-mini", "gpt-4.1-nano", "gpt-4o", "gpt-4o-mini"]
+    ids = np.arange(n).astype(str)
+    miner = HardExampleMiner(4)
+    t0 = time.perf_counter()
+    for m in models:
+        pred = np.where(rng.random(n) < 0.8, truth, rng.integers(1, 5, n))
+        miner.update(ids, [m] * n, pred)
+    labelled = rng.random(n) < 0.2
+    miner.set_human(dict(zip(ids[labelled], truth[labelled])))
+    load_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    hard = miner.hard_set()
+    rank_s = time.perf_counter() - t0
+    k = 10_000
+    t0 = time.perf_counter()
+    sel = rng.choice(n, k, replace=False)
+    miner.update(ids[sel], rng.choice(models, k), rng.integers(1, 5, k))
+    update_ms = (time.perf_counter() - t0) * 1000
+    print(f"{n:,} frasi × {len(models)} modelli: caricamento {load_s:.2f} s, punteggi + top {HARD_SET_SIZE} "
+          f"{rank_s:.2f} s, {k:,} predizioni nuove {update_ms:.0f} ms")
+    print(hard.head(10).round(3).to_string())
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import numpy as np
+
+# --- Richieste "hedged" contro la coda lenta delle latenze --------------------
+# Se una chiamata non è tornata entro il p95 osservato per quel modello, ne parte
+# un duplicato e vince la prima risposta. Il duplicato costa una chiamata intera
+# (anche quello perdente viene fatturato), quindi la quota di hedge è limitata
+# da un tetto globale: con max_hedge_rate=0.05 al massimo 5 chiamate extra su 100.
+QUANTILE = 0.95
+MAX_HEDGE_RATE = 0.05
+MIN_SAMPLES = 20      # prima di avere un p95 affidabile niente hedge
+WINDOW = 500          # latenze recenti per modello usate per il quantile
+
+
+class LatencyTracker:
+
+    def __init__(self, window: int = WINDOW):
+        self._lat = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def add(self, model: str, seconds: float) -> None:
+        with self._lock:
+            self._lat[model].append(seconds)
+
+    def quantile(self, model: str, q: float = QUANTILE, min_samples: int = MIN_SAMPLES):
+        with self._lock:
+            lat = list(self._lat[model])
+        return float(np.quantile(lat, q)) if len(lat) >= min_samples else None
+
+
+class Hedger:
+
+    def __init__(self, quantile: float = QUANTILE, max_hedge_rate: float = MAX_HEDGE_RATE,
+                 min_samples: int = MIN_SAMPLES, max_workers: int = 16):
+        self.quantile = quantile
+        self.max_hedge_rate = max_hedge_rate
+        self.min_samples = min_samples
+        self.tracker = LatencyTracker()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "hedges": 0, "hedge_wins": 0}
+
+    def _submit(self, model: str, fn, args, kwargs):
+        # ogni tentativo registra la propria latenza (anche il perdente, quando finisce):
+        # il quantile descrive il servizio, non l'effetto dell'hedging
+        t0 = time.perf_counter()
+        future = self._pool.submit(fn, *args, **kwargs)
+        future.add_done_callback(
+            lambda f: self.tracker.add(model, time.perf_counter() - t0) if f.exception() is None else None)
+        return future
+
+    def _may_hedge(self) -> bool:
+        with self._lock:
+            if self.stats["hedges"] + 1 > self.max_hedge_rate * self.stats["requests"]:
+                return False
+            self.stats["hedges"] += 1
+            return True
+
+    def call(self, model: str, fn, *args, **kwargs):
+        # come fn(*args, **kwargs), con un duplicato se la risposta tarda oltre il p95
+        with self._lock:
+            self.stats["requests"] += 1
+        primary = self._submit(model, fn, args, kwargs)
+        threshold = self.tracker.quantile(model, self.quantile, self.min_samples)
+        if threshold is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self._may_hedge():
+            return primary.result()
+        backup = self._submit(model, fn, args, kwargs)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is backup:
+                        with self._lock:
+                            self.stats["hedge_wins"] += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.stats["hedges"] / max(self.stats["requests"], 1)
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    import sys
+    import pandas as pd
+    from openai import OpenAI
+    from llm_simulator import SimulatorConfig, running_simulator
+    # benchmark sul simulatore: chiamate sequenziali come nei classificatori, con
+    # coda lenta (2% delle richieste 8 volte più lente), senza e con hedging
+    # uso: python hedged_requests.py [n_richieste]
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    scale = 0.1  # attese accelerate 10×; le latenze riportate sono riscalate
+    rows = []
+    for name, rate in (("nessun hedge", 0.0), ("hedge ≤ 2%", 0.02), ("hedge ≤ 5%", 0.05), ("hedge ≤ 10%", 0.10)):
+        config = SimulatorConfig(latency_ms=400, latency_sigma=0.3, tail_prob=0.02, tail_factor=8,
+                                 seed=7, time_scale=scale)
+        with running_simulator(config) as sim:
+            client = OpenAI(base_url=sim.base_url, api_key="sim", max_retries=0)
+            hedger = Hedger(max_hedge_rate=rate)
+
+            def classify(i):
+                return client.chat.completions.create(
+                    model="gpt-4.1-mini", temperature=0, max_tokens=10,
+                    messages=[{"role": "system", "content": "Rispondi con un intero tra 1 e 4"},
+                              {"role": "user", "content": f"frase {i}"}])
+
+            lat = []
+            for i in range(n):
+                t0 = time.perf_counter()
+                hedger.call("gpt-4.1-mini", classify, i)
+                lat.append((time.perf_counter() - t0) * 1000 / scale)
+            hedger.close()
+            time.sleep(0.5)  # lascia finire i duplicati perdenti prima di contare
+            lat = np.array(lat)
+            rows.append({"policy": name, "p50_ms": np.percentile(lat, 50), "p95_ms": np.percentile(lat, 95),
+                         "p99_ms": np.percentile(lat, 99), "max_ms": lat.max(), "total_s": lat.sum() / 1000,
+                         "hedge_rate": hedger.hedge_rate, "hedge_wins": hedger.stats["hedge_wins"],
+                         "extra_cost": sim.stats["served"] / n - 1})
+    print(f"{n} chiamate sequenziali, latenza simulata (mediana 400 ms, 2% × 8):")
+    print(pd.DataFrame(rows).set_index("policy").round(3).to_string())
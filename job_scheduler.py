@@ -0,0 +1,296 @@
+import itertools
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+from answer_format import parse_answer
+from llm_metrics import PRICES
+from resilient_calls import error_category
+
+# --- Scheduler dei job di classificazione ------------------------------------
+# Un job è (task, sheet, versione del prompt, modello) con le sue frasi. Invece
+# di un modello alla volta e uno script per task, un unico dispatcher tiene
+# pieno il budget di ogni modello (richieste al minuto e chiamate in volo) e
+# sceglie il prossimo elemento per:
+#   1. priorità del job (più bassa = prima): test set prima del training,
+#      a parità il modello più economico (primi risultati a basso costo)
+#   2. fair share tra task: il task con meno chiamate servite (pesate) passa avanti
+# Un modello fermo al suo limite non blocca gli altri.
+RATE_LIMITS = {          # richieste al minuto per modello (limiti dell'account)
+    "gpt-4.1":      500,
+    "gpt-4.1-mini": 500,
+    "gpt-4.1-nano": 500,
+    "gpt-4o":       500,
+    "gpt-4o-mini":  500,
+}
+DEFAULT_RPM = 60          # modelli fuori elenco (server locali: di fatto la concorrenza)
+SPLIT_RANK = {"test": 0, "train": 1}
+MAX_IN_FLIGHT = 32        # chiamate in volo in totale, su tutti i modelli
+
+
+def job_priority(split: str, model: str) -> tuple:
+    # test prima di train; a parità il modello che costa meno per milione di token
+    price = PRICES.get(model, {"input": 0.0, "output": 0.0})
+    return SPLIT_RANK.get(split, len(SPLIT_RANK)), price["input"] + price["output"]
+
+
+class RateBudget:
+    # token bucket in memoria: rpm richieste al minuto, raffica fino a burst
+
+    def __init__(self, rpm: float, burst: float = 1.0, clock=time.monotonic):
+        self.rate = rpm / 60.0
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def wait_s(self) -> float:
+        # secondi prima che ci sia un token (0 = subito)
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class Job:
+
+    def __init__(self, name: str, task: str, model: str, items: list, handler, priority=0, weight: float = 1.0):
+        # handler(item) → True se l'elemento ha avuto un'etichetta; gli errori dell'API
+        # contano come fallimenti, le altre eccezioni (bug) interrompono il job
+        self.name = name
+        self.task = task
+        self.model = model
+        self.items = list(items)
+        self.handler = handler
+        self.priority = priority
+        self.weight = weight
+        self.total = len(self.items)
+        self.done = 0
+        self.failed = 0
+        self.started = None
+        self.finished = None
+        self.error = None
+        self._next = 0
+
+    @property
+    def pending(self) -> bool:
+        return self._next < self.total and self.error is None
+
+    def pop(self):
+        item = self.items[self._next]
+        self._next += 1
+        return item
+
+    def eta_s(self) -> float:
+        finished = self.done + self.failed
+        if not finished or self.started is None:
+            return float("nan")
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return (self.total - finished) * elapsed / finished
+
+
+class JobScheduler:
+
+    def __init__(self, rate_limits: dict = None, concurrency: dict = None, max_in_flight: int = MAX_IN_FLIGHT,
+                 progress: bool = True):
+        # concurrency: modello → chiamate in volo (di solito backend.concurrency)
+        self.rate_limits = {**RATE_LIMITS, **(rate_limits or {})}
+        self.concurrency = concurrency or {}
+        self.max_in_flight = max_in_flight
+        self.progress_bars = progress
+        self.jobs = []
+        self._seq = itertools.count()
+        self._order = {}
+        self._budgets = {}
+        self._in_flight = defaultdict(int)
+        self._served = defaultdict(float)
+        self._cond = threading.Condition()
+        self._bars = {}
+
+    def add(self, job: Job) -> Job:
+        self._order[id(job)] = next(self._seq)
+        self.jobs.append(job)
+        if job.model not in self._budgets:
+            self._budgets[job.model] = RateBudget(self.rate_limits.get(job.model, DEFAULT_RPM),
+                                                  burst=self.concurrency.get(job.model, 1))
+        return job
+
+    def _key(self, job: Job) -> tuple:
+        return job.priority, self._served[job.task], self._order[id(job)]
+
+    def _pick(self):
+        # (job da servire, None) oppure (None, secondi da attendere)
+        best, wait = None, None
+        for job in self.jobs:
+            if not job.pending or self._in_flight[job.model] >= self.concurrency.get(job.model, 1):
+                continue
+            w = self._budgets[job.model].wait_s()
+            if w > 0:
+                wait = w if wait is None else min(wait, w)
+            elif best is None or self._key(job) < self._key(best):
+                best = job
+        return best, wait
+
+    def _run_one(self, job: Job, item) -> None:
+        error = None
+        try:
+            ok = bool(job.handler(item))
+        except Exception as exc:
+            ok = False
+            if error_category(exc) is None:
+                # bug nel handler o nel backend (KeyError, TypeError, ...): come in
+                # ResilientCaller non si maschera da fallimento dell'elemento
+                error = exc
+                print(f"[{job.name}] interrotto: {type(exc).__name__}: {exc}")
+        with self._cond:
+            if error is not None and job.error is None:
+                job.error = error
+                job.finished = time.monotonic()
+            if ok:
+                job.done += 1
+            else:
+                job.failed += 1
+            self._in_flight[job.model] -= 1
+            if job.error is None and not job.pending and job.done + job.failed == job.total:
+                job.finished = time.monotonic()
+            self._cond.notify_all()
+        if job.name in self._bars:
+            self._bars[job.name].update(1)
+
+    def run(self) -> pd.DataFrame:
+        if self.progress_bars:
+            from tqdm import tqdm
+            for i, job in enumerate(sorted(self.jobs, key=self._key)):
+                self._bars[job.name] = tqdm(total=job.total, desc=job.name, position=i, leave=True)
+        now = time.monotonic()
+        for job in self.jobs:
+            job.started = now
+            if job.total == 0:
+                job.finished = now
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="job") as pool:
+            with self._cond:
+                while True:
+                    in_flight = sum(self._in_flight.values())
+                    aborted = any(job.error is not None for job in self.jobs)
+                    if (aborted or not any(job.pending for job in self.jobs)) and in_flight == 0:
+                        break
+                    if aborted:
+                        # un job interrotto da un bug: niente nuove chiamate, si
+                        # aspettano solo quelle in volo
+                        self._cond.wait(timeout=1.0)
+                        continue
+                    job, wait = (None, None) if in_flight >= self.max_in_flight else self._pick()
+                    if job is None:
+                        # slot o token in arrivo: si riprova al primo dei due
+                        self._cond.wait(timeout=wait if wait is not None else 1.0)
+                        continue
+                    self._budgets[job.model].take()
+                    self._in_flight[job.model] += 1
+                    self._served[job.task] += 1 / job.weight
+                    pool.submit(self._run_one, job, job.pop())
+        for bar in self._bars.values():
+            bar.close()
+        self._bars = {}
+        for job in self.jobs:
+            if job.error is not None:
+                raise job.error
+        return self.progress()
+
+    def progress(self) -> pd.DataFrame:
+        # avanzamento ed ETA per job (si può chiamare da un altro thread durante run)
+        rows = []
+        for job in self.jobs:
+            finished = job.done + job.failed
+            elapsed = ((job.finished or time.monotonic()) - job.started) if job.started else 0.0
+            rows.append({"job": job.name, "task": job.task, "model": job.model, "priority": job.priority,
+                         "done": job.done, "failed": job.failed, "total": job.total,
+                         "aborted": job.error is not None,
+                         "per_min": 60 * finished / elapsed if elapsed else 0.0,
+                         "elapsed_s": elapsed, "eta_s": job.eta_s()})
+        return pd.DataFrame(rows).set_index("job")
+
+
+def classification_job(registry, metrics, caller, backend, task: str, rows: list, prompt: str, params: dict,
+                       version: str, n_classes: int, mode: str = "json", split: str = "train", skip=(),
+                       weight: float = 1.0) -> Job:
+    # rows: coppie (sentence_id, frase); le frasi già nel run o in skip non rientrano nel job
+    from prompt_layout import PromptLayout
+    layout = PromptLayout(prompt, version)
+    run = registry.get_or_create_run(task, prompt, backend.name, params, prompt_version=version)
+    done = registry.done_ids(run) | set(skip)
+    items = [(sid, sentence) for sid, sentence in rows if sid not in done]
+
+    def attempt(sentence, sentence_id):
+        with metrics.track(backend.name, task, layout.hash, sentence_id) as call:
+            resp = backend.complete(layout, sentence, params)
+            call.response(resp)
+            txt = resp.choices[0].message.content or ""
+            cls = parse_answer(txt, n_classes, mode)
+            call.set_label(cls)
+        return cls, txt
+
+    def handler(item):
+        sentence_id, sentence = item
+        # run fermato dalla dashboard live: le frasi restanti contano come non fatte
+        if registry.events is not None and registry.events.stopped(run):
+            return False
+        result = caller.call(backend.name, attempt, sentence, sentence_id,
+                             validate=lambda r: r[0] is not None,
+                             item={"task": task, "model": backend.name, "prompt_version": version,
+                                   "sentence_id": sentence_id})
+        if result is None:
+            return False
+        registry.record(run, sentence_id, result[0], raw=result[1])
+        return True
+
+    return Job(f"{task}/{version}/{backend.name}", task, backend.name, items, handler,
+               priority=job_priority(split, backend.name), weight=weight)
+
+
+if __name__ == "__main__":
+    import sys
+    import numpy as np
+    # simulazione: due task (test disponibile 171 frasi, train libera 800) su tre
+    # modelli con limiti diversi; latenza lognormale. Confronto tra un job alla
+    # volta (come gli script attuali) e tutti i job nello scheduler.
+    # uso: python job_scheduler.py [scala_tempo]
+    scale = float(sys.argv[1]) if len(sys.argv) > 1 else 0.02
+    models = {"gpt-4.1": 300, "gpt-4.1-mini": 600, "gpt-4o-mini": 900}   # rpm
+    latency_s = 0.5
+    rng = np.random.default_rng(0)
+
+    def make_jobs():
+        jobs = []
+        for task, split, n in (("donna_disponibile_test", "test", 171), ("donna_libera", "train", 800)):
+            for model in models:
+                lat = latency_s * np.exp(0.4 * rng.standard_normal(n)) * scale
+                jobs.append(Job(f"{task}/{model}", task, model, list(lat), lambda s: time.sleep(s) or True,
+                                priority=job_priority(split, model)))
+        return jobs
+
+    limits = {m: rpm / scale for m, rpm in models.items()}
+    conc = {m: 8 for m in models}
+    t0 = time.monotonic()
+    for job in make_jobs():
+        one = JobScheduler(limits, conc, progress=False)
+        one.add(job)
+        one.run()
+    sequential = (time.monotonic() - t0) / scale
+
+    sched = JobScheduler(limits, conc, progress=False)
+    for job in make_jobs():
+        sched.add(job)
+    t0 = time.monotonic()
+    table = sched.run()
+    together = (time.monotonic() - t0) / scale
+    test_done = max(j.finished - j.started for j in sched.jobs if j.task == "donna_disponibile_test") / scale
+    print(f"un job alla volta: {sequential:.0f} s   scheduler: {together:.0f} s   "
+          f"(test set completo dopo {test_done:.0f} s)")
+    table["elapsed_s"] /= scale
+    table["per_min"] *= scale
+    print(table[["done", "total", "per_min", "elapsed_s"]].round(1).to_string())
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import re
+import numpy as np
+import pandas as pd
+from statsmodels.stats.proportion import proportion_confint
+
+from text_cleaning import normalized_key
+from sheet_labels import human_labels
+
+try:
+    import ahocorasick
+except ImportError:  # fallback: una sola regex con tutte le parole chiave (più lenta)
+    ahocorasick = None
+
+# --- Regole per parole chiave ---------------------------------------------
+# Ogni regola assegna una classe se nella frase (pulita, minuscola) compare
+# almeno una parola di "any", tutte quelle di "all" e nessuna di "none".
+# Una parola che finisce con * è un prefisso (scarcerat* → scarcerata/o/i).
+# Se due regole con classi diverse scattano sulla stessa frase, nessuna etichetta.
+RULES = {
+    "donna libera": [
+        {"name": "giudiziario", "class": 6,
+         "any": ["carcere", "scarcerat*", "assolt*", "prosciolt*", "domiciliari", "detenut*",
+                 "ergastolo", "evas*", "rilasciat*", "condannat*", "processo", "tribunale"]},
+        {"name": "sentimentale", "class": 2,
+         "any": ["single", "nubile", "fidanzat*", "divorziat*", "separat*", "zitella"]},
+    ],
+    "donna disponibile": [
+        {"name": "escort", "class": 2,
+         "any": ["escort", "incontri", "annunci", "trans", "massaggi*", "hot", "sexy"]},
+        {"name": "prodotto", "class": 4,
+         "any": ["disponibile dal", "disponibile in", "disponibile su", "disponibili dal",
+                 "in vendita", "prezzo", "euro", "negozi*", "online", "streaming"]},
+        {"name": "gestazione", "class": 1,
+         "any": ["utero in affitto", "gestazione per altri", "maternità surrogata"]},
+    ],
+}
+# soglie per usare una regola come etichetta automatica
+MIN_PRECISION = 0.95
+MIN_SUPPORT = 20
+
+
+def rules_hash(rules: list) -> str:
+    return hashlib.sha256(json.dumps(rules, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class RuleEngine:
+
+    def __init__(self, rules: list):
+        self.rules = list(rules)
+        # parola chiave → indice; per regola, bitmask delle sue parole
+        self.keywords = []
+        self._kw_index = {}
+        self._any, self._all, self._none = [], [], []
+        for rule in self.rules:
+            masks = []
+            for field in ("any", "all", "none"):
+                mask = 0
+                for kw in rule.get(field, []):
+                    mask |= 1 << self._keyword_id(kw.lower())
+                masks.append(mask)
+            self._any.append(masks[0])
+            self._all.append(masks[1])
+            self._none.append(masks[2])
+        self.classes = np.array([r["class"] for r in self.rules])
+        self._compile()
+
+    def _keyword_id(self, kw: str) -> int:
+        if kw not in self._kw_index:
+            self._kw_index[kw] = len(self.keywords)
+            self.keywords.append(kw)
+        return self._kw_index[kw]
+
+    def _compile(self):
+        # un solo automa per tutte le parole chiave di tutte le regole
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for kw, i in self._kw_index.items():
+                stem = kw.rstrip("*")
+                self._automaton.add_word(stem, (i, len(stem), kw.endswith("*")))
+            self._automaton.make_automaton()
+        else:
+            parts = []
+            for kw, i in sorted(self._kw_index.items(), key=lambda kv: -len(kv[0])):
+                stem = re.escape(kw.rstrip("*"))
+                end = "" if kw.endswith("*") else r"(?!\w)"
+                parts.append(f"(?P<k{i}>{stem}{end})")
+            self._regex = re.compile(r"(?<!\w)(?:" + "|".join(parts) + ")")
+
+    # --- scansione --------------------------------------------------------------
+    def _scan_one(self, text: str) -> int:
+        # bitmask delle parole chiave presenti (solo a confine di parola)
+        found = 0
+        if ahocorasick is not None:
+            n = len(text)
+            for end, (i, length, prefix) in self._automaton.iter(text):
+                start = end - length + 1
+                if start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if not prefix and end + 1 < n and _is_word_char(text[end + 1]):
+                    continue
+                found |= 1 << i
+        else:
+            for m in self._regex.finditer(text):
+                found |= 1 << int(m.lastgroup[1:])
+        return found
+
+    def scan(self, keys) -> np.ndarray:
+        # keys: frasi già normalizzate (normalized_key); → (frasi × regole) bool
+        fired = np.zeros((len(keys), len(self.rules)), dtype=bool)
+        for row, text in enumerate(keys):
+            found = self._scan_one(text) if isinstance(text, str) else 0
+            if not found:
+                continue
+            for j in range(len(self.rules)):
+                if (found & self._any[j] or not self._any[j]) and (found & self._all[j]) == self._all[j] \
+                        and not found & self._none[j]:
+                    fired[row, j] = True
+        return fired
+
+    def label(self, sentences, normalized: bool = False) -> pd.DataFrame:
+        # → label (Int64, <NA> se nessuna regola o regole in conflitto) e rule
+        keys = sentences if normalized else normalized_key(sentences)
+        fired = self.scan(list(keys))
+        classes = np.where(fired, self.classes, 0)
+        n_distinct = np.array([len(set(r[r > 0])) for r in classes]) if len(classes) else np.zeros(0)
+        single = n_distinct == 1
+        first = fired.argmax(axis=1)
+        label = pd.array(np.where(single, classes.max(axis=1), 0), dtype="Int64")
+        label[~single] = pd.NA
+        names = np.array([r["name"] for r in self.rules] or [""], dtype=object)
+        rule = np.where(single, names[first] if len(self.rules) else "", "")
+        return pd.DataFrame({"label": label, "rule": rule})
+
+    # --- precisione contro le etichette umane -----------------------------------
+    def precision(self, sentences, human, normalized: bool = False, alpha: float = 0.05) -> pd.DataFrame:
+        # per regola: quante frasi annotate colpisce, quante giuste, precisione e
+        # limite inferiore di Wilson (la soglia per l'auto-etichettatura)
+        keys = sentences if normalized else normalized_key(sentences)
+        human = pd.to_numeric(pd.Series(list(human)), errors="coerce").to_numpy()
+        annotated = ~np.isnan(human)
+        fired = self.scan(list(keys))
+        rows = []
+        for j, rule in enumerate(self.rules):
+            hit = fired[:, j] & annotated
+            support = int(hit.sum())
+            correct = int((human[hit] == rule["class"]).sum())
+            low = proportion_confint(correct, support, alpha=alpha, method="wilson")[0] if support else np.nan
+            rows.append({"rule": rule["name"], "class": rule["class"], "fired": int(fired[:, j].sum()),
+                         "support": support, "correct": correct,
+                         "precision": correct / support if support else np.nan, "wilson_low": low})
+        return pd.DataFrame(rows).set_index("rule")
+
+    def trusted(self, report: pd.DataFrame, min_precision: float = MIN_PRECISION,
+                min_support: int = MIN_SUPPORT) -> "RuleEngine":
+        # solo le regole con precisione sufficiente (limite di Wilson) e abbastanza esempi
+        ok = report[(report["support"] >= min_support) & (report["wilson_low"] >= min_precision)].index
+        return RuleEngine([r for r in self.rules if r["name"] in set(ok)])
+
+
+def apply_rules(registry, task: str, expression: str, df: pd.DataFrame, human_col: str = "best_human",
+                id_col: str = "id", sentence_col: str = "sentence", annotator_cols=None) -> set:
+    # calibra le regole sulle righe già annotate, registra come run "rules" le
+    # etichette delle regole affidabili e restituisce gli id da non mandare ai modelli.
+    # Riferimento: human_col se lo sheet ce l'ha, altrimenti il consenso degli
+    # annotator_cols (lo sheet di donna libera non ha best_human).
+    # Le regole etichettano solo le righe senza etichetta umana: la precisione non
+    # si misura sulle stesse righe che poi si tolgono ai modelli, e le righe
+    # annotate hanno sempre la risposta dei modelli da confrontare
+    engine = RuleEngine(RULES[expression])
+    if human_col in df.columns:
+        human = df[human_col]
+    elif annotator_cols:
+        # 0 = nessuna annotazione o disaccordo: per la precisione è "non annotata"
+        human = human_labels(df, list(annotator_cols)).replace(0, np.nan).to_numpy()
+    else:
+        human = pd.Series([""] * len(df))
+    annotated = pd.to_numeric(pd.Series(list(human)), errors="coerce").notna().to_numpy(copy=True)
+    if annotator_cols:
+        cells = df[list(annotator_cols)].astype(str).apply(lambda c: c.str.strip())
+        annotated |= (cells != "").any(axis=1).to_numpy()
+    keys = normalized_key(df[sentence_col])
+    report = engine.precision(keys, human, normalized=True)
+    print("Precisione delle regole sulle frasi annotate:")
+    print(report.round(3).to_string())
+    trusted = engine.trusted(report)
+    if not trusted.rules:
+        return set()
+    run = registry.get_or_create_run(task, json.dumps(trusted.rules, ensure_ascii=False), "rules", {},
+                                     prompt_version="rules", prompt_hash_value=rules_hash(trusted.rules))
+    labels = trusted.label(keys, normalized=True)
+    hit = labels["label"].notna().to_numpy() & ~annotated
+    ids = df.loc[hit, id_col].astype(str)
+    registry.record_many(run, ids, labels.loc[hit, "label"].tolist(), raws=labels.loc[hit, "rule"].tolist())
+    print(f"Frasi non annotate etichettate dalle regole ({', '.join(r['name'] for r in trusted.rules)}): "
+          f"{hit.sum()}")
+    return set(ids)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    # uso: python keyword_rules.py bench [n_frasi]
+    #      python keyword_rules.py precision export.csv "donna libera" colonna_umana
+    if len(sys.argv) > 1 and sys.argv[1] == "precision":
+        path, expression, human_col = sys.argv[2:5]
+        df = pd.read_csv(path, dtype=str)
+        engine = RuleEngine(RULES[expression])
+        print(engine.precision(df["sentence"], df[human_col]).round(3))
+    else:
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+        rng = np.random.default_rng(0)
+        filler = np.array([f"parola{i}" for i in range(2000)] + ["donna", "libera", "disponibile", "carcere",
+                                                                    "escort", "prezzo", "single"])
+        keys = [" ".join(rng.choice(filler, 30)) for _ in range(n)]
+        engine = RuleEngine(RULES["donna libera"] + RULES["donna disponibile"])
+        backend = "pyahocorasick" if ahocorasick is not None else "regex"
+        t0 = time.perf_counter()
+        labels = engine.label(keys, normalized=True)
+        elapsed = time.perf_counter() - t0
+        print(f"{n:,} frasi ({backend}): {elapsed:.1f} s → {n / elapsed * 60 / 1e6:.1f} M frasi/minuto, "
+              f"{labels['label'].notna().mean():.1%} etichettate dalle regole")
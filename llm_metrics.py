@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+# --- Configurazione ---------------------------------------------------------
+# Ogni chiamata ai modelli (classificatori, benchmark sul simulatore) registra
+# token, latenza, retry ed esito in un unico store locale su SQLite.
+DEFAULT_DB_PATH = os.environ.get(
+    "LLM_METRICS_DB", os.path.expanduser("~/.cache/linguistica/llm_metrics.sqlite")
+)
+
+# listino OpenAI in $ per milione di token: input, input in cache, output
+PRICES = {
+    "gpt-4.1":      {"input": 2.00, "cached": 0.50,  "output": 8.00},
+    "gpt-4.1-mini": {"input": 0.40, "cached": 0.10,  "output": 1.60},
+    "gpt-4.1-nano": {"input": 0.10, "cached": 0.025, "output": 0.40},
+    "gpt-4o":       {"input": 2.50, "cached": 1.25,  "output": 10.00},
+    "gpt-4o-mini":  {"input": 0.15, "cached": 0.075, "output": 0.60},
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    ts                REAL,
+    task              TEXT,
+    model             TEXT,
+    prompt_hash       TEXT,
+    sentence_id       TEXT,
+    prompt_tokens     INTEGER,
+    completion_tokens INTEGER,
+    cached_tokens     INTEGER,
+    latency_ms        REAL,
+    retries           INTEGER,
+    status            TEXT,
+    label             INTEGER
+);
+CREATE INDEX IF NOT EXISTS calls_task_ts ON calls (task, ts);
+"""
+
+
+def call_cost(model: str, prompt_tokens, completion_tokens, cached_tokens):
+    # funziona sia su scalari sia su colonne; modelli fuori listino → NaN
+    price = PRICES.get(model)
+    if price is None:
+        return np.nan * np.asarray(prompt_tokens, dtype=float)
+    uncached = np.asarray(prompt_tokens, dtype=float) - np.asarray(cached_tokens, dtype=float)
+    return (uncached * price["input"] + np.asarray(cached_tokens, dtype=float) * price["cached"]
+            + np.asarray(completion_tokens, dtype=float) * price["output"]) / 1e6
+
+
+class TrackedCall:
+    # a single in-flight call; filled by the caller, written on exit
+
+    def __init__(self, store, model, task, prompt_hash, sentence_id):
+        self.store = store
+        self.row = {"task": task, "model": model, "prompt_hash": prompt_hash,
+                    "sentence_id": None if sentence_id is None else str(sentence_id),
+                    "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+                    "retries": 0, "status": "ok", "label": None}
+
+    def response(self, resp, retries: int = 0) -> None:
+        usage = getattr(resp, "usage", None)
+        if usage is not None:
+            self.row["prompt_tokens"] = usage.prompt_tokens or 0
+            self.row["completion_tokens"] = usage.completion_tokens or 0
+            details = getattr(usage, "prompt_tokens_details", None)
+            self.row["cached_tokens"] = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+        self.row["retries"] = retries
+
+    def set_label(self, label) -> None:
+        self.row["label"] = None if label is None else int(label)
+        if label is None:
+            self.row["status"] = "invalid"
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.row["latency_ms"] = (time.perf_counter() - self._t0) * 1000
+        if exc_type is not None:
+            self.row["status"] = f"error:{exc_type.__name__}"
+        self.store.record(**self.row)
+        return False
+
+
+class MetricsStore:
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def track(self, model: str, task: str = "", prompt_hash: str = "", sentence_id=None) -> TrackedCall:
+        #   with metrics.track(mdl, TASK, PROMPT_HASH, sentence_id) as call:
+        #       raw = client.chat.completions.with_raw_response.create(...)
+        #       resp = raw.parse(); call.response(resp, raw.retries_taken)
+        #       call.set_label(cls)
+        return TrackedCall(self, model, task, prompt_hash, sentence_id)
+
+    def record(self, **row) -> None:
+        row.setdefault("ts", time.time())
+        cols = ["ts", "task", "model", "prompt_hash", "sentence_id", "prompt_tokens", "completion_tokens",
+                "cached_tokens", "latency_ms", "retries", "status", "label"]
+        with self._lock, self._conn:
+            self._conn.execute(f"INSERT INTO calls ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                               [row.get(c) for c in cols])
+
+    def calls(self, task: str = None, since: float = None) -> pd.DataFrame:
+        query, args = "SELECT * FROM calls WHERE ts >= ?", [since or 0.0]
+        if task:
+            query += " AND task = ?"
+            args.append(task)
+        df = pd.read_sql_query(query, self._conn, params=args)
+        df["cost"] = np.nan
+        for model, idx in df.groupby("model").groups.items():
+            sub = df.loc[idx]
+            df.loc[idx, "cost"] = call_cost(model, sub["prompt_tokens"], sub["completion_tokens"],
+                                            sub["cached_tokens"])
+        return df
+
+    # --- riepiloghi -----------------------------------------------------------
+    def summary(self, task: str = None, since: float = None) -> pd.DataFrame:
+        # per modello: chiamate, frasi, costo, costo per frase, token, latenze
+        df = self.calls(task, since)
+        if df.empty:
+            return pd.DataFrame()
+        g = df.groupby("model")
+        return pd.DataFrame({
+            "calls": g.size(),
+            "sentences": g["sentence_id"].nunique(),
+            "errors": g["status"].apply(lambda s: (s != "ok").sum()),
+            "retries": g["retries"].sum(),
+            "prompt_tokens": g["prompt_tokens"].sum(),
+            "cached_share": g["cached_tokens"].sum() / g["prompt_tokens"].sum().replace(0, np.nan),
+            "completion_tokens": g["completion_tokens"].sum(),
+            "cost_usd": g["cost"].sum(),
+            "cost_per_sentence": g["cost"].sum() / g["sentence_id"].nunique().replace(0, np.nan),
+            "p50_ms": g["latency_ms"].quantile(0.5),
+            "p95_ms": g["latency_ms"].quantile(0.95),
+            "p99_ms": g["latency_ms"].quantile(0.99),
+        })
+
+    def cost_per_sentence(self, task: str = None, since: float = None) -> pd.Series:
+        summary = self.summary(task, since)
+        return summary["cost_per_sentence"] if not summary.empty else pd.Series(dtype=float)
+
+    def cost_by_class(self, task: str = None, since: float = None) -> pd.DataFrame:
+        # costo medio per frase secondo la classe predetta (modelli × classi)
+        df = self.calls(task, since).dropna(subset=["label"])
+        if df.empty:
+            return pd.DataFrame()
+        df["label"] = df["label"].astype(int)
+        return df.pivot_table(index="model", columns="label", values="cost", aggfunc="mean")
+
+    def throughput(self, task: str = None, since: float = None, freq: str = "1min") -> pd.DataFrame:
+        # chiamate e frasi distinte per intervallo, per modello
+        df = self.calls(task, since)
+        if df.empty:
+            return pd.DataFrame()
+        df["period"] = pd.to_datetime(df["ts"], unit="s").dt.floor(freq)
+        return df.groupby(["period", "model"])["sentence_id"].agg(calls="size", sentences="nunique") \
+            .unstack("model", fill_value=0)
+
+
+if __name__ == "__main__":
+    import sys
+    # uso: python llm_metrics.py [task] [ultimi_giorni]
+    task = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] != "-" else None
+    days = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+    store = MetricsStore()
+    since = time.time() - days * 86400
+    summary = store.summary(task, since)
+    if summary.empty:
+        print("Nessuna chiamata registrata.")
+        sys.exit(0)
+    print(f"Chiamate ai modelli negli ultimi {days:g} giorni" + (f" (task {task})" if task else "") + ":")
+    print(summary.round(4).to_string())
+    print("\nCosto medio per frase ($) per classe predetta:")
+    print(store.cost_by_class(task, since).round(6).to_string())
+    print("\nThroughput (chiamate per ora):")
+    print(store.throughput(task, since, freq="1h")["calls"].tail(24).to_string())
@@ -0,0 +1,347 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# --- Simulatore locale di /v1/chat/completions ------------------------------
+# Server compatibile OpenAI per benchmark offline dei classificatori:
+#   replay: risponde con le risposte registrate (chiave = hash della richiesta);
+#           per richieste mai viste genera una classe sintetica deterministica
+#   record: inoltra all'API vera, salva risposta e latenza nella cassetta
+# Latenza, 429 (con retry-after) e JSON malformato sono iniettati secondo la
+# configurazione, con un seed: due esecuzioni uguali vedono gli stessi eventi.
+#
+# uso dagli script: OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=sim
+UPSTREAM_URL = "https://api.openai.com/v1/chat/completions"
+
+# parametri che cambiano la risposta: fanno parte della chiave della cassetta
+KEY_PARAMS = ("model", "messages", "temperature", "top_p", "max_tokens", "n",
+              "response_format", "logit_bias", "seed")
+N_CLASSES_RE = re.compile(r"tra 1 e (\d+)")
+# cache dei prefissi: soglia minima e durata (secondi) come documentate da OpenAI
+CACHE_MIN_TOKENS = 1024
+CACHE_TTL_S = 300
+# risposte sintetiche: probabilità per unità di temperatura di campionare una classe a caso
+SAMPLE_FLIP = 0.3
+
+
+def request_key(body: dict) -> str:
+    canonical = {k: body[k] for k in KEY_PARAMS if k in body}
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _n_classes(body: dict) -> int:
+    # numero di classi letto dal prompt di sistema ("numero intero tra 1 e 4")
+    for msg in body.get("messages", []):
+        if msg.get("role") == "system":
+            m = N_CLASSES_RE.search(msg.get("content", ""))
+            if m:
+                return int(m.group(1))
+    return 4
+
+
+class SimulatorConfig:
+
+    def __init__(self, latency_ms: float = 400.0, latency_sigma: float = 0.5, tail_prob: float = 0.02,
+                 tail_factor: float = 8.0, rate_per_minute: float = None, rate_limit_prob: float = 0.0,
+                 retry_after_s: float = 1.0, malformed_prob: float = 0.0, seed: int = 0,
+                 time_scale: float = 1.0, ms_per_output_token: float = 0.0, server_error_prob: float = 0.0,
+                 broken_models: tuple = ()):
+        # latenza lognormale (mediana latency_ms) con una coda lenta: con
+        # probabilità tail_prob la richiesta è tail_factor volte più lenta
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tail_prob = tail_prob
+        self.tail_factor = tail_factor
+        # tempo di generazione: si aggiunge per ogni token di output (solo risposte sintetiche)
+        self.ms_per_output_token = ms_per_output_token
+        # 429: oltre rate_per_minute richieste/minuto, o a caso con rate_limit_prob
+        self.rate_per_minute = rate_per_minute
+        self.rate_limit_prob = rate_limit_prob
+        self.retry_after_s = retry_after_s
+        self.malformed_prob = malformed_prob
+        # 500: a caso con server_error_prob, sempre per i modelli in broken_models
+        self.server_error_prob = server_error_prob
+        self.broken_models = tuple(broken_models)
+        self.seed = seed
+        # < 1 accelera tutte le attese (benchmark lunghi in pochi secondi)
+        self.time_scale = time_scale
+
+
+class Cassette:
+    # risposte registrate in JSON Lines: {"key", "response", "latency_ms"}
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        rec = json.loads(line)
+                        self.entries[rec["key"]] = rec
+
+    def get(self, key: str):
+        return self.entries.get(key)
+
+    def put(self, key: str, response: dict, latency_ms: float) -> None:
+        rec = {"key": key, "response": response, "latency_ms": latency_ms}
+        with self._lock:
+            self.entries[key] = rec
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+
+class LLMSimulator(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, config: SimulatorConfig = None,
+                 cassette: Cassette = None, mode: str = "replay", upstream_key: str = None):
+        super().__init__((host, port), _Handler)
+        self.config = config or SimulatorConfig()
+        self.cassette = cassette or Cassette()
+        self.mode = mode
+        self.upstream_key = upstream_key or os.getenv("OPENAI_API_KEY")
+        self.rng = np.random.default_rng(self.config.seed)
+        self._lock = threading.Lock()
+        self._window = []          # timestamp delle richieste dell'ultimo minuto
+        self._prefixes = {}        # (modello, hash del prefisso) → ultimo uso
+        self.stats = {"requests": 0, "served": 0, "rate_limited": 0, "malformed": 0, "server_errors": 0,
+                      "replayed": 0, "synthetic": 0, "recorded": 0}
+        self.latencies_ms = []
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    # --- decisioni per richiesta (sotto lock: sequenza riproducibile) -------
+    def _draw(self):
+        cfg = self.config
+        with self._lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            self._window = [t for t in self._window if now - t < 60.0 * cfg.time_scale]
+            over_rate = cfg.rate_per_minute is not None and len(self._window) >= cfg.rate_per_minute
+            limited = over_rate or self.rng.random() < cfg.rate_limit_prob
+            malformed = self.rng.random() < cfg.malformed_prob
+            server_error = self.rng.random() < cfg.server_error_prob
+            latency = cfg.latency_ms * float(np.exp(cfg.latency_sigma * self.rng.standard_normal()))
+            if self.rng.random() < cfg.tail_prob:
+                latency *= cfg.tail_factor
+            if limited:
+                self.stats["rate_limited"] += 1
+            else:
+                self._window.append(now)
+        return limited, malformed, server_error, latency
+
+    def _synthetic(self, body: dict, key: str) -> dict:
+        # classe "creduta" dal modello: deterministica per (modello, messaggi); a
+        # temperatura > 0 ogni choice se ne discosta con probabilità SAMPLE_FLIP × T.
+        # Con max_tokens=1 (risposta a una cifra) il contenuto è la sola cifra
+        k = _n_classes(body)
+        digit = body.get("max_tokens") == 1
+        per_choice = 1 if digit else 5
+        belief = request_key({"model": body.get("model"), "messages": body.get("messages")})
+        base = int(belief, 16) % k + 1
+        flip = min(1.0, SAMPLE_FLIP * float(body.get("temperature", 1.0)))
+        choices = []
+        for i in range(int(body.get("n", 1))):
+            h = int(hashlib.sha256(f"{key}:{i}".encode()).hexdigest(), 16)
+            cls = h % k + 1 if (h >> 64) % 10_000 < flip * 10_000 else base
+            content = str(cls) if digit else json.dumps({"class": cls})
+            choices.append({"index": i, "finish_reason": "length" if digit else "stop",
+                            "message": {"role": "assistant", "content": content}})
+        prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+        return {"id": f"chatcmpl-sim-{key[:16]}", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", ""), "choices": choices,
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": per_choice * len(choices),
+                          "total_tokens": prompt_tokens + per_choice * len(choices),
+                          "prompt_tokens_details": {"cached_tokens": self._cached_tokens(body)}}}
+
+    def _cached_tokens(self, body: dict) -> int:
+        # come la cache automatica di OpenAI: prefisso identico (tutto tranne
+        # l'ultimo messaggio) di almeno 1024 token, visto negli ultimi minuti,
+        # riusato a blocchi di 128 token
+        messages = body.get("messages", [])
+        prefix_tokens = sum(len(m.get("content", "")) for m in messages[:-1]) // 4
+        if prefix_tokens < CACHE_MIN_TOKENS:
+            return 0
+        prefix = (body.get("model", ""), hashlib.sha256(json.dumps(messages[:-1], sort_keys=True,
+                                                                   ensure_ascii=False).encode()).hexdigest())
+        now = time.monotonic()
+        with self._lock:
+            last = self._prefixes.get(prefix)
+            self._prefixes[prefix] = now
+        if last is None or now - last > CACHE_TTL_S * self.config.time_scale:
+            return 0
+        return prefix_tokens // 128 * 128
+
+    def _upstream(self, body: dict):
+        req = urllib.request.Request(UPSTREAM_URL, data=json.dumps(body).encode("utf-8"), headers={
+            "Content-Type": "application/json", "Authorization": f"Bearer {self.upstream_key}"})
+        t0 = time.perf_counter()
+        with urllib.request.urlopen(req, timeout=120) as resp:
+            data = json.loads(resp.read())
+        return data, (time.perf_counter() - t0) * 1000
+
+    def complete(self, body: dict):
+        # → (status, headers, payload bytes, latency in ms da simulare)
+        limited, malformed, server_error, latency = self._draw()
+        cfg = self.config
+        if limited:
+            payload = {"error": {"message": "Rate limit reached (simulated)", "type": "requests",
+                                 "code": "rate_limit_exceeded"}}
+            return 429, {"retry-after": f"{cfg.retry_after_s:g}"}, json.dumps(payload).encode(), 0.0
+        if server_error or body.get("model") in cfg.broken_models:
+            self.stats["server_errors"] += 1
+            payload = {"error": {"message": "The server had an error (simulated)", "type": "server_error"}}
+            return 500, {}, json.dumps(payload).encode(), latency
+
+        key = request_key(body)
+        rec = self.cassette.get(key)
+        if rec is not None:
+            response, latency = rec["response"], rec["latency_ms"]
+            self.stats["replayed"] += 1
+        elif self.mode == "record":
+            response, latency = self._upstream(body)
+            self.cassette.put(key, response, latency)
+            self.stats["recorded"] += 1
+            latency = 0.0  # l'attesa vera è già stata pagata
+        else:
+            response = self._synthetic(body, key)
+            latency += cfg.ms_per_output_token * response["usage"]["completion_tokens"]
+            self.stats["synthetic"] += 1
+        if malformed and not body.get("logit_bias"):
+            # contenuto troncato: l'HTTP è valido, il JSON del modello no
+            # (con logit_bias sulle cifre il modello non può uscire dal vincolo)
+            response = json.loads(json.dumps(response))
+            for choice in response["choices"]:
+                choice["message"]["content"] = choice["message"]["content"][:-3]
+            self.stats["malformed"] += 1
+        self.stats["served"] += 1
+        return 200, {}, json.dumps(response).encode("utf-8"), latency
+
+    def latency_summary(self) -> dict:
+        lat = np.array(self.latencies_ms) if self.latencies_ms else np.zeros(1)
+        return {"p50_ms": float(np.percentile(lat, 50)), "p95_ms": float(np.percentile(lat, 95)),
+                "p99_ms": float(np.percentile(lat, 99)), "max_ms": float(lat.max())}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # header e corpo sono due write: senza TCP_NODELAY Nagle + ACK ritardato
+    # aggiungono ~40 ms a ogni risposta e falsano le latenze misurate
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass  # niente log per richiesta: falserebbe i benchmark
+
+    def _send(self, status: int, headers: dict, payload: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {}, b'{"error": {"message": "not found"}}')
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send(400, {}, b'{"error": {"message": "invalid JSON body"}}')
+            return
+        t0 = time.perf_counter()
+        try:
+            status, headers, payload, latency = self.server.complete(body)
+        except urllib.error.HTTPError as exc:
+            status, headers, payload, latency = exc.code, dict(exc.headers), exc.read(), 0.0
+        time.sleep(latency / 1000 * self.server.config.time_scale)
+        if status == 200:
+            self.server.latencies_ms.append((time.perf_counter() - t0) * 1000)
+        self._send(status, headers, payload)
+
+
+@contextmanager
+def running_simulator(config: SimulatorConfig = None, cassette_path: str = None, mode: str = "replay",
+                      port: int = 0):
+    # fixture: avvia il server in un thread e lo ferma all'uscita
+    #   with running_simulator(SimulatorConfig(rate_limit_prob=0.05)) as sim:
+    #       client = OpenAI(base_url=sim.base_url, api_key="sim")
+    server = LLMSimulator(port=port, config=config, cassette=Cassette(cassette_path), mode=mode)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def benchmark(n_requests: int = 500, concurrency: int = 8, config: SimulatorConfig = None) -> dict:
+    # carico stile classificatore attraverso il client OpenAI (retry inclusi)
+    from concurrent.futures import ThreadPoolExecutor
+    from openai import OpenAI
+    config = config or SimulatorConfig(latency_ms=300, rate_limit_prob=0.05, malformed_prob=0.02,
+                                       retry_after_s=0.5, time_scale=0.1)
+    with running_simulator(config) as sim:
+        client = OpenAI(base_url=sim.base_url, api_key="sim", max_retries=5)
+
+        def call(i):
+            t0 = time.perf_counter()
+            resp = client.chat.completions.create(
+                model="gpt-4.1-mini", temperature=0, max_tokens=10,
+                response_format={"type": "json_object"},
+                messages=[{"role": "system", "content": "Rispondi con un intero tra 1 e 4"},
+                          {"role": "user", "content": f"frase {i}"}])
+            try:
+                json.loads(resp.choices[0].message.content)
+                ok = True
+            except json.JSONDecodeError:
+                ok = False
+            return (time.perf_counter() - t0) * 1000, ok
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(call, range(n_requests)))
+        elapsed = time.perf_counter() - t0
+        lat = np.array([r[0] for r in results])
+        return {"requests": n_requests, "throughput_rps": n_requests / elapsed,
+                "client_p50_ms": float(np.percentile(lat, 50)), "client_p95_ms": float(np.percentile(lat, 95)),
+                "client_p99_ms": float(np.percentile(lat, 99)),
+                "malformed_answers": sum(not r[1] for r in results), **sim.stats}
+
+
+if __name__ == "__main__":
+    import sys
+    # uso: python llm_simulator.py serve [porta] [cassetta.jsonl] [replay|record]
+    #      python llm_simulator.py bench [n_richieste] [concorrenza]
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+        conc = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+        for name, value in benchmark(n, conc).items():
+            print(f"{name:>18}: {value:.1f}" if isinstance(value, float) else f"{name:>18}: {value}")
+    else:
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8099
+        cassette = sys.argv[3] if len(sys.argv) > 3 else None
+        mode = sys.argv[4] if len(sys.argv) > 4 else "replay"
+        server = LLMSimulator(port=port, cassette=Cassette(cassette), mode=mode)
+        print(f"Simulatore in ascolto su {server.base_url} (modalità {mode})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
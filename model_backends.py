@@ -0,0 +1,213 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+
+from llm_metrics import PRICES, call_cost
+
+# --- Backend dei modelli ------------------------------------------------------
+# Lo stesso run di classificazione può puntare a:
+#   "gpt-4.1"                                     API di OpenAI
+#   "local:qwen2.5-7b-instruct@http://127.0.0.1:8080/v1"
+#                                                 server compatibile OpenAI in locale
+#                                                 (llama.cpp, vLLM, ... anche solo CPU)
+#   "sklearn:/percorso/tfidf_logreg.joblib"       modello scikit-learn in-process
+# Il nome è anche il "modello" del run nel registro. Ogni backend ha la sua
+# concorrenza, la dimensione dei batch e i prezzi ($ per milione di token, come
+# in llm_metrics.PRICES; per i locali anche un costo orario della macchina).
+# concurrency e batch_size valgono solo dove si passa da complete_batch o dallo
+# scheduler (benchmark, "Classifier Scheduler.py"): i singoli script dei
+# classificatori chiamano complete una frase alla volta.
+OPENAI_CONCURRENCY = 8
+LOCAL_CONCURRENCY = 1       # un server llama.cpp su CPU serve una richiesta alla volta
+SKLEARN_BATCH_SIZE = 4096
+FREE = {"input": 0.0, "cached": 0.0, "output": 0.0}
+
+
+def _response(contents: list) -> SimpleNamespace:
+    # risposta con la stessa forma di una ChatCompletion (per metrics.track e parse_answer)
+    return SimpleNamespace(
+        choices=[SimpleNamespace(index=i, finish_reason="stop", message=SimpleNamespace(content=c))
+                 for i, c in enumerate(contents)],
+        usage=SimpleNamespace(prompt_tokens=0, completion_tokens=0, prompt_tokens_details=None))
+
+
+class Backend:
+    name = ""
+    concurrency = 1
+    batch_size = 1
+    cost_per_hour = 0.0
+
+    def complete(self, layout, sentence: str, params: dict):
+        raise NotImplementedError
+
+    def complete_batch(self, layout, sentences: list, params: dict) -> list:
+        # batch = chiamate singole in parallelo, fino alla concorrenza del backend
+        if self.concurrency <= 1:
+            return [self.complete(layout, s, params) for s in sentences]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            return list(pool.map(lambda s: self.complete(layout, s, params), sentences))
+
+    def cost(self, responses, seconds: float) -> float:
+        # token al prezzo del listino + tempo macchina per i backend locali
+        usage = np.array([[r.usage.prompt_tokens or 0, r.usage.completion_tokens or 0,
+                           getattr(getattr(r.usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0]
+                          for r in responses], dtype=float).reshape(-1, 3)
+        tokens = float(np.nansum(call_cost(self.name, usage[:, 0], usage[:, 1], usage[:, 2])))
+        return tokens + self.cost_per_hour * seconds / 3600
+
+
+class OpenAIBackend(Backend):
+
+    def __init__(self, model: str, client=None, concurrency: int = OPENAI_CONCURRENCY):
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(max_retries=0)
+        self.name = model
+        self.client = client
+        self.concurrency = concurrency
+
+    def complete(self, layout, sentence: str, params: dict):
+        return self.client.chat.completions.create(
+            model=self.name, messages=layout.messages(sentence), **params, **layout.request_kwargs())
+
+
+class LocalBackend(Backend):
+    # server compatibile OpenAI. Differenze gestite qui:
+    #   - logit_bias usa gli id dei token di OpenAI: per le risposte a una cifra si
+    #     usa invece una grammatica GBNF (llama.cpp) con le sole cifre ammesse
+    #   - prompt_cache_key non esiste: llama.cpp riusa il prefisso con cache_prompt
+    #   - n > 1 non è garantito: si fanno n chiamate con seed diversi
+
+    def __init__(self, model: str, base_url: str, api_key: str = "local", concurrency: int = LOCAL_CONCURRENCY,
+                 cost_per_hour: float = 0.0, prices: dict = None):
+        from openai import OpenAI
+        self.name = f"local:{model}@{base_url}"
+        self.model = model
+        self.client = OpenAI(base_url=base_url, api_key=api_key, max_retries=0)
+        self.concurrency = concurrency
+        self.cost_per_hour = cost_per_hour
+        PRICES.setdefault(self.name, prices or FREE)
+
+    def _params(self, params: dict) -> dict:
+        params = dict(params)
+        extra = {"cache_prompt": True}
+        bias = params.pop("logit_bias", None)
+        if bias:
+            extra["grammar"] = f"root ::= [1-{len(bias)}]"
+        params.pop("n", None)
+        return {**params, "extra_body": extra}
+
+    def complete(self, layout, sentence: str, params: dict):
+        local = self._params(params)
+        n = int(params.get("n", 1))
+        if n == 1:
+            return self.client.chat.completions.create(model=self.model, messages=layout.messages(sentence), **local)
+        responses = [self.client.chat.completions.create(model=self.model, messages=layout.messages(sentence),
+                                                         seed=i, **local) for i in range(n)]
+        merged = _response([r.choices[0].message.content for r in responses])
+        merged.usage.prompt_tokens = sum(r.usage.prompt_tokens or 0 for r in responses)
+        merged.usage.completion_tokens = sum(r.usage.completion_tokens or 0 for r in responses)
+        return merged
+
+
+class SklearnBackend(Backend):
+    # pipeline scikit-learn salvata con joblib (vedi train_sklearn); nessun costo a token
+
+    def __init__(self, path: str, batch_size: int = SKLEARN_BATCH_SIZE, cost_per_hour: float = 0.0):
+        import joblib
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:12]
+        # il nome include l'hash del file: un modello riaddestrato è un run diverso
+        self.name = f"sklearn:{os.path.basename(path)}@{digest}"
+        self.pipeline = joblib.load(path)
+        self.batch_size = batch_size
+        self.cost_per_hour = cost_per_hour
+        PRICES.setdefault(self.name, FREE)
+
+    @staticmethod
+    def _format(labels, params: dict) -> list:
+        # stessa forma di risposta del modo scelto (cifra o JSON)
+        if params.get("max_tokens") == 1:
+            return [str(int(l)) for l in labels]
+        return [f'{{"class": {int(l)}}}' for l in labels]
+
+    def complete(self, layout, sentence: str, params: dict):
+        return self.complete_batch(layout, [sentence], params)[0]
+
+    def complete_batch(self, layout, sentences: list, params: dict) -> list:
+        out = []
+        for start in range(0, len(sentences), self.batch_size):
+            labels = self.pipeline.predict(sentences[start:start + self.batch_size])
+            out += [_response(self._format([l], params) * int(params.get("n", 1))) for l in labels]
+        return out
+
+
+def train_sklearn(texts, labels, path: str):
+    # TF-IDF (parole e bigrammi) + regressione logistica: pochi secondi su CPU
+    import joblib
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    pipeline = make_pipeline(TfidfVectorizer(ngram_range=(1, 2), min_df=2, sublinear_tf=True),
+                             LogisticRegression(max_iter=1000, class_weight="balanced"))
+    pipeline.fit(list(texts), list(labels))
+    joblib.dump(pipeline, path)
+    return pipeline
+
+
+def make_backend(name: str, client=None) -> Backend:
+    if name.startswith("sklearn:"):
+        return SklearnBackend(name[len("sklearn:"):])
+    if name.startswith("local:"):
+        model, _, base_url = name[len("local:"):].partition("@")
+        return LocalBackend(model, base_url or "http://127.0.0.1:8080/v1")
+    return OpenAIBackend(name, client)
+
+
+def benchmark(backends: list, layout, params: dict, sentences: list, human, n_classes: int,
+              mode: str = "json") -> pd.DataFrame:
+    # throughput, costo per 1000 frasi e accordo con l'etichetta umana per ogni backend
+    from sklearn.metrics import cohen_kappa_score
+    from answer_format import parse_answer
+    human = pd.to_numeric(pd.Series(list(human)), errors="coerce").to_numpy()
+    rows = []
+    for backend in backends:
+        t0 = time.perf_counter()
+        responses = backend.complete_batch(layout, sentences, params)
+        seconds = time.perf_counter() - t0
+        pred = np.array([parse_answer(r.choices[0].message.content, n_classes, mode) or 0 for r in responses])
+        keep = ~np.isnan(human) & (pred > 0)
+        rows.append({"backend": backend.name, "sentences": len(sentences), "seconds": seconds,
+                     "sentences_per_s": len(sentences) / seconds,
+                     "cost_per_1k_usd": 1000 * backend.cost(responses, seconds) / len(sentences),
+                     "invalid": int((pred == 0).sum()),
+                     "accuracy": float((pred[keep] == human[keep]).mean()) if keep.any() else np.nan,
+                     "kappa": cohen_kappa_score(human[keep].astype(int), pred[keep]) if keep.sum() > 1 else np.nan})
+    return pd.DataFrame(rows).set_index("backend")
+
+
+if __name__ == "__main__":
+    import sys
+    from prompt_layout import PromptLayout, prompts_from_script
+    # uso: python model_backends.py train export.csv colonna_umana modello.joblib
+    #      python model_backends.py bench export.csv colonna_umana n_classi script.py backend [backend ...]
+    # (export.csv: colonne sentence e colonna_umana; per sklearn usare frasi non viste in addestramento)
+    if len(sys.argv) > 1 and sys.argv[1] == "train":
+        path, human_col, out = sys.argv[2:5]
+        df = pd.read_csv(path, dtype=str).dropna(subset=[human_col])
+        t0 = time.perf_counter()
+        train_sklearn(df["sentence"], df[human_col].astype(int), out)
+        print(f"{len(df)} frasi, modello salvato in {out} ({time.perf_counter() - t0:.1f} s)")
+    elif len(sys.argv) > 1 and sys.argv[1] == "bench":
+        path, human_col, n_classes, script = sys.argv[2:6]
+        df = pd.read_csv(path, dtype=str)
+        prompt = prompts_from_script(script)["SYSTEM_PROMPT"]
+        params = {"temperature": 0, "max_tokens": 10, "top_p": 1, "response_format": {"type": "json_object"}}
+        backends = [make_backend(name) for name in sys.argv[6:]]
+        result = benchmark(backends, PromptLayout(prompt, "mod"), params, df["sentence"].tolist(), df[human_col],
+                           int(n_classes))
+        print(result.round(4).to_string())
@@ -0,0 +1,130 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from scipy.stats import binom
+from statsmodels.stats.multitest import multipletests
+
+# --- Confronti a coppie tra modelli -----------------------------------------
+# Tutti i test lavorano sulla matrice di correttezza C (frasi × modelli):
+#   McNemar esatto: frasi discordanti b/c di ogni coppia (C.T @ (1 - C))
+#   bootstrap appaiato: stesse frasi ricampionate per tutti i modelli
+#   permutazione: scambio casuale delle risposte di A e B frase per frase
+# Ricampionamenti e permutazioni sono divisi in blocchi su un process pool.
+CHUNK = 250
+
+
+def correctness(human, models: dict):
+    # human/predizioni come nello sheet (stringhe); le righe senza etichetta umana
+    # sono escluse, una predizione vuota o non valida conta come errore
+    human = pd.Series(list(human), dtype=object).fillna("").astype(str).str.strip()
+    keep = (human != "").to_numpy()
+    names = list(models)
+    C = np.column_stack([
+        pd.Series(list(models[name]), dtype=object).fillna("").astype(str).str.strip().to_numpy()[keep]
+        == human.to_numpy()[keep]
+        for name in names
+    ]).astype(np.float64)
+    return names, C
+
+
+def mcnemar_exact(C: np.ndarray):
+    # → b (A giusto, B sbagliato), c (A sbagliato, B giusto), p bilaterale; (m × m)
+    b = C.T @ (1.0 - C)
+    c = b.T
+    n = b + c
+    p = np.minimum(1.0, 2.0 * binom.cdf(np.minimum(b, c), n, 0.5))
+    p[n == 0] = 1.0
+    return b.astype(np.int64), c.astype(np.int64), p
+
+
+def _bootstrap_chunk(task):
+    # accuratezze di tutti i modelli su `size` ricampionamenti (size × m)
+    C, seed, size = task
+    n = len(C)
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, n, (size, n))
+    counts = np.bincount((idx + np.arange(size)[:, None] * n).ravel(), minlength=size * n).reshape(size, n)
+    return counts @ C / n
+
+
+def _permutation_chunk(task):
+    # statistiche permutate per tutte le coppie (size × coppie)
+    D, seed, size = task
+    rng = np.random.default_rng(seed)
+    signs = rng.integers(0, 2, (size, len(D)), dtype=np.int8) * 2 - 1
+    return signs @ D
+
+
+def _run_chunks(fn, data, n_resamples: int, seed: int, workers: int):
+    sizes = [min(CHUNK, n_resamples - s) for s in range(0, n_resamples, CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(data, s, size) for s, size in zip(seeds, sizes)]
+    if workers == 1:
+        return np.vstack([fn(t) for t in tasks])
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        return np.vstack(list(pool.map(fn, tasks)))
+
+
+def compare_models(human, models: dict, n_resamples: int = 10_000, seed: int = 0, alpha: float = 0.05,
+                   workers: int = None) -> pd.DataFrame:
+    # one row per model pair: accuracies, McNemar, paired bootstrap CI of the
+    # difference, permutation p-value, and Holm-adjusted p-values across pairs
+    names, C = correctness(human, models)
+    pairs = list(combinations(range(len(names)), 2))
+    ia = np.array([a for a, _ in pairs], dtype=int)
+    ib = np.array([b for _, b in pairs], dtype=int)
+    acc = C.mean(axis=0)
+    b, c, p_mcnemar = mcnemar_exact(C)
+
+    boot = _run_chunks(_bootstrap_chunk, C, n_resamples, seed, workers)
+    diffs = boot[:, ia] - boot[:, ib]
+    low, high = np.percentile(diffs, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    p_boot = np.minimum(1.0, 2 * np.minimum((diffs <= 0).mean(axis=0), (diffs >= 0).mean(axis=0)))
+
+    D = (C[:, ia] - C[:, ib]).astype(np.float32)
+    observed = np.abs(D.sum(axis=0))
+    perm = _run_chunks(_permutation_chunk, D, n_resamples, seed + 1, workers)
+    p_perm = ((np.abs(perm) >= observed - 1e-9).sum(axis=0) + 1) / (n_resamples + 1)
+
+    out = pd.DataFrame({
+        "model_a": [names[i] for i in ia], "model_b": [names[j] for j in ib],
+        "n": len(C), "acc_a": acc[ia], "acc_b": acc[ib], "diff": acc[ia] - acc[ib],
+        "a_only": b[ia, ib], "b_only": c[ia, ib],
+        "mcnemar_p": p_mcnemar[ia, ib],
+        "boot_low": low, "boot_high": high, "boot_p": p_boot,
+        "perm_p": p_perm,
+    })
+    for col in ("mcnemar_p", "boot_p", "perm_p"):
+        out[col.replace("_p", "_holm")] = multipletests(out[col], alpha=alpha, method="holm")[1] \
+            if len(out) else []
+    return out
+
+
+def pvalue_matrix(result: pd.DataFrame, column: str = "mcnemar_holm") -> pd.DataFrame:
+    # matrice simmetrica modelli × modelli (per heatmap)
+    names = list(dict.fromkeys(result["model_a"].tolist() + result["model_b"].tolist()))
+    mat = pd.DataFrame(np.nan, index=names, columns=names)
+    for a, b, p in result[["model_a", "model_b", column]].itertuples(index=False):
+        mat.at[a, b] = mat.at[b, a] = p
+    return mat
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    # benchmark: 20 modelli × 10k ricampionamenti su n frasi sintetiche
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    n_models = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rng = np.random.default_rng(0)
+    human = rng.integers(1, 5, n).astype(str)
+    models = {}
+    for m in range(n_models):
+        wrong = rng.random(n) > 0.70 + 0.01 * m
+        models[f"model-{m:02d}"] = np.where(wrong, rng.integers(1, 5, n).astype(str), human)
+    t0 = time.perf_counter()
+    result = compare_models(human, models, n_resamples=10_000)
+    print(f"{n_models} modelli ({len(result)} coppie) × 10k ricampionamenti su {n:,} frasi: "
+          f"{time.perf_counter() - t0:.1f} s")
+    print(result.sort_values("mcnemar_p").head(10).round(4).to_string(index=False))
@@ -0,0 +1,259 @@
+import hashlib
+import json
+import os
+import re
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# --- Store denso delle predizioni (run × frasi) -----------------------------
+# codes.int8   : classe predetta per ogni run e frase (memory-mapped)
+#                 0 = non classificata, -1 = risposta non valida, 1..k = classe
+# probs.float16: probabilità per classe (opzionale), run × frasi × classi
+# runs.csv     : metadati dei run (modello, hash del prompt, data, colonna sheet)
+# sentences.parquet: id della frase → colonna del tensore
+# Strumento a sé: gli script di classificazione scrivono nel registro degli
+# esperimenti, lo store si popola con import_sheet o con
+# ExperimentRegistry.to_prediction_store.
+MISSING = 0
+FAILED = -1
+RUN_COLUMNS = ["run_id", "model", "prompt_hash", "date", "column", "has_probs"]
+# colonne dello sheet: mod_gpt-4_1, mod3_gpt-4o, mod4_gpt-4_1-nano, ...
+SHEET_COLUMN_RE = re.compile(r"^(mod\d*)_(.+)$")
+
+
+def sheet_model_name(name: str) -> str:
+    # nelle colonne dello sheet il punto di "gpt-4.1" diventa "_" (mdl.replace(".", "_"));
+    # si ripristina solo quello: mod3_chat_gpt-4o resta chat_gpt-4o
+    return re.sub(r"gpt-4_1", "gpt-4.1", name)
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def encode_labels(values, n_classes: int) -> np.ndarray:
+    # "1".."k" → classe, "" → 0, qualsiasi altra cosa ("None", testo) → -1
+    s = pd.Series(values, dtype=object).fillna("").astype(str).str.strip()
+    num = pd.to_numeric(s, errors="coerce")
+    valid = num.isin(range(1, n_classes + 1))
+    codes = np.where(valid, num.fillna(0), np.where(s == "", MISSING, FAILED))
+    return codes.astype(np.int8)
+
+
+class PredictionStore:
+
+    def __init__(self, path: str, n_classes: int = None, sentence_capacity: int = 1024):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+        else:
+            if n_classes is None:
+                raise ValueError("n_classes è obbligatorio per un nuovo store")
+            self.meta = {"n_classes": n_classes, "capacity": sentence_capacity, "n_runs": 0, "n_sentences": 0}
+            self._save_meta()
+        runs_path = os.path.join(path, "runs.csv")
+        self.runs = pd.read_csv(runs_path, dtype={"prompt_hash": str}) if os.path.exists(runs_path) \
+            else pd.DataFrame(columns=RUN_COLUMNS)
+        self._sentence_ids = None
+
+    @property
+    def n_classes(self) -> int:
+        return self.meta["n_classes"]
+
+    @property
+    def n_runs(self) -> int:
+        return self.meta["n_runs"]
+
+    @property
+    def n_sentences(self) -> int:
+        return self.meta["n_sentences"]
+
+    @property
+    def sentence_ids(self) -> pd.Index:
+        # caricati solo quando servono (scritture, export): aprire lo store resta O(1)
+        if self._sentence_ids is None:
+            path = self._file("sentences.parquet")
+            ids = pd.read_parquet(path)["sentence_id"].to_numpy(dtype=object) if os.path.exists(path) else []
+            self._sentence_ids = pd.Index(ids, dtype=object)
+        return self._sentence_ids
+
+    # --- file ---------------------------------------------------------------
+    def _save_meta(self):
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _map(self, name, dtype, extra=(), mode="r+"):
+        shape = (self.n_runs, self.meta["capacity"]) + tuple(extra)
+        if self.n_runs == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode=mode, shape=shape)
+
+    def _grow_capacity(self, needed: int):
+        # raddoppia la capacità delle frasi riscrivendo i file (costo ammortizzato)
+        old_cap = self.meta["capacity"]
+        new_cap = max(needed, 2 * old_cap)
+        for name, dtype, extra in (("codes.int8", np.int8, ()),
+                                   ("probs.float16", np.float16, (self.n_classes,))):
+            if self.n_runs == 0 or not os.path.exists(self._file(name)):
+                continue
+            old = np.memmap(self._file(name), dtype=dtype, mode="r",
+                            shape=(self.n_runs, old_cap) + extra)
+            new = np.memmap(self._file(name) + ".tmp", dtype=dtype, mode="w+",
+                            shape=(self.n_runs, new_cap) + extra)
+            new[:, :old_cap] = old
+            new.flush()
+            del old, new
+            os.replace(self._file(name) + ".tmp", self._file(name))
+        self.meta["capacity"] = new_cap
+        self._save_meta()
+
+    # --- scrittura ----------------------------------------------------------
+    def sentence_index(self, ids) -> np.ndarray:
+        # column of each sentence id, registering the new ones
+        ids = pd.Index(np.asarray(ids).astype(str), dtype=object)
+        pos = self.sentence_ids.get_indexer(ids)
+        if (pos < 0).any():
+            new = ids[pos < 0].unique()
+            self._sentence_ids = self.sentence_ids.append(new)
+            if len(self._sentence_ids) > self.meta["capacity"]:
+                self._grow_capacity(len(self._sentence_ids))
+            pd.DataFrame({"sentence_id": self._sentence_ids.astype(str)}).to_parquet(
+                self._file("sentences.parquet"), index=False)
+            self.meta["n_sentences"] = len(self._sentence_ids)
+            self._save_meta()
+            pos = self._sentence_ids.get_indexer(ids)
+        return pos
+
+    def add_run(self, model: str, prompt: str = None, prompt_hash_value: str = None,
+                column: str = "", date: str = None, with_probs: bool = False) -> int:
+        run_id = self.n_runs
+        row = np.zeros((1, self.meta["capacity"]), dtype=np.int8)
+        with open(self._file("codes.int8"), "ab") as f:
+            f.write(row.tobytes())
+        if with_probs or os.path.exists(self._file("probs.float16")):
+            # i run senza probabilità occupano comunque il loro blocco (NaN)
+            self._ensure_probs()
+            with open(self._file("probs.float16"), "ab") as f:
+                f.write(np.full((1, self.meta["capacity"], self.n_classes), np.nan, np.float16).tobytes())
+        self.meta["n_runs"] += 1
+        self._save_meta()
+        self.runs.loc[len(self.runs)] = {
+            "run_id": run_id, "model": model,
+            "prompt_hash": prompt_hash_value or (prompt_hash(prompt) if prompt else ""),
+            "date": date or datetime.utcnow().date().isoformat(),
+            "column": column, "has_probs": bool(with_probs),
+        }
+        self.runs.to_csv(self._file("runs.csv"), index=False)
+        return run_id
+
+    def _ensure_probs(self):
+        if os.path.exists(self._file("probs.float16")):
+            return
+        with open(self._file("probs.float16"), "wb") as f:
+            f.write(np.full((self.n_runs, self.meta["capacity"], self.n_classes),
+                            np.nan, np.float16).tobytes())
+
+    def write(self, run_id: int, sentence_ids, codes, probs=None) -> None:
+        idx = self.sentence_index(sentence_ids)
+        mm = self._map("codes.int8", np.int8)
+        mm[run_id, idx] = np.asarray(codes, dtype=np.int8)
+        mm.flush()
+        if probs is not None:
+            pm = self._map("probs.float16", np.float16, (self.n_classes,))
+            pm[run_id, idx] = np.asarray(probs, dtype=np.float16)
+            pm.flush()
+
+    # --- lettura ------------------------------------------------------------
+    def codes(self, runs=None) -> np.ndarray:
+        # read-only memmap view (runs × sentences); no data is read until used
+        mm = self._map("codes.int8", np.int8, mode="r")[:, :self.n_sentences]
+        return mm if runs is None else mm[runs]
+
+    def probs(self, runs=None) -> np.ndarray:
+        if not os.path.exists(self._file("probs.float16")):
+            return None
+        mm = self._map("probs.float16", np.float16, (self.n_classes,), mode="r")[:, :self.n_sentences]
+        return mm if runs is None else mm[runs]
+
+    def find_runs(self, **filters) -> list:
+        runs = self.runs
+        for key, value in filters.items():
+            runs = runs[runs[key] == value]
+        return runs["run_id"].astype(int).tolist()
+
+    def agreement(self, reference: np.ndarray, runs=None) -> pd.Series:
+        # accordo di ogni run con un vettore di riferimento (codici), solo celle valide
+        codes = self.codes(runs)
+        run_ids = list(range(self.n_runs)) if runs is None else list(runs)
+        valid = (codes > 0) & (reference > 0)
+        hits = ((codes == reference) & valid).sum(axis=1)
+        return pd.Series(hits / np.maximum(valid.sum(axis=1), 1), index=run_ids)
+
+    # --- conversione da/verso il layout dello sheet -------------------------
+    def import_sheet(self, df: pd.DataFrame, id_col: str = "id", prompts: dict = None) -> list:
+        # one run per mod*_ column; prompts maps the prefix (mod, mod3, ...) to its prompt text
+        prompts = prompts or {}
+        ids = df[id_col].astype(str).tolist()
+        created = []
+        for col in df.columns:
+            m = SHEET_COLUMN_RE.match(col)
+            if not m:
+                continue
+            prefix, model = m.groups()
+            prompt = prompts.get(prefix)
+            run = self.add_run(sheet_model_name(model), prompt=prompt,
+                               prompt_hash_value=None if prompt else prefix, column=col)
+            self.write(run, ids, encode_labels(df[col], self.n_classes))
+            created.append(run)
+        return created
+
+    def to_sheet_frame(self, runs=None, failed: str = "") -> pd.DataFrame:
+        # vista nel formato dello sheet: una colonna stringa per run
+        run_ids = list(range(self.n_runs)) if runs is None else list(runs)
+        codes = np.asarray(self.codes(run_ids))
+        lookup = np.array([failed, ""] + [str(c) for c in range(1, self.n_classes + 1)], dtype=object)
+        out = pd.DataFrame({"id": self.sentence_ids})
+        for i, run in enumerate(run_ids):
+            meta = self.runs.iloc[run]
+            name = meta["column"] if isinstance(meta["column"], str) and meta["column"] else \
+                f"run{run}_{meta['model'].replace('.', '_')}"
+            out[name] = lookup[codes[i].astype(np.int64) + 1]
+        return out
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import time
+    import tracemalloc
+    # benchmark: 10 run × 1M frasi, poi caricamento di tutti i run
+    n_sent = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    n_runs = 10
+    path = tempfile.mkdtemp()
+    store = PredictionStore(path, n_classes=4, sentence_capacity=n_sent)
+    ids = np.arange(n_sent).astype(str)
+    rng = np.random.default_rng(0)
+    t0 = time.perf_counter()
+    for r in range(n_runs):
+        run = store.add_run(f"model-{r}", prompt=f"prompt {r % 3}")
+        store.write(run, ids, rng.integers(-1, 5, n_sent))
+    print(f"Scrittura di {n_runs} run × {n_sent:,} frasi: {time.perf_counter() - t0:.2f} s")
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    reopened = PredictionStore(path)
+    codes = reopened.codes()
+    t_open = time.perf_counter() - t0
+    agreement = reopened.agreement(codes[0])
+    t_all = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    print(f"Apertura store + memmap: {t_open * 1000:.1f} ms")
+    print(f"Accordo di tutti i run col run 0: {t_all * 1000:.1f} ms, picco memoria Python {peak / 1e6:.1f} MB")
+    print(f"Dimensione su disco: {os.path.getsize(os.path.join(path, 'codes.int8')) / 1e6:.1f} MB")
@@ -0,0 +1,200 @@
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import unicodedata
+import numpy as np
+import pandas as pd
+
+from llm_metrics import call_cost
+
+try:
+    import tiktoken
+except ImportError:  # fallback: stima di ~4 caratteri per token
+    tiktoken = None
+
+# --- Layout dei messaggi per la cache dei prefissi ----------------------------
+# OpenAI riusa automaticamente il prefisso già visto di una richiesta (da 1024
+# token in su, a blocchi di 128, per alcuni minuti) e fattura quei token al
+# prezzo "cached". Perché succeda il prefisso deve essere identico byte per byte:
+#   - prima tutto il contenuto statico (definizioni, esempi) nel messaggio di sistema
+#   - per ultima la frase da classificare, da sola nel messaggio utente
+#   - chiamate con lo stesso modello e la stessa versione del prompt una dopo
+#     l'altra (schedule), con prompt_cache_key per instradarle sulla stessa cache
+# Con i prompt attuali (221-456 token, vedi "python prompt_layout.py check") la
+# soglia di 1024 token non si raggiunge: la cache non scatta e il layout non fa
+# risparmiare nulla finché i prompt non crescono (es. esempi few-shot). Resta
+# utile solo perché il rendering è deterministico (tests/test_prompt_layout.py).
+CACHE_MIN_TOKENS = 1024
+CHARS_PER_TOKEN = 4
+# frasi per blocco: dentro un blocco tutte le chiamate di un modello sono consecutive
+BLOCK_SIZE = 200
+
+
+def normalize_prompt(text: str) -> str:
+    # solo trasformazioni che non cambiano il testo visibile: NFC e fine riga \n
+    # (niente strip: l'hash del prompt nel registro resta quello di sempre)
+    return unicodedata.normalize("NFC", text.replace("\r\n", "\n"))
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    if tiktoken is not None:
+        try:
+            try:
+                enc = tiktoken.encoding_for_model(model)
+            except KeyError:
+                enc = tiktoken.get_encoding("o200k_base")
+            return len(enc.encode(text))
+        except Exception:  # tabelle BPE non scaricabili (offline): stima
+            pass
+    return len(text) // CHARS_PER_TOKEN
+
+
+class PromptLayout:
+
+    def __init__(self, system_prompt: str, version: str):
+        self.static = normalize_prompt(system_prompt)
+        self.version = version
+        self.hash = hashlib.sha256(self.static.encode("utf-8")).hexdigest()[:12]
+        self.cache_key = f"{version}-{self.hash}"
+        self.tokens = count_tokens(self.static)
+        self._system = {"role": "system", "content": self.static}
+
+    @property
+    def cacheable(self) -> bool:
+        return self.tokens >= CACHE_MIN_TOKENS
+
+    def messages(self, sentence: str) -> list:
+        # prefisso statico sempre lo stesso oggetto, frase per ultima
+        return [self._system, {"role": "user", "content": normalize_prompt(sentence)}]
+
+    def request_kwargs(self) -> dict:
+        # fuori da PARAMS: non cambia l'identità del run nel registro
+        return {"extra_body": {"prompt_cache_key": self.cache_key}}
+
+    def render(self, sentence: str) -> bytes:
+        # i byte del corpo della richiesta (messages) come li vede l'API
+        return json.dumps(self.messages(sentence), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def warn_if_short(self) -> None:
+        if not self.cacheable:
+            print(f"[prompt {self.version}] ~{self.tokens} token di prefisso statico: sotto la soglia di "
+                  f"{CACHE_MIN_TOKENS} la cache automatica non scatta (aggiungere esempi few-shot aiuta)")
+
+
+def schedule(rows, models, block_size: int = BLOCK_SIZE):
+    # (modello, riga) blocco per blocco: nel blocco prima tutte le frasi del primo
+    # modello, poi del secondo... così lo stesso prefisso torna entro pochi secondi
+    rows = list(rows)
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        for mdl in models:
+            for row in block:
+                yield mdl, row
+
+
+# --- Rapporto sulla cache -----------------------------------------------------
+def cache_report(metrics, task: str = None, since: float = None) -> pd.DataFrame:
+    # per modello e prompt: token in cache, hit ratio e costo effettivo vs senza cache
+    df = metrics.calls(task, since)
+    if df.empty:
+        return pd.DataFrame()
+    df["cost_no_cache"] = np.nan
+    for model, idx in df.groupby("model").groups.items():
+        sub = df.loc[idx]
+        df.loc[idx, "cost_no_cache"] = call_cost(model, sub["prompt_tokens"], sub["completion_tokens"], 0)
+    df["hit"] = df["cached_tokens"] > 0
+    g = df.groupby(["model", "prompt_hash"])
+    out = pd.DataFrame({
+        "calls": g.size(),
+        "calls_with_hit": g["hit"].mean(),
+        "prompt_tokens": g["prompt_tokens"].sum(),
+        "cached_tokens": g["cached_tokens"].sum(),
+        "cost_usd": g["cost"].sum(),
+        "cost_no_cache_usd": g["cost_no_cache"].sum(),
+    })
+    out["hit_ratio"] = out["cached_tokens"] / out["prompt_tokens"].replace(0, np.nan)
+    out["savings"] = 1 - out["cost_usd"] / out["cost_no_cache_usd"].replace(0, np.nan)
+    return out
+
+
+def print_cache_report(metrics, task: str = None, since: float = None) -> None:
+    report = cache_report(metrics, task, since)
+    if report.empty:
+        return
+    print("Cache dei prefissi (hit_ratio = token in cache / token di prompt):")
+    print(report.round(4).to_string())
+
+
+# --- Verifica: il rendering è identico tra esecuzioni --------------------------
+def prompts_from_script(path: str) -> dict:
+    # le costanti SYSTEM_PROMPT* di uno script, senza eseguirlo
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    prompts = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant) \
+                and isinstance(node.value.value, str):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id.startswith("SYSTEM_PROMPT"):
+                    prompts[target.id] = node.value.value
+    return prompts
+
+
+CHECK_SENTENCES = ["È una donna disponibile, sempre pronta ad aiutare.",
+                   "Cercasi donna libera per incontri\r\nDisponibile dal lunedì"]
+
+
+def fingerprints(paths) -> dict:
+    # sha256 dei byte renderizzati per ogni (script, prompt, frase di prova)
+    out = {}
+    for path in paths:
+        for name, prompt in sorted(prompts_from_script(path).items()):
+            layout = PromptLayout(prompt, name)
+            for i, sentence in enumerate(CHECK_SENTENCES):
+                out[f"{os.path.basename(path)}:{name}:{i}"] = hashlib.sha256(layout.render(sentence)).hexdigest()
+    return out
+
+
+def check(paths) -> bool:
+    # 1) stessi byte in processi diversi (hash seed diversi)
+    # 2) per ogni prompt il prefisso statico è identico tra frasi diverse
+    ok = True
+    local = fingerprints(paths)
+    for seed in ("0", "1", "12345"):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        code = "import json, sys, prompt_layout; print(json.dumps(prompt_layout.fingerprints(sys.argv[1:])))"
+        res = subprocess.run([sys.executable, "-c", code, *paths], capture_output=True, text=True, env=env,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        remote = json.loads(res.stdout)
+        diff = [k for k in local if remote.get(k) != local[k]]
+        if diff or set(remote) != set(local):
+            ok = False
+            print(f"PYTHONHASHSEED={seed}: rendering diverso per {diff or 'insieme di prompt diverso'}")
+    for path in paths:
+        for name, prompt in prompts_from_script(path).items():
+            layout = PromptLayout(prompt, name)
+            prefixes = {layout.render(s)[:layout.render(s).index(b'{"role":"user"')] for s in CHECK_SENTENCES}
+            if len(prefixes) != 1:
+                ok = False
+                print(f"{path}:{name}: il prefisso statico cambia con la frase")
+            layout.warn_if_short()
+    print(f"{len(local)} rendering controllati: " + ("identici" if ok else "DIFFERENZE"))
+    return ok
+
+
+if __name__ == "__main__":
+    from llm_metrics import MetricsStore
+    # uso: python prompt_layout.py report [task]
+    #      python prompt_layout.py check [script.py ...]
+    if len(sys.argv) > 1 and sys.argv[1] == "check":
+        here = os.path.dirname(os.path.abspath(__file__))
+        scripts = sys.argv[2:] or [os.path.join(here, name) for name in (
+            "Classifier Test data Donna disponibile.py", "Classifier Training Data Donna libera.py",
+            "classifier Training Data Donna Disponibile.py")]
+        sys.exit(0 if check(scripts) else 1)
+    task = sys.argv[2] if len(sys.argv) > 2 else None
+    report = cache_report(MetricsStore(), task)
+    print(report.round(4).to_string() if not report.empty else "Nessuna chiamata registrata.")
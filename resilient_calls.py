@@ -0,0 +1,328 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+# --- Chiamate resilienti ai modelli -------------------------------------------
+# Ogni errore finisce in una categoria:
+#   rate_limit     429                                   → ritenta, rispetta retry-after
+#   timeout        timeout o connessione caduta          → ritenta
+#   server         5xx                                   → ritenta
+#   malformed      risposta senza classe valida          → ritenta poche volte
+#   content_filter bloccata dal filtro dei contenuti     → permanente
+#   client         altri 4xx (richiesta sbagliata, auth) → permanente
+# Le altre eccezioni (KeyError, TypeError, ...) sono bug del codice, non errori
+# del servizio: si rilanciano subito, senza ritentativi, breaker o dead-letter.
+# I ritentativi usano backoff esponenziale con jitter ("full jitter"); esauriti i
+# tentativi, o per gli errori permanenti, l'elemento va nella dead-letter (JSON
+# Lines) e il run prosegue. Un circuit breaker per modello smette di chiamare un
+# modello che fallisce di continuo, così non rallenta gli altri.
+RETRYABLE = {"rate_limit", "timeout", "server", "malformed"}
+PERMANENT = {"content_filter", "client"}
+# errori che contano per il circuit breaker (429 e risposte sporche no: il modello funziona)
+BREAKER_ERRORS = {"timeout", "server"}
+DEFAULT_DEAD_LETTER_PATH = os.environ.get(
+    "CLASSIFIER_DEAD_LETTER", os.path.expanduser("~/.cache/linguistica/dead_letter.jsonl")
+)
+
+
+class MalformedAnswer(Exception):
+    pass
+
+
+def error_category(exc: BaseException):
+    # solo attributi e nomi delle classi di openai: nessun import qui.
+    # None = non è un errore dell'API (va rilanciato)
+    if isinstance(exc, MalformedAnswer):
+        return "malformed"
+    name = type(exc).__name__
+    if name in ("APITimeoutError", "APIConnectionError", "Timeout", "TimeoutError", "ConnectionError",
+                "ConnectionResetError", "ReadTimeout", "ConnectTimeout", "RemoteProtocolError"):
+        return "timeout"
+    status = getattr(exc, "status_code", None)
+    if status is None and name not in ("APIError", "RateLimitError", "InternalServerError"):
+        return None
+    text = f"{getattr(exc, 'code', '') or ''} {exc}".lower()
+    if status == 429 or name == "RateLimitError":
+        # quota esaurita: ritentare non serve
+        return "client" if "insufficient_quota" in text else "rate_limit"
+    if "content_filter" in text or "content management policy" in text:
+        return "content_filter"
+    if status is not None and status >= 500:
+        return "server"
+    if status is not None and 400 <= status < 500:
+        return "client"
+    # APIError senza codice HTTP (risposta interrotta a metà stream)
+    return "server"
+
+
+def retry_after(exc: BaseException):
+    # secondi suggeriti dal server (retry-after-ms o retry-after), se presenti
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class RetryPolicy:
+
+    def __init__(self, max_attempts: int = 6, base_s: float = 0.5, cap_s: float = 60.0,
+                 max_malformed_attempts: int = 2, seed: int = None):
+        self.max_attempts = max_attempts
+        self.base_s = base_s
+        self.cap_s = cap_s
+        # a temperatura 0 una risposta sporca tende a ripetersi: pochi tentativi
+        self.max_malformed_attempts = max_malformed_attempts
+        self._rng = random.Random(seed)
+
+    def attempts_for(self, category: str) -> int:
+        return self.max_malformed_attempts if category == "malformed" else self.max_attempts
+
+    def delay(self, attempt: int, exc: BaseException = None) -> float:
+        # full jitter: uniforme in [0, min(cap, base·2^attempt)], mai meno di retry-after
+        backoff = self._rng.uniform(0, min(self.cap_s, self.base_s * 2 ** attempt))
+        hint = retry_after(exc) if exc is not None else None
+        return max(backoff, hint) if hint is not None else backoff
+
+
+class CircuitBreaker:
+    # closed → (failure_threshold errori di fila) → open → (cooldown) → half-open:
+    # passa una sola chiamata di prova (gli altri thread restano fuori finché non
+    # finisce); se riesce si richiude, altrimenti torna open
+
+    def __init__(self, failure_threshold: int = 5, cooldown_s: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown_s else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown_s:
+                return False
+            self.probing = True
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def release(self) -> None:
+        # prova finita senza verdetto sul modello (429, risposta sporca, bug):
+        # il prossimo allow() ne lascia passare un'altra
+        with self._lock:
+            self.probing = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self.probing = False
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+class DeadLetterQueue:
+    # un elemento per riga: {"ts", "task", "model", "sentence_id", "category", "error", "attempts", ...}
+
+    def __init__(self, path: str = DEFAULT_DEAD_LETTER_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+
+    def put(self, item: dict, category: str, error: str, attempts: int) -> None:
+        rec = {"ts": datetime.utcnow().isoformat(), **item, "category": category, "error": error[:500],
+               "attempts": attempts}
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    def _read(self) -> list:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def items(self, task: str = None) -> list:
+        with self._lock:
+            items = self._read()
+        return [it for it in items if task is None or it.get("task") == task]
+
+    def _rewrite(self, keep: list) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for it in keep:
+                f.write(json.dumps(it, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+
+    def permanent_ids(self, task: str, model: str, prompt_version: str = None) -> set:
+        # frasi da non riprovare in automatico (filtro contenuti, richieste rifiutate)
+        return {str(it["sentence_id"]) for it in self.items(task)
+                if it.get("model") == model and it["category"] in PERMANENT
+                and (prompt_version is None or it.get("prompt_version") == prompt_version)}
+
+    def clear_retryable(self, task: str) -> int:
+        # all'avvio di un run: gli errori transitori vengono comunque ritentati dal
+        # ciclo principale (non sono nel registro), quindi escono dalla coda
+        with self._lock:
+            items = self._read()
+            keep = [it for it in items if it.get("task") != task or it["category"] in PERMANENT]
+            self._rewrite(keep)
+        return len(items) - len(keep)
+
+    def reprocess(self, handler, task: str = None) -> int:
+        # handler(item) → True se risolto; restano in coda solo quelli non risolti
+        with self._lock:
+            items = self._read()
+        resolved = []
+        for it in items:
+            if (task is None or it.get("task") == task) and handler(it):
+                resolved.append(it)
+        with self._lock:
+            current = self._read()
+            self._rewrite([it for it in current if it not in resolved])
+        return len(resolved)
+
+    def summary(self, task: str = None) -> Counter:
+        return Counter((it.get("model"), it["category"]) for it in self.items(task))
+
+    def print_summary(self, task: str = None) -> None:
+        summary = self.summary(task)
+        if not summary:
+            print("Dead-letter vuota.")
+            return
+        print(f"Dead-letter ({self.path}):")
+        for (model, category), count in sorted(summary.items()):
+            print(f"{model:>14}  {category:<15} {count}")
+
+
+def has_label(result) -> bool:
+    # validate per classify_with_model: (classe, testo) con classe non None
+    return result is not None and result[0] is not None
+
+
+class ResilientCaller:
+
+    def __init__(self, dead_letter: DeadLetterQueue = None, policy: RetryPolicy = None,
+                 failure_threshold: int = 5, cooldown_s: float = 60.0, sleep=time.sleep):
+        self.dead_letter = dead_letter
+        self.policy = policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.breakers = {}
+        self.sleep = sleep
+        self.stats = Counter()
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        # setdefault: più thread dello scheduler possono chiedere lo stesso modello
+        return self.breakers.setdefault(model, CircuitBreaker(self.failure_threshold, self.cooldown_s))
+
+    def _give_up(self, item, category: str, error: str, attempts: int):
+        self.stats[f"dead:{category}"] += 1
+        if self.dead_letter is not None and item is not None:
+            self.dead_letter.put(item, category, error, attempts)
+        return None
+
+    def call(self, model: str, fn, *args, item: dict = None, validate=None, **kwargs):
+        # fn(*args, **kwargs) con ritentativi; None se l'elemento è finito in dead-letter.
+        # validate(risultato) → False per una risposta senza classe valida (malformed)
+        breaker = self.breaker(model)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                return self._give_up(item, "circuit_open", f"circuit breaker aperto per {model}", attempt)
+            attempt += 1
+            self.stats["attempts"] += 1
+            try:
+                result = fn(*args, **kwargs)
+                if validate is not None and not validate(result):
+                    raise MalformedAnswer(f"risposta non valida: {result!r}")
+            except Exception as exc:
+                category = error_category(exc)
+                if category in BREAKER_ERRORS:
+                    breaker.failure()
+                else:
+                    breaker.release()
+                if category is None:
+                    raise
+                self.stats[category] += 1
+                if category not in RETRYABLE or attempt >= self.policy.attempts_for(category):
+                    return self._give_up(item, category, f"{type(exc).__name__}: {exc}", attempt)
+                self.sleep(self.policy.delay(attempt - 1, exc))
+                continue
+            breaker.success()
+            self.stats["ok"] += 1
+            return result
+
+
+if __name__ == "__main__":
+    import sys
+    # uso: python resilient_calls.py [dead_letter.jsonl]            riepilogo della coda
+    #      python resilient_calls.py requeue [dead_letter.jsonl] [task]   svuota: il prossimo run ritenta
+    #      python resilient_calls.py demo                             prova sul simulatore
+    if len(sys.argv) > 1 and sys.argv[1] == "demo":
+        from openai import OpenAI
+        from answer_format import parse_answer
+        from llm_simulator import SimulatorConfig, running_simulator
+        # 5 modelli, uno sempre in errore 500; 429, 500 e JSON troncati a caso
+        config = SimulatorConfig(latency_ms=100, rate_limit_prob=0.1, retry_after_s=0.2, server_error_prob=0.05,
+                                 malformed_prob=0.05, broken_models=("gpt-4o",), seed=3, time_scale=0.2)
+        models = ["gpt-4.1", "gpt-4.1-mini", "gpt-4.1-nano", "gpt-4o", "gpt-4o-mini"]
+        dlq = DeadLetterQueue(os.path.join(os.path.dirname(os.path.abspath(__file__)), "dead_letter_demo.jsonl"))
+        if os.path.exists(dlq.path):
+            os.remove(dlq.path)
+        with running_simulator(config) as sim:
+            client = OpenAI(base_url=sim.base_url, api_key="sim", max_retries=0)
+            caller = ResilientCaller(dlq, RetryPolicy(base_s=0.05, cap_s=1.0, seed=0), cooldown_s=5.0)
+
+            def classify(sentence, model):
+                resp = client.chat.completions.create(
+                    model=model, temperature=0, max_tokens=10, response_format={"type": "json_object"},
+                    messages=[{"role": "system", "content": "Rispondi con un intero tra 1 e 4"},
+                              {"role": "user", "content": sentence}])
+                txt = resp.choices[0].message.content
+                return parse_answer(txt, 4), txt
+
+            per_model = Counter()
+            t0 = time.perf_counter()
+            for i in range(200):
+                for model in models:
+                    res = caller.call(model, classify, f"frase {i}", model, validate=lambda r: r[0] is not None,
+                                      item={"task": "demo", "model": model, "sentence_id": str(i)})
+                    per_model[model] += res is not None
+            elapsed = time.perf_counter() - t0
+        print(f"200 frasi × {len(models)} modelli in {elapsed:.1f} s, richieste al simulatore: {sim.stats['requests']}")
+        print("classificate per modello:", dict(per_model))
+        print("esiti:", dict(caller.stats))
+        print("breaker:", {m: b.state for m, b in caller.breakers.items()})
+        print("dead-letter:", dict(dlq.summary()))
+        os.remove(dlq.path)
+        sys.exit(0)
+    requeue = len(sys.argv) > 1 and sys.argv[1] == "requeue"
+    args = sys.argv[2:] if requeue else sys.argv[1:]
+    dlq = DeadLetterQueue(args[0] if args else DEFAULT_DEAD_LETTER_PATH)
+    task = args[1] if len(args) > 1 else None
+    if requeue:
+        print(f"{dlq.reprocess(lambda it: True, task)} elementi rimessi in coda per il prossimo run")
+    else:
+        dlq.print_summary(task)
@@ -0,0 +1,137 @@
+import json
+import numpy as np
+import pandas as pd
+
+from answer_format import parse_answer
+
+# --- Self-consistency: k campioni in una sola chiamata (parametro n) -----------
+# Per misurare la stabilità delle etichette non serve rilanciare lo script con un
+# altro passaggio (mod3_/mod4_): si chiedono n=k risposte a temperatura > 0 nella
+# stessa richiesta. Il prompt si paga una volta sola, cresce solo l'output.
+# Nel registro ogni frase ha come label la classe di maggioranza e nel campo raw
+# la distribuzione dei voti con l'entropia: un segnale di incertezza per decidere
+# quali frasi mandare alla revisione umana.
+SAMPLES = 5
+TEMPERATURE = 0.7
+
+
+def sc_params(params: dict, n: int = SAMPLES, temperature: float = TEMPERATURE) -> dict:
+    # parametri del run self-consistency (diversi da quelli deterministici: run a parte)
+    return {**params, "n": n, "temperature": temperature}
+
+
+def votes(texts, n_classes: int, mode: str = "json") -> np.ndarray:
+    # conteggi per classe; l'indice 0 conta le risposte non valide
+    counts = np.zeros(n_classes + 1, dtype=np.int64)
+    for text in texts:
+        counts[parse_answer(text, n_classes, mode) or 0] += 1
+    return counts
+
+
+def vote_summary(counts: np.ndarray) -> dict:
+    # maggioranza, quota di accordo, entropia (bit) e entropia normalizzata in [0, 1]
+    valid = np.asarray(counts[1:], dtype=float)
+    total = valid.sum()
+    out = {"votes": [int(c) for c in counts[1:]], "invalid": int(counts[0])}
+    if total == 0:
+        return {**out, "label": None, "agreement": 0.0, "entropy": None, "entropy_norm": None, "tie": False}
+    p = valid / total
+    nz = p[p > 0]
+    entropy = float(-(nz * np.log2(nz)).sum())
+    top = valid.max()
+    return {**out, "label": int(valid.argmax()) + 1, "agreement": float(top / total),
+            "entropy": entropy, "entropy_norm": entropy / np.log2(len(valid)) if len(valid) > 1 else 0.0,
+            "tie": bool((valid == top).sum() > 1)}
+
+
+def classify_votes(backend, metrics, task: str, layout, model: str, sentence: str, params: dict,
+                   n_classes: int, mode: str = "json", sentence_id=None):
+    # una chiamata con n campioni → (label di maggioranza, JSON dei voti per il registro)
+    with metrics.track(model, task, layout.hash, sentence_id) as call:
+        resp = backend.complete(layout, sentence, params)
+        call.response(resp)
+        summary = vote_summary(votes([c.message.content for c in resp.choices], n_classes, mode))
+        call.set_label(summary["label"])
+    return summary["label"], json.dumps(summary)
+
+
+def vote_table(registry, run_ids: dict) -> pd.DataFrame:
+    # run_ids: modello → run self-consistency; una riga per (modello, frase)
+    long = registry.results(list(run_ids.values()), with_raw=True)
+    names = {int(r): m for m, r in run_ids.items()}
+    rows = []
+    for run_id, sentence_id, raw in long[["run_id", "sentence_id", "raw"]].itertuples(index=False):
+        if not raw:
+            continue
+        summary = json.loads(raw)
+        rows.append({"model": names[int(run_id)], "sentence_id": sentence_id, "label": summary["label"],
+                     "agreement": summary["agreement"], "entropy_norm": summary["entropy_norm"],
+                     "tie": summary["tie"], "votes": summary["votes"]})
+    return pd.DataFrame(rows)
+
+
+def review_queue(table: pd.DataFrame, min_entropy: float = 0.3) -> pd.DataFrame:
+    # frasi da rivedere: entropia media sui modelli sopra soglia, o modelli in
+    # disaccordo sulla maggioranza; le più incerte per prime
+    if table.empty:
+        return pd.DataFrame()
+    g = table.groupby("sentence_id")
+    out = pd.DataFrame({
+        "mean_entropy": g["entropy_norm"].mean(),
+        "max_entropy": g["entropy_norm"].max(),
+        "ties": g["tie"].sum(),
+        "distinct_labels": g["label"].nunique(),
+    })
+    out = out[(out["mean_entropy"] >= min_entropy) | (out["distinct_labels"] > 1) | (out["ties"] > 0)]
+    return out.sort_values(["mean_entropy", "distinct_labels"], ascending=False)
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import time
+    from openai import OpenAI
+    from llm_metrics import call_cost
+    from llm_simulator import SimulatorConfig, running_simulator
+    from prompt_layout import PromptLayout, prompts_from_script
+    # uso: python self_consistency.py bench [n_frasi] [k]
+    #      python self_consistency.py review registro.sqlite task prompt_version [soglia]
+    if len(sys.argv) > 1 and sys.argv[1] == "review":
+        from experiment_registry import ExperimentRegistry
+        registry = ExperimentRegistry(sys.argv[2])
+        run_ids = registry.latest_runs(sys.argv[3], prompt_version=sys.argv[4])
+        queue = review_queue(vote_table(registry, run_ids), float(sys.argv[5]) if len(sys.argv) > 5 else 0.3)
+        print(f"{len(queue)} frasi da rivedere")
+        print(queue.head(50).round(3).to_string())
+        sys.exit(0)
+    # benchmark sul simulatore: k chiamate separate contro una chiamata con n=k
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else SAMPLES
+    here = os.path.dirname(os.path.abspath(__file__))
+    prompt = prompts_from_script(os.path.join(here, "Classifier Training Data Donna libera.py"))["SYSTEM_PROMPT"]
+    sentences = pd.read_csv(os.path.join(here, "train_sentences_libera.csv"))["sentence"].head(n).tolist()
+    layout = PromptLayout(prompt, "mod")
+    params = {"temperature": 0, "max_tokens": 10, "top_p": 1, "response_format": {"type": "json_object"}}
+    model = "gpt-4.1-mini"
+    rows = []
+    with running_simulator(SimulatorConfig(latency_ms=300, ms_per_output_token=20, seed=1)) as sim:
+        client = OpenAI(base_url=sim.base_url, api_key="sim", max_retries=0)
+        for name, calls, per_call in (("k chiamate", k, sc_params(params, 1)), ("n=k", 1, sc_params(params, k))):
+            usage = np.zeros(2)
+            entropies = []
+            t0 = time.perf_counter()
+            for i, sentence in enumerate(sentences):
+                texts = []
+                for j in range(calls):
+                    resp = client.chat.completions.create(
+                        model=model, messages=layout.messages(sentence), **per_call, seed=j)
+                    usage += [resp.usage.prompt_tokens, resp.usage.completion_tokens]
+                    texts += [c.message.content for c in resp.choices]
+                entropies.append(vote_summary(votes(texts, 6))["entropy_norm"])
+            elapsed = time.perf_counter() - t0
+            rows.append({"mode": name, "requests": calls * len(sentences), "prompt_tokens": int(usage[0]),
+                         "completion_tokens": int(usage[1]),
+                         "cost_per_1k_usd": 1000 * call_cost(model, usage[0], usage[1], 0) / len(sentences),
+                         "seconds": elapsed, "mean_entropy": float(np.nanmean(entropies))})
+    print(f"{len(sentences)} frasi × {k} campioni, {model} simulato:")
+    print(pd.DataFrame(rows).set_index("mode").round(4).to_string())
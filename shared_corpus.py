@@ -0,0 +1,199 @@
+import itertools
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+# --- Corpus condiviso tra le sessioni Streamlit --------------------------------
+# Le frasi dello sheet (id, data, testo, riga) si scrivono una volta in un file
+# Arrow IPC e si riaprono in memory-map: i buffer stanno nella page cache, non
+# nell'heap di Python, e sono gli stessi per tutte le sessioni (e per tutti i
+# processi sulla stessa macchina). Le app tengono l'oggetto con st.cache_resource
+# insieme al worksheet e all'header; ogni sessione conserva solo le posizioni
+# delle sue frasi da annotare (int32) e il pointer. All'accesso di un annotatore
+# si legge dallo sheet solo la sua colonna.
+DEFAULT_DIR = os.environ.get("CORPUS_ARROW_DIR", os.path.expanduser("~/.cache/linguistica/corpus"))
+COLUMNS = ["id", "date", "sentence", "__sheet_row"]
+_VERSIONS = itertools.count(1)
+
+
+def corpus_path(sheet_name: str, directory: str = DEFAULT_DIR) -> str:
+    return os.path.join(directory, f"{sheet_name.lower().replace(' ', '_')}.arrow")
+
+
+def write_arrow(values: list, path: str) -> None:
+    # values: come ws.get_all_values() (header + righe)
+    import pyarrow as pa
+    header, rows = values[0], values[1:]
+    lower = [h.lower() for h in header]
+
+    def column(name):
+        j = lower.index(name) if name in lower else None
+        return [r[j] if j is not None and j < len(r) else "" for r in rows]
+
+    ids = pd.to_numeric(pd.Series(column("id")), errors="coerce") if "id" in lower else pd.Series(range(len(rows)))
+    table = pa.table({
+        "id": pa.array(ids.fillna(-1).astype(np.int64).to_numpy()),
+        "date": pa.array(pd.to_datetime(pd.Series(column("date")), errors="coerce"), type=pa.timestamp("s")),
+        "sentence": pa.array(column("sentence"), type=pa.string()),
+        "__sheet_row": pa.array(np.arange(2, len(rows) + 2, dtype=np.int32)),
+    })
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path)   # chi ha già il file in memory-map continua a leggere il vecchio
+
+
+class SharedCorpus:
+
+    def __init__(self, ws, path: str, values: list = None):
+        import pyarrow as pa
+        self.ws = ws
+        values = values if values is not None else ws.get_all_values()
+        self.header = list(values[0])
+        write_arrow(values, path)
+        self.path = path
+        self.table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        # colonne numeriche come viste numpy sui buffer mappati (nessuna copia)
+        self.ids = self.table["id"].to_numpy()
+        self.sheet_rows = self.table["__sheet_row"].to_numpy()
+        self.rank = np.arange(len(self.table), dtype=np.int32)
+        self.lock = threading.Lock()
+        # cambia a ogni rilettura dello sheet: le posizioni salvate nelle sessioni
+        # valgono solo per la versione con cui sono state calcolate
+        self.version = next(_VERSIONS)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def sentences(self) -> list:
+        return self.table["sentence"].to_pylist()
+
+    def set_order(self, order) -> None:
+        # permutazione delle posizioni (diversity_order): rank condiviso
+        rank = np.empty(len(self), dtype=np.int32)
+        rank[np.asarray(order)] = np.arange(len(self), dtype=np.int32)
+        self.rank = rank
+
+    def row(self, pos: int) -> dict:
+        row = {c: self.table[c][int(pos)].as_py() for c in COLUMNS}
+        row["date"] = pd.Timestamp(row["date"]) if row["date"] is not None else pd.NaT
+        return row
+
+    # --- annotatori -------------------------------------------------------------
+    def add_annotator(self, name: str) -> str:
+        # nome canonico (maiuscole come nell'header); se manca, nuova colonna nello
+        # sheet. L'header si rilegge sotto lock: altre sessioni o altri processi
+        # possono aver aggiunto colonne nel frattempo
+        with self.lock:
+            self.header = self.ws.row_values(1)
+            lower = {h.lower(): h for h in self.header}
+            if name.lower() in lower:
+                return lower[name.lower()]
+            if len(self.header) + 1 > self.ws.col_count:
+                self.ws.add_cols(len(self.header) + 1 - self.ws.col_count)
+            self.ws.update_cell(1, len(self.header) + 1, name)
+            self.header.append(name)
+            return name
+
+    def column_number(self, name: str) -> int:
+        return self.header.index(name) + 1
+
+    def todo(self, done_values) -> np.ndarray:
+        # done_values: la colonna dell'annotatore (senza header), anche più corta
+        # del corpus; → posizioni non ancora annotate nell'ordine di annotazione
+        done = np.zeros(len(self), bool)
+        filled = np.asarray([v != "" for v in done_values[:len(self)]], dtype=bool)
+        done[:len(filled)] = filled
+        pos = np.flatnonzero(~done).astype(np.int32)
+        return pos[np.argsort(self.rank[pos], kind="stable")]
+
+    def annotator_todo(self, annotator: str):
+        # una sola lettura (la colonna dell'annotatore) → (posizioni, già annotate)
+        values = self.ws.col_values(self.column_number(annotator))[1:]
+        order = self.todo(values)
+        return order, len(self) - len(order)
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+    import tempfile
+    import tracemalloc
+    # benchmark di memoria: 50 sessioni simulate sullo stesso sheet.
+    #   prima: ogni sessione fa get_all_values (risposta JSON da decodificare) e
+    #          tiene il proprio todo_df, l'header e il worksheet
+    #   dopo:  un SharedCorpus condiviso; la sessione legge la colonna del suo
+    #          annotatore e tiene l'array di posizioni e il pointer
+    # uso: python shared_corpus.py [righe] [sessioni]
+    import pyarrow as pa
+    from text_cleaning import load_concordance
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 3781
+    n_sessions = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    base = load_concordance("concordance_preloaded_trends_it_20250625112515.txt")
+    base = base.iloc[np.arange(n) % len(base)]
+    rng = np.random.default_rng(0)
+    annotators = ["Fabio2", "Monica", "mod4_gpt-4o", "mod4_gpt-4_1", "best_human"]
+    header = ["id", "date", "sentence"] + annotators
+    labels = np.where(rng.random((n, len(annotators))) < 0.3, rng.integers(1, 7, (n, len(annotators))).astype(str), "")
+    raw = [header] + [[str(i), str(d), s] + list(lab) for i, (d, s, lab) in
+                      enumerate(zip(base["date"].astype(str), base["sentence"], labels))]
+    blob = json.dumps(raw)
+    column_blob = json.dumps([r[3] for r in raw])
+
+    class FakeWorksheet:
+        # quel che serve di un worksheet: ogni lettura restituisce oggetti nuovi
+        def get_all_values(self):
+            return json.loads(blob)
+
+        def row_values(self, row):
+            return list(header)
+
+        def col_values(self, col):
+            return json.loads(column_blob)
+
+    def old_session():
+        ws = FakeWorksheet()
+        values = ws.get_all_values()
+        df = pd.DataFrame(values[1:], columns=values[0])
+        df["__sheet_row"] = list(range(2, len(values) + 1))
+        df["id"] = df["id"].astype(int)
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+        done = df[df["Fabio2"] != ""]["id"].tolist()
+        todo = df[~df["id"].isin(done)].sample(frac=1, random_state=42).reset_index(drop=True)
+        return {"todo_df": todo, "ws": ws, "header": values[0], "pointer": 0, "history": []}
+
+    def new_session(corpus):
+        order, done_count = corpus.annotator_todo(corpus.add_annotator("fabio2"))
+        return {"order": order, "done_count": done_count, "pointer": 0, "history": []}
+
+    def retained(make, count):
+        # heap Python (tracemalloc) + memoria Arrow: con pandas 3 le colonne di
+        # testo dei DataFrame stanno in buffer Arrow, invisibili a tracemalloc
+        tracemalloc.start()
+        sessions = []
+        before = tracemalloc.get_traced_memory()[0] + pa.total_allocated_bytes()
+        for _ in range(count):
+            sessions.append(make())
+        after = tracemalloc.get_traced_memory()[0] + pa.total_allocated_bytes()
+        tracemalloc.stop()
+        return (after - before) / count, sessions
+
+    old_kb, _ = retained(old_session, n_sessions)
+    path = os.path.join(tempfile.mkdtemp(), "corpus.arrow")
+    tracemalloc.start()
+    arrow_before = pa.total_allocated_bytes()
+    corpus = SharedCorpus(FakeWorksheet(), path)
+    corpus.set_order(rng.permutation(len(corpus)))
+    corpus_heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    arrow_heap = pa.total_allocated_bytes() - arrow_before
+    new_kb, sessions = retained(lambda: new_session(corpus), n_sessions)
+    row = corpus.row(sessions[0]["order"][0])
+    print(f"{n:,} righe, {n_sessions} sessioni")
+    print(f"  prima: {old_kb / 1024:,.1f} KB per sessione ({old_kb * n_sessions / 2 ** 20:,.1f} MB in tutto)")
+    print(f"  dopo:  {new_kb / 1024:,.1f} KB per sessione ({new_kb * n_sessions / 2 ** 20:,.2f} MB in tutto) "
+          f"+ corpus condiviso una volta: file Arrow in memory-map {os.path.getsize(path) / 2 ** 20:.1f} MB, "
+          f"heap Python {corpus_heap / 1024:,.0f} KB, heap Arrow {arrow_heap / 1024:,.0f} KB")
+    print(f"  frase #{row['id']} (riga {row['__sheet_row']}): {row['sentence'][:60]}...")
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+# --- Colonne di etichetta degli sheet -------------------------------------------
+# Negli sheet convivono annotatori (Fabio, Monica, ...), l'etichetta aggiudicata
+# (best_human) e le colonne dei modelli: mdl.replace(".", "_"), da sola (donna
+# libera: gpt-4_1, ...) o dopo un prefisso (mod4_gpt-4o, mod3_chat_gpt-4o).
+# Regole, active learning e dashboard riconoscono le colonne allo stesso modo.
+ADJUDICATED = "best_human"
+MODELS = ["gpt-4.1", "gpt-4.1-mini", "gpt-4.1-nano", "gpt-4o", "gpt-4o-mini"]
+STATIC_COLUMNS = {"id", "date", "sentence", "year"}
+
+
+def is_model_column(name: str) -> bool:
+    name = name.lower()
+    return name.startswith("mod") or any(name == n or name.endswith("_" + n)
+                                         for n in (mdl.replace(".", "_") for mdl in MODELS))
+
+
+def model_columns(header: list) -> list:
+    return [h for h in header if is_model_column(h)]
+
+
+def annotator_columns(header: list) -> list:
+    return [h for h in header if h.lower() not in STATIC_COLUMNS | {ADJUDICATED} and not is_model_column(h)
+            and not h.startswith("__")]
+
+
+def human_labels(frame: pd.DataFrame, annotators: list) -> pd.Series:
+    # best_human se c'è, altrimenti l'etichetta su cui concordano tutti gli
+    # annotatori presenti; 0 = non annotata o in disaccordo non aggiudicato
+    codes = frame[annotators].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float).reshape(len(frame), -1)
+    present = ~np.isnan(codes)
+    lo = np.where(present, codes, np.inf).min(axis=1, initial=np.inf)
+    hi = np.where(present, codes, -np.inf).max(axis=1, initial=-np.inf)
+    label = np.where(present.any(axis=1) & (lo == hi), lo, 0)
+    if ADJUDICATED in frame.columns:
+        best = pd.to_numeric(frame[ADJUDICATED], errors="coerce").to_numpy(dtype=float)
+        label = np.where(np.isnan(best), label, best)
+    return pd.Series(label.astype(np.int8), index=frame["id"].astype(str).to_numpy())
@@ -0,0 +1,226 @@
+import os
+import sqlite3
+import threading
+import time
+import pandas as pd
+
+# --- Configurazione ---------------------------------------------------------
+# Tutti i processi (app Streamlit, classificatori, analisi) usano lo stesso
+# service account e quindi la stessa quota di Google Sheets (60 richieste al
+# minuto per utente): un unico token bucket condiviso su SQLite li coordina.
+DEFAULT_DB_PATH = os.environ.get(
+    "SHEETS_QUOTA_DB", os.path.expanduser("~/.cache/linguistica/sheets_quota.sqlite")
+)
+REQUESTS_PER_MINUTE = 60
+BURST = 10
+
+# priorità: numero più basso = servito prima
+INTERACTIVE = 0   # salvataggi degli annotatori
+ANALYSIS    = 1   # script di analisi
+BATCH       = 2   # scritture dei classificatori
+
+# ogni processo in coda rinnova l'heartbeat almeno ogni HEARTBEAT_S (anche
+# durante l'attesa dei token o di un 429); dopo tre heartbeat mancati il processo
+# è considerato morto ed esce dalla coda, così non blocca gli altri
+HEARTBEAT_S = 1.0
+STALE_WAITER_S = 3 * HEARTBEAT_S
+MIN_POLL_S = 0.05
+MAX_RETRIES = 5
+
+# chiamate di gspread.Worksheet che consumano quota
+SHEETS_CALLS = {
+    "acell", "add_cols", "add_rows", "append_row", "append_rows", "batch_clear",
+    "batch_get", "batch_update", "cell", "clear", "col_values", "delete_rows",
+    "find", "findall", "format", "get", "get_all_records", "get_all_values",
+    "get_values", "insert_row", "insert_rows", "resize", "row_values", "update",
+    "update_acell", "update_cell", "update_cells",
+}
+
+
+class SheetsQuotaGovernor:
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, rate_per_minute: float = REQUESTS_PER_MINUTE,
+                 capacity: float = BURST, bucket: str = "gcp_service_account",
+                 clock=time.time, sleep=time.sleep):
+        self.path = path
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.bucket = bucket
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS bucket (name TEXT PRIMARY KEY, tokens REAL, updated REAL);
+            CREATE TABLE IF NOT EXISTS waiters (id INTEGER PRIMARY KEY AUTOINCREMENT, bucket TEXT,
+                                                priority INTEGER, enqueued REAL, heartbeat REAL);
+            CREATE TABLE IF NOT EXISTS waits (ts REAL, bucket TEXT, pid INTEGER, priority INTEGER,
+                                              op TEXT, wait_s REAL);
+        """)
+
+    # --- token bucket -------------------------------------------------------
+    def _refill(self, now: float) -> float:
+        row = self._conn.execute("SELECT tokens, updated FROM bucket WHERE name = ?",
+                                 (self.bucket,)).fetchone()
+        if row is None:
+            self._conn.execute("INSERT INTO bucket VALUES (?, ?, ?)", (self.bucket, self.capacity, now))
+            return self.capacity
+        tokens, updated = row
+        return min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+
+    def acquire(self, priority: int = BATCH, cost: float = 1.0, op: str = "") -> float:
+        # blocks until this process may issue one Sheets request; returns the wait
+        start = self.clock()
+        waiter_id = None
+        while True:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    now = self.clock()
+                    tokens = self._refill(now)
+                    if waiter_id is None:
+                        waiter_id = self._conn.execute(
+                            "INSERT INTO waiters (bucket, priority, enqueued, heartbeat) VALUES (?, ?, ?, ?)",
+                            (self.bucket, priority, now, now)).lastrowid
+                    else:
+                        self._conn.execute("UPDATE waiters SET heartbeat = ? WHERE id = ?", (now, waiter_id))
+                    self._conn.execute("DELETE FROM waiters WHERE bucket = ? AND heartbeat < ?",
+                                       (self.bucket, now - STALE_WAITER_S))
+                    # solo il primo della coda (priorità, poi ordine d'arrivo) può consumare
+                    first = self._conn.execute(
+                        "SELECT id FROM waiters WHERE bucket = ? ORDER BY priority, enqueued, id LIMIT 1",
+                        (self.bucket,)).fetchone()[0]
+                    granted = first == waiter_id and tokens >= cost
+                    if granted:
+                        tokens -= cost
+                        self._conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+                        self._conn.execute("INSERT INTO waits VALUES (?, ?, ?, ?, ?, ?)",
+                                           (now, self.bucket, os.getpid(), priority, op, now - start))
+                    self._conn.execute("UPDATE bucket SET tokens = ?, updated = ? WHERE name = ?",
+                                       (tokens, now, self.bucket))
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            if granted:
+                return now - start
+            missing = (cost - tokens) / self.rate if first == waiter_id else MIN_POLL_S
+            self.sleep(min(HEARTBEAT_S, max(MIN_POLL_S, missing)))
+
+    def penalize(self, seconds: float) -> None:
+        # dopo un 429 tutti i processi si fermano per retry-after secondi
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            now = self.clock()
+            tokens = min(self._refill(now), -seconds * self.rate)
+            self._conn.execute("UPDATE bucket SET tokens = ?, updated = ? WHERE name = ?",
+                               (tokens, now, self.bucket))
+            self._conn.execute("COMMIT")
+
+    # --- metriche -------------------------------------------------------------
+    def wait_stats(self, since: float = None) -> pd.DataFrame:
+        # attese per priorità: numero di richieste, media, p50/p95/p99 e massimo
+        df = pd.read_sql_query("SELECT * FROM waits WHERE bucket = ? AND ts >= ?", self._conn,
+                               params=(self.bucket, since or 0.0))
+        if df.empty:
+            return pd.DataFrame(columns=["requests", "mean_s", "p50_s", "p95_s", "p99_s", "max_s"])
+        g = df.groupby("priority")["wait_s"]
+        return pd.DataFrame({
+            "requests": g.size(), "mean_s": g.mean(), "p50_s": g.quantile(0.5),
+            "p95_s": g.quantile(0.95), "p99_s": g.quantile(0.99), "max_s": g.max(),
+        })
+
+    def export_waits(self, path: str, since: float = None) -> None:
+        pd.read_sql_query("SELECT * FROM waits WHERE bucket = ? AND ts >= ?", self._conn,
+                          params=(self.bucket, since or 0.0)).to_csv(path, index=False)
+
+
+# --- Worksheet con quota -----------------------------------------------------
+def _retry_after(exc) -> float:
+    response = getattr(exc, "response", None)
+    if response is None or getattr(response, "status_code", None) != 429:
+        return None
+    try:
+        return float(response.headers.get("Retry-After", 60))
+    except (TypeError, ValueError):
+        return 60.0
+
+
+def spreadsheet_update_time(ws):
+    # lastUpdateTime del file (metadati Drive/Sheets); None se non disponibile
+    spreadsheet = getattr(ws, "spreadsheet", None)
+    if spreadsheet is None:
+        return None
+    try:
+        if hasattr(spreadsheet, "get_lastUpdateTime"):
+            return spreadsheet.get_lastUpdateTime()
+        return spreadsheet.lastUpdateTime
+    except Exception:
+        return None
+
+
+class GovernedWorksheet:
+    # proxy of gspread.Worksheet: every Sheets call waits for a token first,
+    # a 429 stops all processes for retry-after seconds and retries the call
+
+    def __init__(self, ws, governor: SheetsQuotaGovernor, priority: int):
+        self._ws = ws
+        self._governor = governor
+        self._priority = priority
+
+    def __getattr__(self, name):
+        attr = getattr(self._ws, name)
+        if name not in SHEETS_CALLS or not callable(attr):
+            return attr
+
+        def governed_call(*args, **kwargs):
+            for attempt in range(MAX_RETRIES):
+                self._governor.acquire(self._priority, op=name)
+                try:
+                    return attr(*args, **kwargs)
+                except Exception as exc:
+                    wait = _retry_after(exc)
+                    if wait is None or attempt == MAX_RETRIES - 1:
+                        raise
+                    self._governor.penalize(wait)
+        return governed_call
+
+    def last_update_time(self):
+        # anche la lettura dei metadati del file consuma quota
+        self._governor.acquire(self._priority, op="lastUpdateTime")
+        return spreadsheet_update_time(self._ws)
+
+
+_governor = None
+
+
+def get_governor() -> SheetsQuotaGovernor:
+    global _governor
+    if _governor is None:
+        _governor = SheetsQuotaGovernor()
+    return _governor
+
+
+def open_worksheet(gc, sheet_name: str, priority: int = BATCH) -> GovernedWorksheet:
+    # sostituisce gc.open(SHEET_NAME).sheet1 negli script e nelle app
+    governor = get_governor()
+    governor.acquire(priority, op="open")
+    return GovernedWorksheet(gc.open(sheet_name).sheet1, governor, priority)
+
+
+if __name__ == "__main__":
+    import sys
+    # uso: python sheets_quota.py [ultimi_minuti] [export.csv]
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 60
+    governor = get_governor()
+    since = time.time() - minutes * 60
+    names = {INTERACTIVE: "interactive", ANALYSIS: "analysis", BATCH: "batch"}
+    stats = governor.wait_stats(since)
+    stats.index = [names.get(p, p) for p in stats.index]
+    print(f"Attese per la quota Sheets negli ultimi {minutes:g} minuti:")
+    print(stats.round(3))
+    if len(sys.argv) > 2:
+        governor.export_waits(sys.argv[2], since)
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import zlib
+from itertools import combinations
+import numpy as np
+import pandas as pd
+
+from text_cleaning import normalized_key
+
+# --- Configurazione ---------------------------------------------------------
+SPLIT_SALT = "split-v1"
+LEDGER_COLUMNS = ["content_id", "date", "split"]
+UNASSIGNED = "pool"
+
+# MinHash/LSH per il controllo dei quasi-duplicati tra split
+SHINGLE_WORDS = 5
+NUM_PERM = 64
+LSH_BANDS = 16
+_MINHASH_PRIME = np.uint64(4294967311)  # primo > 2**32
+
+
+# --- ID stabili e bucket di hash -------------------------------------------
+# SipHash-2-4 a 64 bit di pandas (hash_pandas_object, chiave fissa): vettoriale
+# in C e stabile tra versioni. I ledger scritti con i vecchi ID blake2b vanno
+# rigenerati dalle esportazioni (seed_ledger).
+_HEX = np.array(list("0123456789abcdef"))
+_NIBBLE_SHIFTS = np.arange(60, -4, -4).astype(np.uint64)
+
+
+def _hash64(values, hash_key: str = None) -> np.ndarray:
+    kwargs = {"hash_key": hash_key} if hash_key is not None else {}
+    values = pd.Series(values if isinstance(values, pd.Series) else list(values), dtype="string")
+    return pd.util.hash_pandas_object(values, index=False, **kwargs).to_numpy()
+
+
+def content_ids(keys) -> pd.Series:
+    # the ID only depends on the normalized text, never on row position
+    digits = _HEX[(_hash64(keys)[:, None] >> _NIBBLE_SHIFTS) & np.uint64(15)]
+    return pd.Series(np.ascontiguousarray(digits).view("<U16").ravel(),
+                     index=keys.index if isinstance(keys, pd.Series) else None, dtype="string")
+
+
+def split_bucket(ids, salt: str = SPLIT_SALT) -> np.ndarray:
+    # uniform value in [0, 1) for every content ID; the salt becomes the 16-byte SipHash key
+    key = hashlib.md5(salt.encode("utf-8")).hexdigest()[:16]
+    return _hash64(ids, key).astype(np.float64) / 2.0 ** 64
+
+
+def _thresholds(fractions: dict):
+    edges, acc = [], 0.0
+    for name, frac in fractions.items():
+        acc += frac
+        edges.append((acc, name))
+    if acc > 1.0 + 1e-9:
+        raise ValueError("Le frazioni degli split superano 1")
+    return edges
+
+
+def _split_from_bucket(buckets: np.ndarray, fractions: dict) -> np.ndarray:
+    out = np.full(len(buckets), UNASSIGNED, dtype=object)
+    lower = 0.0
+    for upper, name in _thresholds(fractions):
+        out[(buckets >= lower) & (buckets < upper)] = name
+        lower = upper
+    return out
+
+
+# --- Registro degli split (ledger) -----------------------------------------
+def load_ledger(path: str) -> pd.DataFrame:
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=LEDGER_COLUMNS)
+    ledger = pd.read_csv(path, dtype=str, encoding="utf-8")
+    # righe "pool" di versioni precedenti: non sono assegnate, restano candidabili
+    return ledger[ledger["split"] != UNASSIGNED].reset_index(drop=True)
+
+
+def append_ledger(new_rows: pd.DataFrame, path: str) -> None:
+    # append-only: rows already in the ledger are never rewritten
+    if new_rows.empty:
+        return
+    new_rows[LEDGER_COLUMNS].to_csv(path, mode="a", index=False, encoding="utf-8",
+                                    header=not os.path.exists(path))
+
+
+def seed_ledger(csv_by_split: dict) -> pd.DataFrame:
+    # recupera l'assegnazione delle esportazioni CSV già annotate
+    frames = []
+    for split, path in csv_by_split.items():
+        if not os.path.exists(path):
+            continue
+        df = pd.read_csv(path, encoding="utf-8")
+        frames.append(pd.DataFrame({
+            "content_id": content_ids(normalized_key(df["sentence"].astype(str))).to_numpy(),
+            "date": df["date"].astype(str).to_numpy(),
+            "split": split,
+        }))
+    if not frames:
+        return pd.DataFrame(columns=LEDGER_COLUMNS)
+    return pd.concat(frames, ignore_index=True).drop_duplicates("content_id")
+
+
+def assign_splits(df: pd.DataFrame, fractions: dict, ledger: pd.DataFrame = None,
+                  stratify_by_year: bool = False, salt: str = SPLIT_SALT) -> pd.DataFrame:
+    # returns ledger rows for the sentences of df that are not in the ledger yet
+    # and fall into a split; df needs "content_id" and "date", the work is O(new rows).
+    # The pool stays out of the append-only ledger, so later runs can still
+    # draw from it when the per-year quotas grow
+    known = set(ledger["content_id"]) if ledger is not None and not ledger.empty else set()
+    new = df.loc[~df["content_id"].isin(known), ["content_id", "date"]].drop_duplicates("content_id")
+    new = new.assign(date=new["date"].astype(str))
+    buckets = split_bucket(new["content_id"], salt)
+    if not stratify_by_year:
+        new = new.assign(split=_split_from_bucket(buckets, fractions))
+        return new[new["split"] != UNASSIGNED].reset_index(drop=True)
+
+    # stratificato: per ogni anno riempi le quote mancanti con i nuovi ID in
+    # ordine di hash, così le proporzioni restano esatte e nessuno si sposta
+    new = new.assign(_bucket=buckets, _year=new["date"].str[:4], split=UNASSIGNED)
+    old = ledger if ledger is not None and not ledger.empty else pd.DataFrame(columns=LEDGER_COLUMNS)
+    old_counts = old.assign(_year=old["date"].astype(str).str[:4]).groupby(["_year", "split"]).size()
+    out = []
+    for year, grp in new.groupby("_year", sort=False):
+        grp = grp.sort_values("_bucket")
+        n_year = len(grp) + int(old_counts.get(year, pd.Series(dtype=int)).sum())
+        labels = np.full(len(grp), UNASSIGNED, dtype=object)
+        start = 0
+        for name, frac in fractions.items():
+            have = int(old_counts.get((year, name), 0))
+            take = max(0, min(len(grp) - start, round(frac * n_year) - have))
+            labels[start:start + take] = name
+            start += take
+        out.append(grp.assign(split=labels)[labels != UNASSIGNED])
+    return pd.concat(out)[LEDGER_COLUMNS].reset_index(drop=True) if out \
+        else pd.DataFrame(columns=LEDGER_COLUMNS)
+
+
+# --- Controllo leakage con quasi-duplicati (MinHash + LSH) -----------------
+def minhash_signatures(keys, num_perm: int = NUM_PERM, k: int = SHINGLE_WORDS, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 32, num_perm, dtype=np.uint64)
+    b = rng.integers(0, 2 ** 32, num_perm, dtype=np.uint64)
+    sigs = np.empty((len(keys), num_perm), dtype=np.uint64)
+    for i, key in enumerate(keys):
+        words = str(key).split()
+        shingles = {" ".join(words[j:j + k]) for j in range(max(1, len(words) - k + 1))}
+        h = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64)
+        sigs[i] = ((np.outer(h, a) + b) % _MINHASH_PRIME).min(axis=0)
+    return sigs
+
+
+def find_leaks(df: pd.DataFrame, split_col: str = "split", key_col: str = "key",
+               threshold: float = 0.8, bands: int = LSH_BANDS) -> pd.DataFrame:
+    # coppie di frasi quasi identiche finite in split diversi
+    df = df[df[split_col] != UNASSIGNED].reset_index(drop=True)
+    sigs = minhash_signatures(df[key_col].tolist())
+    rows = sigs.shape[1] // bands
+    splits = df[split_col].to_numpy()
+    candidates = set()
+    mix = np.random.default_rng(2).integers(1, 2 ** 63, rows, dtype=np.uint64)
+    for band in range(bands):
+        band_hash = (sigs[:, band * rows:(band + 1) * rows] * mix).sum(axis=1)
+        for members in pd.Series(np.arange(len(df))).groupby(band_hash).groups.values():
+            if len(members) < 2:
+                continue
+            for i, j in combinations(members, 2):
+                if splits[i] != splits[j]:
+                    candidates.add((min(i, j), max(i, j)))
+    pairs = []
+    for i, j in candidates:
+        sim = float((sigs[i] == sigs[j]).mean())
+        if sim >= threshold:
+            pairs.append({"content_id_a": df.at[i, "content_id"], "split_a": splits[i],
+                          "content_id_b": df.at[j, "content_id"], "split_b": splits[j],
+                          "similarity": sim,
+                          "sentence_a": df.at[i, key_col], "sentence_b": df.at[j, key_col]})
+    return pd.DataFrame(pairs).sort_values("similarity", ascending=False) if pairs \
+        else pd.DataFrame(columns=["content_id_a", "split_a", "content_id_b", "split_b", "similarity"])
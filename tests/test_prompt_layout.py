@@ -0,0 +1,44 @@
+import os
+
+from prompt_layout import (CACHE_MIN_TOKENS, CHECK_SENTENCES, PromptLayout, check, fingerprints,
+                           prompts_from_script, schedule)
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = [os.path.join(HERE, name) for name in (
+    "Classifier Test data Donna disponibile.py", "Classifier Training Data Donna libera.py",
+    "classifier Training Data Donna Disponibile.py")]
+
+
+def test_scripts_define_system_prompts():
+    for path in SCRIPTS:
+        assert prompts_from_script(path), path
+
+
+def test_rendering_is_identical_across_processes():
+    # stessi byte con PYTHONHASHSEED diversi (sottoprocessi) e prefisso statico
+    # identico per frasi diverse
+    assert check(SCRIPTS)
+
+
+def test_rendering_is_stable_within_a_process():
+    assert fingerprints(SCRIPTS) == fingerprints(SCRIPTS)
+
+
+def test_sentence_is_the_only_varying_suffix():
+    layout = PromptLayout("Classifica la frase.\r\nRispondi con un intero.", "mod")
+    a, b = (layout.render(s) for s in CHECK_SENTENCES)
+    cut = a.index(b'{"role":"user"')
+    assert a[:cut] == b[:cut]
+    assert b"\\r\\n" not in a[:cut]
+
+
+def test_short_prompt_is_not_cacheable():
+    assert not PromptLayout("Classifica la frase.", "mod").cacheable
+    assert PromptLayout("parola " * (CACHE_MIN_TOKENS * 2), "mod").cacheable
+
+
+def test_schedule_keeps_each_model_consecutive_within_a_block():
+    calls = list(schedule(range(5), ["a", "b"], block_size=2))
+    assert calls == [("a", 0), ("a", 1), ("b", 0), ("b", 1),
+                     ("a", 2), ("a", 3), ("b", 2), ("b", 3),
+                     ("a", 4), ("b", 4)]
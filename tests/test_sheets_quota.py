@@ -0,0 +1,95 @@
+import pytest
+
+from sheets_quota import (SheetsQuotaGovernor, INTERACTIVE, ANALYSIS, BATCH, HEARTBEAT_S, STALE_WAITER_S)
+
+
+class FakeClock:
+    # tempo simulato: sleep avanza l'orologio e chiama on_sleep (l'"altro processo")
+
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+        self.on_sleep = None
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+        if self.on_sleep is not None:
+            self.on_sleep(self.now)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def governor(tmp_path, clock):
+    return SheetsQuotaGovernor(str(tmp_path / "quota.sqlite"), rate_per_minute=60, capacity=2,
+                               clock=clock, sleep=clock.sleep)
+
+
+def add_waiter(governor, priority: int, at: float) -> int:
+    # un waiter di un altro processo, inserito direttamente nella coda condivisa
+    return governor._conn.execute(
+        "INSERT INTO waiters (bucket, priority, enqueued, heartbeat) VALUES (?, ?, ?, ?)",
+        (governor.bucket, priority, at, at)).lastrowid
+
+
+def waiters(governor) -> list:
+    return [r[0] for r in governor._conn.execute("SELECT id FROM waiters ORDER BY id")]
+
+
+def test_burst_then_rate(governor, clock):
+    assert governor.acquire(BATCH) == 0
+    assert governor.acquire(BATCH) == 0
+    # bucket vuoto: il terzo aspetta un token (1 al secondo)
+    assert governor.acquire(BATCH) == pytest.approx(1.0)
+    assert waiters(governor) == []
+
+
+def test_higher_priority_waiter_is_served_first(governor, clock):
+    other = add_waiter(governor, INTERACTIVE, clock.now)
+    served_at = clock.now + 2.0
+
+    def other_process(now):
+        # processo vivo: rinnova l'heartbeat finché non viene servito
+        if now >= served_at:
+            governor._conn.execute("DELETE FROM waiters WHERE id = ?", (other,))
+        else:
+            governor._conn.execute("UPDATE waiters SET heartbeat = ? WHERE id = ?", (now, other))
+
+    clock.on_sleep = other_process
+    # ci sono token, ma la richiesta interattiva in coda passa prima del batch
+    assert governor.acquire(BATCH) == pytest.approx(2.0, abs=HEARTBEAT_S)
+    assert waiters(governor) == []
+
+
+def test_lower_priority_waiter_does_not_block(governor, clock):
+    add_waiter(governor, BATCH, clock.now)
+    assert governor.acquire(INTERACTIVE) == 0
+
+
+def test_equal_priority_is_first_come_first_served(governor, clock):
+    other = add_waiter(governor, ANALYSIS, clock.now - 1.0)
+    clock.on_sleep = lambda now: governor._conn.execute("DELETE FROM waiters WHERE id = ?", (other,))
+    assert governor.acquire(ANALYSIS) > 0
+
+
+def test_dead_waiter_is_pruned_after_missed_heartbeats(governor, clock):
+    # processo morto in testa alla coda: nessun heartbeat dopo l'ingresso
+    add_waiter(governor, INTERACTIVE, clock.now)
+    wait = governor.acquire(BATCH)
+    assert STALE_WAITER_S <= wait <= STALE_WAITER_S + HEARTBEAT_S
+    assert waiters(governor) == []
+
+
+def test_waiting_process_keeps_heartbeating_through_a_penalty(governor, clock):
+    # dopo un 429 con retry-after lungo si dorme a passi di HEARTBEAT_S, così
+    # chi aspetta non viene scambiato per un processo morto
+    governor.penalize(30.0)
+    assert governor.acquire(BATCH) == pytest.approx(31.0)
+    assert max(clock.sleeps) <= HEARTBEAT_S
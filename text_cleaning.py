@@ -0,0 +1,211 @@
+import re
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # fallback: pandas' Python string methods (slower)
+    pa = None
+    pc = None
+
+# --- Tabella di riparazione mojibake -----------------------------------------
+# The exports were decoded as cp1252/latin-1 (and once as cp1251) instead of
+# UTF-8, sometimes with a further NFKC pass on top (e.g. "è" → "Ã¨" → "Ã ̈").
+REPAIRABLE_CHARS = (
+    "àèéìòùÀÈÉÌÒÙáíóúÁÍÓÚâêîôûçñäëïöüß"
+    "’‘“”„–—…«»°€•\xa0"
+)
+MOJIBAKE_LEADS = "ÃÂâÅÐГ"
+
+
+def _wrong_decode(ch: str, encoding: str) -> str:
+    # decode the UTF-8 bytes of ch with the wrong codec, dropping undefined bytes
+    out = []
+    for b in ch.encode("utf-8"):
+        try:
+            out.append(bytes([b]).decode(encoding))
+        except UnicodeDecodeError:
+            pass
+    return "".join(out)
+
+
+def _build_mojibake_table():
+    table = {}
+    for ch in REPAIRABLE_CHARS:
+        for enc in ("cp1252", "latin-1", "cp1251"):
+            bad = _wrong_decode(ch, enc)
+            variants = [bad]
+            if enc != "cp1251":
+                variants.append(unicodedata.normalize("NFKC", bad))
+            for variant in variants:
+                if len(variant) > 1 and variant[0] in MOJIBAKE_LEADS:
+                    # "Ã\xa0" (= "à") became "Ã ": keep the space, "à" is word-final in Italian
+                    fixed = ch + " " if variant[-1].isspace() and ch.isalpha() else ch
+                    table.setdefault(variant, fixed)
+    # varianti osservate nelle esportazioni che non seguono lo schema sopra
+    table["â€|"] = "…"
+    table['â€"'] = "–"
+    table["â€~"] = "‘"
+    table['Â"'] = '"'
+    # longest first, so that "Ã ̈" wins over "Ã "
+    return sorted(table.items(), key=lambda kv: len(kv[0]), reverse=True)
+
+
+MOJIBAKE_TABLE = _build_mojibake_table()
+MOJIBAKE_RE2 = "[" + MOJIBAKE_LEADS + "]"
+
+# corpus markup: <s>/</s> separate sentences, <coll> marks the query hit
+MARKUP_REPLACEMENTS = [("<s>", " "), ("</s>", " "), ("<coll>", ""), ("</coll>", "")]
+# NFC only changes rows with combining marks (or the few NFC singletons)
+NEEDS_NFC_RE2 = r"[\x{0300}-\x{036F}\x{2126}\x{212A}\x{212B}]"
+# RE2's \s is ASCII only, so list the Unicode separators explicitly; single
+# spaces are left alone, which keeps the number of replacements small
+_OTHER_WS = r"\t\n\v\f\r\x{0085}\x{00A0}\x{1680}\x{2000}-\x{200A}\x{2028}\x{2029}\x{202F}\x{205F}\x{3000}"
+WHITESPACE_RE2 = f"[ {_OTHER_WS}]{{2,}}|[{_OTHER_WS}]"
+CONCORDANCE_LINE_RE = r"^(\d{4}-\d{2}-\d{2})\s*\|\s*(.+)$"
+CONCORDANCE_PREFIX_RE = r"^\d{4}-\d{2}-\d{2}\s*\|\s*"
+CHUNK_ROWS = 65_536
+
+
+# --- Kernels ----------------------------------------------------------------
+def _to_arrow(values):
+    if not isinstance(values, (pa.Array, pa.ChunkedArray)):
+        values = pa.array(values, type=pa.string(), from_pandas=True)
+    if isinstance(values, pa.Array):
+        values = pa.chunked_array([values])
+    return values
+
+
+def _apply_where(arr, mask, fn):
+    # run fn only on the rows selected by mask and splice the result back
+    if not pc.any(mask).as_py():
+        return arr
+    fixed = fn(pc.filter(arr, mask))
+    return pc.replace_with_mask(arr, mask, fixed)
+
+
+def _repair_mojibake(bad):
+    for pattern, repl in MOJIBAKE_TABLE:
+        bad = pc.replace_substring(bad, pattern, repl)
+    return bad
+
+
+def _clean_chunk(arr):
+    arr = _apply_where(arr, pc.fill_null(pc.match_substring_regex(arr, MOJIBAKE_RE2), False),
+                       _repair_mojibake)
+    for pattern, repl in MARKUP_REPLACEMENTS:
+        arr = pc.replace_substring(arr, pattern, repl)
+    arr = _apply_where(arr, pc.fill_null(pc.match_substring_regex(arr, NEEDS_NFC_RE2), False),
+                       lambda a: pc.utf8_normalize(a, form="NFC"))
+    arr = pc.replace_substring_regex(arr, WHITESPACE_RE2, " ")
+    return pc.utf8_trim_whitespace(arr)
+
+
+def _clean_arrow(arr):
+    # Arrow kernels release the GIL: clean fixed-size slices on a thread pool
+    arr = arr.combine_chunks()
+    slices = [arr.slice(i, CHUNK_ROWS) for i in range(0, len(arr), CHUNK_ROWS)] or [arr]
+    with ThreadPoolExecutor(max_workers=pa.cpu_count()) as pool:
+        return pa.chunked_array(list(pool.map(_clean_chunk, slices)), type=pa.string())
+
+
+def _clean_pandas(s: pd.Series) -> pd.Series:
+    s = s.astype("string")
+    damaged = s.str.contains(MOJIBAKE_RE2, regex=True, na=False)
+    if damaged.any():
+        bad = s[damaged]
+        for pattern, repl in MOJIBAKE_TABLE:
+            bad = bad.str.replace(pattern, repl, regex=False)
+        s = s.mask(damaged, bad)
+    for pattern, repl in MARKUP_REPLACEMENTS:
+        s = s.str.replace(pattern, repl, regex=False)
+    s = s.str.normalize("NFC")
+    s = s.str.replace(r"\s+", " ", regex=True)
+    return s.str.strip()
+
+
+# --- API pubblica -----------------------------------------------------------
+def clean_text(values) -> pd.Series:
+    # mojibake repair → markup removal → NFC → whitespace collapse, one column at a time
+    index = values.index if isinstance(values, pd.Series) else None
+    if pc is None:
+        return _clean_pandas(pd.Series(values, index=index))
+    out = _clean_arrow(_to_arrow(values))
+    return pd.Series(pd.arrays.ArrowStringArray(out), index=index,
+                     name=getattr(values, "name", None))
+
+
+def normalized_key(values) -> pd.Series:
+    # chiave usata per dedup e matching: testo pulito, minuscolo
+    return clean_text(values).str.lower()
+
+
+def clean_frame(df: pd.DataFrame, column: str = "sentence") -> pd.DataFrame:
+    df = df.copy()
+    df[column] = clean_text(df[column])
+    df["key"] = df[column].str.lower()
+    return df
+
+
+def load_concordance(path: str) -> pd.DataFrame:
+    # parsifica l'esportazione "YYYY-MM-DD | testo..." senza loop per riga
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    date, body = split_concordance_lines(lines)
+    return clean_frame(pd.DataFrame({"date": date, "sentence": body}))
+
+
+def split_concordance_lines(lines):
+    # (date, raw text) for every "YYYY-MM-DD | ..." line; header lines are dropped
+    if pc is None:
+        parts = pd.Series(lines, dtype="string").str.strip().str.extract(CONCORDANCE_LINE_RE).dropna()
+        return parts[0].tolist(), parts[1]
+    arr = pc.utf8_trim_whitespace(_to_arrow(lines).combine_chunks())
+    arr = pc.filter(arr, pc.match_substring_regex(arr, CONCORDANCE_PREFIX_RE + "."))
+    date = pc.utf8_slice_codeunits(arr, 0, 10)
+    body = pc.replace_substring_regex(arr, CONCORDANCE_PREFIX_RE, "", max_replacements=1)
+    return date.to_pylist(), body
+
+
+# --- Benchmark: loop per riga attuale vs pipeline vettoriale ---------------
+def _legacy_clean(lines):
+    # replica del loop nei file "Create Database" + normalize()
+    out = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        m = re.match(r'^(\d{4}-\d{2}-\d{2})\s*\|\s*(.+)$', line)
+        if m:
+            date_str, sentence = m.groups()
+            sentence = re.sub(r"</?s>", " ", sentence)
+            sentence = re.sub(r"</?coll>", "", sentence)
+            out.append(re.sub(r"\s+", " ", sentence.strip()).strip())
+    return out
+
+
+if __name__ == "__main__":
+    import sys
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    seed = pd.read_csv("rest_sentences_libera.csv")["sentence"].astype(str)
+    seed = seed.radd("2021-01-01 | <coll>donna</coll> <coll>libera</coll> </s><s> ")
+    lines = seed.sample(n=n_rows, replace=True, random_state=0).tolist()
+    print(f"Benchmark su {n_rows:,} frasi")
+
+    t0 = time.perf_counter()
+    legacy = _legacy_clean(lines)
+    t_legacy = time.perf_counter() - t0
+    print(f"  loop per riga (re.sub):  {t_legacy:7.2f} s")
+
+    t0 = time.perf_counter()
+    _, body = split_concordance_lines(lines)
+    cleaned = clean_text(body)
+    key = cleaned.str.lower()
+    t_vec = time.perf_counter() - t0
+    print(f"  pipeline vettoriale:     {t_vec:7.2f} s  (x{t_legacy / t_vec:.1f})")
+    print(f"  chiavi uniche: {key.nunique():,} (su {len(set(legacy)):,} col loop)")
+    still_broken = cleaned.str.contains(MOJIBAKE_RE2, regex=True).sum()
+    print(f"  righe con mojibake residuo: {still_broken:,}")
@@ -0,0 +1,261 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from statsmodels.stats.proportion import proportion_confint
+
+# --- Configurazione ---------------------------------------------------------
+# human:     etichetta umana (best_human o annotatore)
+# predicted: voto di maggioranza dei modelli
+# weighted:  distribuzione dei voti dei modelli (somma 1 per frase)
+# Strumento a sé (nessuno script lo importa): si lancia su un export CSV dello
+# sheet, vedi "uso:" in fondo al file. Lo stato resta in <export>_trends.npz: ai
+# lanci successivi si ripiegano solo le righe nuove o cambiate dell'export.
+VARIANTS = ("human", "predicted", "weighted")
+
+
+def month_index(dates) -> np.ndarray:
+    # months since year 0: 2019-03 → 2019*12 + 2
+    d = pd.to_datetime(pd.Series(dates), errors="coerce")
+    return (d.dt.year * 12 + d.dt.month - 1).to_numpy(dtype="float64")
+
+
+def _one_hot(labels, n_classes: int) -> np.ndarray:
+    labels = pd.to_numeric(pd.Series(labels), errors="coerce").to_numpy()
+    out = np.zeros((len(labels), n_classes))
+    ok = ~np.isnan(labels) & (labels >= 1) & (labels <= n_classes)
+    out[np.flatnonzero(ok), labels[ok].astype(int) - 1] = 1.0
+    return out
+
+
+def row_fingerprints(df: pd.DataFrame, cols: list, id_col: str = "id") -> pd.Series:
+    # id → hash a 64 bit di id, data ed etichette (una riga cambiata cambia hash)
+    fp = pd.util.hash_pandas_object(df[cols].astype(str), index=False).to_numpy()
+    return pd.Series(fp, index=df[id_col].astype(str).to_numpy(), dtype="UInt64")
+
+
+def vote_distribution(votes, n_classes: int) -> np.ndarray:
+    # votes: (frasi × modelli) con classi 1..n o NaN; risultato normalizzato per riga
+    votes = pd.DataFrame(votes).apply(pd.to_numeric, errors="coerce").to_numpy()
+    dist = np.zeros((len(votes), n_classes))
+    for c in range(1, n_classes + 1):
+        dist[:, c - 1] = (votes == c).sum(axis=1)
+    totals = dist.sum(axis=1, keepdims=True)
+    return np.divide(dist, totals, out=np.zeros_like(dist), where=totals > 0)
+
+
+# --- Motore di aggregazione -------------------------------------------------
+class TrendAggregator:
+    # per-month × class counts; every sentence remembers its last contribution,
+    # so a changed label is folded in by subtracting the old one (no rescans)
+
+    def __init__(self, n_classes: int, expression: str = ""):
+        self.n_classes = n_classes
+        self.expression = expression
+        self.start_month = None
+        self.counts = {v: np.zeros((0, n_classes)) for v in VARIANTS}
+        self._contrib = {v: {} for v in VARIANTS}
+        # fingerprint delle righe già ripiegate (fold_rows)
+        self.fingerprints = pd.Series(dtype="UInt64")
+
+    # --- aggiornamenti incrementali -----------------------------------------
+    def _ensure_months(self, months: np.ndarray) -> None:
+        months = months[~np.isnan(months)]
+        if months.size == 0:
+            return
+        lo, hi = int(months.min()), int(months.max())
+        if self.start_month is None:
+            self.start_month = lo
+            for v in VARIANTS:
+                self.counts[v] = np.zeros((hi - lo + 1, self.n_classes))
+            return
+        pad_before = max(0, self.start_month - lo)
+        pad_after = max(0, hi - (self.start_month + len(self.counts[VARIANTS[0]]) - 1))
+        if pad_before or pad_after:
+            for v in VARIANTS:
+                self.counts[v] = np.pad(self.counts[v], ((pad_before, pad_after), (0, 0)))
+            self.start_month -= pad_before
+
+    def update(self, variant: str, ids, dates, weights: np.ndarray) -> None:
+        # weights: (n, n_classes); a zero row removes the sentence from the counts
+        ids = list(ids)
+        months = month_index(dates)
+        self._ensure_months(months)
+        counts, contrib = self.counts[variant], self._contrib[variant]
+        old_rows, old_w = [], []
+        new_rows, new_w = [], []
+        for sid, m, w in zip(ids, months, weights):
+            prev = contrib.pop(sid, None)
+            if prev is not None:
+                old_rows.append(prev[0] - self.start_month)
+                old_w.append(prev[1])
+            if not np.isnan(m) and w.any():
+                contrib[sid] = (int(m), w)
+                new_rows.append(int(m) - self.start_month)
+                new_w.append(w)
+        if old_rows:
+            np.subtract.at(counts, np.array(old_rows), np.array(old_w))
+        if new_rows:
+            np.add.at(counts, np.array(new_rows), np.array(new_w))
+
+    def add_human_labels(self, ids, dates, labels) -> None:
+        self.update("human", ids, dates, _one_hot(labels, self.n_classes))
+
+    def add_predictions(self, ids, dates, votes) -> None:
+        dist = vote_distribution(votes, self.n_classes)
+        # maggioranza; in caso di parità vince la classe più bassa
+        majority = np.where(dist.any(axis=1), dist.argmax(axis=1) + 1, np.nan)
+        self.update("predicted", ids, dates, _one_hot(majority, self.n_classes))
+        self.update("weighted", ids, dates, dist)
+
+    def add_sheet_rows(self, df: pd.DataFrame, human_col: str, model_cols: list,
+                       id_col: str = "id", date_col: str = "date") -> None:
+        ids = df[id_col].astype(str).tolist()
+        if human_col in df.columns:
+            self.add_human_labels(ids, df[date_col], df[human_col])
+        cols = [c for c in model_cols if c in df.columns]
+        if cols:
+            self.add_predictions(ids, df[date_col], df[cols])
+
+    def fold_rows(self, df: pd.DataFrame, human_col: str, model_cols: list,
+                  id_col: str = "id", date_col: str = "date") -> int:
+        # ripiega solo le righe nuove o cambiate rispetto all'ultimo fold; le righe
+        # sparite dall'export escono dai conteggi. Restituisce le righe toccate
+        df = df.drop_duplicates(id_col, keep="last")
+        cols = [c for c in [id_col, date_col, human_col, *model_cols] if c in df.columns]
+        fp = row_fingerprints(df, cols, id_col)
+        prev = self.fingerprints.reindex(fp.index)
+        changed = prev.ne(fp).fillna(True).to_numpy(dtype=bool)
+        gone = self.fingerprints.index.difference(fp.index)
+        if len(gone):
+            nan_dates = [None] * len(gone)
+            for v in VARIANTS:
+                self.update(v, gone, nan_dates, np.zeros((len(gone), self.n_classes)))
+        self.add_sheet_rows(df[changed], human_col, model_cols, id_col, date_col)
+        self.fingerprints = fp
+        return int(changed.sum()) + len(gone)
+
+    def merge(self, other: "TrendAggregator") -> "TrendAggregator":
+        # somma di due aggregati disgiunti (es. anni diversi calcolati in parallelo)
+        if other.start_month is None:
+            return self
+        self._ensure_months(np.array([other.start_month, other.start_month + len(other.counts["human"]) - 1],
+                                     dtype=float))
+        offset = other.start_month - self.start_month
+        for v in VARIANTS:
+            self.counts[v][offset:offset + len(other.counts[v])] += other.counts[v]
+            self._contrib[v].update(other._contrib[v])
+        return self
+
+    # --- interrogazioni -----------------------------------------------------
+    def trend(self, variant: str = "human", freq: str = "M", normalize: bool = False) -> pd.DataFrame:
+        counts = self.counts[variant]
+        columns = list(range(1, self.n_classes + 1))
+        if self.start_month is None:
+            return pd.DataFrame(columns=columns, dtype=float)
+        months = np.arange(self.start_month, self.start_month + len(counts))
+        if freq == "Y":
+            years = months // 12
+            index, inverse = np.unique(years, return_inverse=True)
+            out = np.zeros((len(index), self.n_classes))
+            np.add.at(out, inverse, counts)
+            index = pd.Index(index, name="year")
+        else:
+            out = counts
+            index = pd.PeriodIndex.from_fields(year=months // 12, month=months % 12 + 1, freq="M")
+        df = pd.DataFrame(out, index=index, columns=columns)
+        if normalize:
+            df = df.div(df.sum(axis=1).replace(0, np.nan), axis=0)
+        return df
+
+    def confidence_band(self, cls: int, variant: str = "human", freq: str = "M",
+                        alpha: float = 0.05) -> pd.DataFrame:
+        # share of cls per period with a Wilson interval (weighted: effective counts)
+        counts = self.trend(variant, freq)
+        total = counts.sum(axis=1).to_numpy()
+        hits = counts[cls].to_numpy()
+        valid = total > 0
+        low = np.full(len(total), np.nan)
+        high = np.full(len(total), np.nan)
+        if valid.any():
+            low[valid], high[valid] = proportion_confint(hits[valid], total[valid],
+                                                         alpha=alpha, method="wilson")
+        share = np.divide(hits, total, out=np.full(len(total), np.nan), where=valid)
+        return pd.DataFrame({"n": total, "share": share, "low": low, "high": high}, index=counts.index)
+
+    # --- persistenza --------------------------------------------------------
+    def save(self, path: str) -> None:
+        arrays = {"meta": np.array([self.n_classes, -1 if self.start_month is None else self.start_month]),
+                  "expression": np.array(self.expression)}
+        for v in VARIANTS:
+            arrays[f"counts_{v}"] = self.counts[v]
+            contrib = self._contrib[v]
+            arrays[f"ids_{v}"] = np.array(list(contrib.keys()), dtype=str)
+            arrays[f"months_{v}"] = np.array([c[0] for c in contrib.values()], dtype=np.int64)
+            arrays[f"weights_{v}"] = np.array([c[1] for c in contrib.values()]).reshape(-1, self.n_classes)
+        arrays["fp_ids"] = self.fingerprints.index.to_numpy(dtype=str)
+        arrays["fp_values"] = self.fingerprints.to_numpy(dtype=np.uint64)
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "TrendAggregator":
+        data = np.load(path)
+        n_classes, start = (int(x) for x in data["meta"])
+        agg = cls(n_classes, str(data["expression"]))
+        agg.start_month = None if start < 0 else start
+        for v in VARIANTS:
+            agg.counts[v] = data[f"counts_{v}"]
+            agg._contrib[v] = {sid: (int(m), w) for sid, m, w in
+                               zip(data[f"ids_{v}"], data[f"months_{v}"], data[f"weights_{v}"])}
+        if "fp_ids" in data:
+            agg.fingerprints = pd.Series(data["fp_values"], index=data["fp_ids"].astype(str), dtype="UInt64")
+        return agg
+
+
+# --- Rollup paralleli su più anni ed espressioni ---------------------------
+def _rollup_chunk(task):
+    expression, n_classes, df, human_col, model_cols = task
+    agg = TrendAggregator(n_classes, expression)
+    agg.add_sheet_rows(df, human_col, model_cols)
+    return expression, agg
+
+
+def build_rollups(sources: dict, workers: int = None) -> dict:
+    # sources: expression → (DataFrame, n_classes, human_col, model_cols);
+    # each (expression, year) slice is aggregated in its own process, then merged
+    tasks = []
+    for expression, (df, n_classes, human_col, model_cols) in sources.items():
+        years = pd.to_datetime(df["date"], errors="coerce").dt.year
+        for _, chunk in df.groupby(years):
+            tasks.append((expression, n_classes, chunk, human_col, model_cols))
+    result = {expr: TrendAggregator(src[1], expr) for expr, src in sources.items()}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for expression, agg in pool.map(_rollup_chunk, tasks):
+            result[expression].merge(agg)
+    return result
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    # uso: python trends.py export.csv n_classi colonna_umana colonna_modello...
+    # primo lancio: rollup parallelo per anno; poi si riparte da <export>_trends.npz
+    # e si ripiegano solo le righe nuove o cambiate
+    path, n_classes, human_col, *model_cols = sys.argv[1:]
+    state_path = os.path.splitext(path)[0] + "_trends.npz"
+    df = pd.read_csv(path, dtype=str)
+    t0 = time.perf_counter()
+    agg = TrendAggregator.load(state_path) if os.path.exists(state_path) else None
+    if agg is not None and agg.n_classes == int(n_classes):
+        touched = agg.fold_rows(df, human_col, model_cols)
+        print(f"Ripiegate {touched:,} righe nuove o cambiate su {len(df):,} in {time.perf_counter() - t0:.2f} s")
+    else:
+        df = df.drop_duplicates("id", keep="last")
+        agg = build_rollups({"corpus": (df, int(n_classes), human_col, model_cols)})["corpus"]
+        cols = [c for c in ["id", "date", human_col, *model_cols] if c in df.columns]
+        agg.fingerprints = row_fingerprints(df, cols)
+        print(f"Aggregazione di {len(df):,} righe in {time.perf_counter() - t0:.2f} s")
+    agg.save(state_path)
+    for variant in VARIANTS:
+        print(f"\nQuota per classe e anno ({variant}):")
+        print(agg.trend(variant, freq="Y", normalize=True).round(3))